@@ -1 +1,6 @@
-# Django 项目包 
\ No newline at end of file
+# Django 项目包
+
+# 确保 Django 启动时加载 Celery 应用，使 shared_task 使用项目配置
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -0,0 +1,27 @@
+"""
+ASGI config for casho project.
+
+Serves casho.urls_async, where the transaction list, stats, export and
+GraphQL endpoints are async views, e.g.
+
+    gunicorn casho.asgi:application -k uvicorn.workers.UvicornWorker
+"""
+
+import os
+
+import django
+from django.core.handlers.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'casho.settings')
+
+
+class CashoASGIHandler(ASGIHandler):
+    urlconf = 'casho.urls_async'
+
+    async def get_response_async(self, request):
+        request.urlconf = self.urlconf
+        return await super().get_response_async(request)
+
+
+django.setup(set_prefix=False)
+application = CashoASGIHandler()
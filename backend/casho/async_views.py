@@ -0,0 +1,46 @@
+"""
+Async dispatch for DRF views, used by the ASGI deployment (casho/asgi.py).
+
+DRF 3.14 views are synchronous. AsyncAPIViewMixin replaces
+APIView.dispatch with a coroutine that does the same steps, so a view
+that defines ``async def get()`` etc. behaves as it does under WSGI:
+
+* the request setup (authentication, permissions, throttles and any
+  ``initial()`` extensions such as the conditional GET check) reads the
+  cache and database synchronously, so it runs in a worker thread;
+* async handlers run on the event loop and reach the database through
+  Django's async ORM or sync_to_async; sync handlers (e.g. OPTIONS) go
+  to a worker thread.
+
+Exception handling and finalize_response() are unchanged. Both do
+in-memory work only, so they run on the loop.
+"""
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+
+class AsyncAPIViewMixin:
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
@@ -0,0 +1,129 @@
+"""
+Read replica routing.
+
+Writes always go to ``default``. Reads go there too, except:
+
+* inside ``replica_reads()`` blocks (stats computation, the Celery
+  summary and report tasks);
+* querysets pinned with ``.using(read_alias(user_id))`` (the transaction
+  list, export and GraphQL transaction resolvers).
+
+Both send reads to the ``replica`` alias. Replication lags, so a user who
+wrote within REPLICA_READ_AFTER_WRITE_WINDOW seconds keeps reading from
+the primary. After that their reads move to the replica only once it has
+replayed past their last write (pg_last_xact_replay_timestamp()),
+checked at most every REPLICA_LAG_CHECK_INTERVAL seconds per process; a
+replica that lags further behind would otherwise have stale stats cached
+under, and stale lists served with, the user's current data version.
+Writes are recorded by stats_cache on every transaction/category/account
+change. Reads made inside a transaction on the primary also stay there.
+Non-PostgreSQL replicas cannot report their lag and are trusted once the
+window has passed. Under test the replica is a separate database that is
+not a standby (so it reports no lag); tests whose reads can reach it list
+it in ``databases``.
+"""
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+
+_read_alias = ContextVar('read_alias', default=DEFAULT_DB_ALIAS)
+
+
+def _write_key(user_id):
+    return f'db:recent-write:{user_id}'
+
+
+def record_write(user_id):
+    """Note that user_id wrote, so their reads stay on the primary until the replica has it"""
+    cache.set(_write_key(user_id), time.time(), settings.REPLICA_WRITE_STAMP_TIMEOUT)
+
+
+_replay_checked = (0.0, None)
+
+
+def replica_replay_time():
+    """
+    Commit time (unix) of the last transaction the replica has replayed:
+    infinity if REPLICA is not a standby at all, None if it cannot tell
+    """
+    global _replay_checked
+    checked_at, replayed_at = _replay_checked
+    if time.monotonic() - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return replayed_at
+    connection = connections[REPLICA]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_is_in_recovery(), extract(epoch FROM pg_last_xact_replay_timestamp())')
+        in_recovery, replayed_at = cursor.fetchone()
+    if not in_recovery:
+        replayed_at = float('inf')
+    else:
+        # NULL: nothing replayed since the standby started
+        replayed_at = float(replayed_at or 0)
+    _replay_checked = (time.monotonic(), replayed_at)
+    return replayed_at
+
+
+def read_alias(user_id=None):
+    """Database to read from: the replica, unless there is none or it may not have user_id's writes yet"""
+    if REPLICA not in settings.DATABASES:
+        return DEFAULT_DB_ALIAS
+    if user_id is None:
+        return REPLICA
+    written_at = cache.get(_write_key(user_id))
+    if written_at is None:
+        return REPLICA
+    if time.time() - written_at < settings.REPLICA_READ_AFTER_WRITE_WINDOW:
+        return DEFAULT_DB_ALIAS
+    replayed_at = replica_replay_time()
+    if replayed_at is not None and replayed_at < written_at:
+        return DEFAULT_DB_ALIAS
+    return REPLICA
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    """Route reads inside the block to read_alias(user_id)"""
+    token = _read_alias.set(read_alias(user_id))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@asynccontextmanager
+async def areplica_reads(user_id=None):
+    """replica_reads() for async code: read_alias() may query the replica, so it runs in a worker thread"""
+    token = _read_alias.set(await sync_to_async(read_alias)(user_id))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related lookups follow the instance they start from
+            return instance._state.db
+        alias = _read_alias.get()
+        if alias != DEFAULT_DB_ALIAS and connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}:
+            return True
+        return None
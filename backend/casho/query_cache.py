@@ -0,0 +1,216 @@
+"""
+Persisted queries and the parsed/validated document cache for /graphql/.
+
+Persisted queries follow the Apollo "automatic persisted queries"
+protocol: a client sends ``extensions.persistedQuery.sha256Hash`` instead
+of the query text; on a miss it retries with both and the server stores
+the text (in the Django cache, so every worker sees it) for
+CACHE_TIMEOUT seconds. Only signed-in users register queries, at most
+MAX_REGISTRATIONS per REGISTRATION_WINDOW seconds each and none longer
+than MAX_QUERY_LENGTH; a request that may not register is still executed
+from its text, it just is not stored. With
+``ALLOWLIST_ONLY`` only the queries in ``ALLOWLIST_FILE`` (a JSON object
+of operation name -> query text) are executed, by hash or by text, and
+registration is disabled.
+
+The document cache keeps the result of parse() + the standard validation
+rules per query hash, so repeated operations skip both.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from graphql import GraphQLError, parse, validate
+from graphql.validation import specified_rules
+from graphql_jwt.exceptions import JSONWebTokenError
+
+PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound'
+PERSISTED_QUERY_NOT_SUPPORTED = 'PersistedQueryNotSupported'
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ALLOWLIST_ONLY': False,
+    'ALLOWLIST_FILE': None,
+    'CACHE_TIMEOUT': 60 * 60 * 24,
+    'MAX_QUERY_LENGTH': 10000,
+    'MAX_REGISTRATIONS': 100,
+    'REGISTRATION_WINDOW': 60 * 60,
+}
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def get_persisted_query_settings():
+    return {**DEFAULTS, **getattr(settings, 'GRAPHQL_PERSISTED_QUERIES', {})}
+
+
+class DocumentCache:
+    """Thread-safe LRU of (document, validation errors) keyed by query hash"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def get_document(self, schema, query, key=None):
+        """Return (document, errors) for query text, parsing and validating only on a miss"""
+        key = key or query_hash(query)
+        entry = self.get(key)
+        if entry is None:
+            try:
+                document = parse(query)
+            except GraphQLError as error:
+                entry = (None, [error])
+            else:
+                entry = (document, validate(schema, document, specified_rules))
+            self.set(key, entry)
+        return entry
+
+
+document_cache = DocumentCache(getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', 256))
+
+
+class PersistedQueryError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.graphql_error = GraphQLError(message, extensions={'code': message})
+
+
+_allowlist = None
+_allowlist_lock = threading.Lock()
+
+
+def load_allowlist():
+    """hash -> query map from ALLOWLIST_FILE, read once per process"""
+    global _allowlist
+    if _allowlist is None:
+        with _allowlist_lock:
+            if _allowlist is None:
+                path = get_persisted_query_settings()['ALLOWLIST_FILE']
+                queries = {}
+                if path:
+                    with open(path, encoding='utf-8') as f:
+                        queries = json.load(f)
+                _allowlist = {query_hash(query): query for query in queries.values()}
+    return _allowlist
+
+
+@receiver(setting_changed)
+def reset_allowlist(setting, **kwargs):
+    global _allowlist
+    if setting == 'GRAPHQL_PERSISTED_QUERIES':
+        _allowlist = None
+
+
+def _cache_key(sha256):
+    return f'graphql:persisted:{sha256}'
+
+
+def _registrations_key(user_id):
+    return f'graphql:persisted:registrations:{user_id}'
+
+
+def _request_user(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    # graphql_jwt only authenticates JWT requests once execution starts
+    try:
+        return authenticate(request=request)
+    except JSONWebTokenError:
+        return None
+
+
+def register(sha256, query, request, config):
+    """Store a persisted query if the request's user may register it; returns whether it is stored"""
+    if request is None or len(query) > config['MAX_QUERY_LENGTH']:
+        return False
+    if cache.get(_cache_key(sha256)) is not None:
+        return True
+    user = _request_user(request)
+    if user is None:
+        return False
+    key = _registrations_key(user.pk)
+    # The window starts at the first registration
+    cache.add(key, 0, timeout=config['REGISTRATION_WINDOW'])
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        count = 1
+        cache.set(key, count, timeout=config['REGISTRATION_WINDOW'])
+    if count > config['MAX_REGISTRATIONS']:
+        return False
+    cache.set(_cache_key(sha256), query, config['CACHE_TIMEOUT'])
+    return True
+
+
+def resolve_query(query, extensions, request=None):
+    """
+    Return (query, hash) for a request, resolving or registering a
+    persisted query. Raises PersistedQueryError when the hash is
+    unknown or the query is not allowed.
+    """
+    config = get_persisted_query_settings()
+    persisted = (extensions or {}).get('persistedQuery') if isinstance(extensions, dict) else None
+    sha256 = persisted.get('sha256Hash') if isinstance(persisted, dict) else None
+
+    if sha256 and not config['ENABLED']:
+        raise PersistedQueryError(PERSISTED_QUERY_NOT_SUPPORTED)
+
+    if config['ALLOWLIST_ONLY']:
+        allowlist = load_allowlist()
+        key = sha256 or (query_hash(query) if query else None)
+        if key not in allowlist or (query and query_hash(query) != key):
+            raise PersistedQueryError(PERSISTED_QUERY_NOT_FOUND)
+        return allowlist[key], key
+
+    if not sha256:
+        return query, None
+
+    if query:
+        if query_hash(query) != sha256:
+            raise PersistedQueryError('provided sha does not match query')
+        register(sha256, query, request, config)
+        return query, sha256
+
+    query = cache.get(_cache_key(sha256))
+    if query is None:
+        raise PersistedQueryError(PERSISTED_QUERY_NOT_FOUND)
+    return query, sha256
@@ -0,0 +1,187 @@
+"""
+GraphQL query depth and cost analysis.
+
+The estimate walks the operation's selection set before execution. Every
+field adds its weight multiplied by how many times it is expected to be
+resolved: a list field multiplies its children by its size argument
+(``first``/``limit``) or by a configured/default list size. A size
+argument on a connection field is applied to the first list below it
+(``edges``). Fields whose name starts with ``__`` (introspection) are
+free.
+
+Tunables live in ``settings.GRAPHQL_QUERY_COST``.
+"""
+from django.conf import settings
+from graphql import (
+    FieldNode, FragmentSpreadNode, GraphQLError, GraphQLList, GraphQLNonNull,
+    InlineFragmentNode, IntValueNode, OperationType, VariableNode, get_named_type,
+    is_composite_type,
+)
+from graphql.validation import ValidationRule
+
+DEFAULTS = {
+    'MAX_DEPTH': 10,
+    'MAX_COST': 5000,
+    'DEFAULT_LIST_SIZE': 20,
+    'SIZE_ARGUMENTS': ('first', 'last', 'limit'),
+    # 'Type.field': expected list length when no size argument is given
+    'LIST_SIZES': {},
+    # 'Type.field': weight; defaults to 1 for object fields and 0 for scalars
+    'FIELD_WEIGHTS': {},
+}
+
+
+def get_cost_settings():
+    return {**DEFAULTS, **getattr(settings, 'GRAPHQL_QUERY_COST', {})}
+
+
+def list_size(key):
+    """
+    Length the estimate assumes for the 'Type.field' list when no size
+    argument is given; resolvers of such lists return at most this many rows
+    """
+    config = get_cost_settings()
+    return config['LIST_SIZES'].get(key, config['DEFAULT_LIST_SIZE'])
+
+
+def _is_list(type_):
+    if isinstance(type_, GraphQLNonNull):
+        type_ = type_.of_type
+    return isinstance(type_, GraphQLList)
+
+
+class QueryCostAnalyzer:
+    def __init__(self, schema, fragments, variables=None, config=None):
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables or {}
+        self.config = config or get_cost_settings()
+        self.variable_defaults = {}
+
+    def analyze(self, operation):
+        """Return (depth, cost) for an OperationDefinitionNode"""
+        root_type = {
+            OperationType.QUERY: self.schema.query_type,
+            OperationType.MUTATION: self.schema.mutation_type,
+            OperationType.SUBSCRIPTION: self.schema.subscription_type,
+        }[operation.operation]
+        if root_type is None:
+            return 0, 0
+        self.variable_defaults = {
+            definition.variable.name.value: definition.default_value
+            for definition in operation.variable_definitions or ()
+            if definition.default_value is not None
+        }
+        return self._selection_set(root_type, operation.selection_set, 1, None, frozenset())
+
+    def _size_argument(self, node):
+        for argument in node.arguments or ():
+            if argument.name.value not in self.config['SIZE_ARGUMENTS']:
+                continue
+            value = argument.value
+            if isinstance(value, VariableNode):
+                name = value.name.value
+                if self.variables.get(name) is not None:
+                    try:
+                        return int(self.variables[name])
+                    except (TypeError, ValueError):
+                        return None
+                value = self.variable_defaults.get(name)
+            if isinstance(value, IntValueNode):
+                return int(value.value)
+        return None
+
+    def _selection_set(self, parent_type, selection_set, multiplier, pending_size, visited):
+        depth = 0
+        cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field_depth, field_cost = self._field(parent_type, selection, multiplier, pending_size, visited)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value) or parent_type
+                field_depth, field_cost = self._selection_set(
+                    fragment_type, selection.selection_set, multiplier, pending_size, visited
+                )
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in visited:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value) or parent_type
+                field_depth, field_cost = self._selection_set(
+                    fragment_type, fragment.selection_set, multiplier, pending_size, visited | {name}
+                )
+            else:
+                continue
+            depth = max(depth, field_depth)
+            cost += field_cost
+        return depth, cost
+
+    def _field(self, parent_type, node, multiplier, pending_size, visited):
+        name = node.name.value
+        if name.startswith('__'):
+            return 0, 0
+        fields = getattr(parent_type, 'fields', None) or {}
+        field = fields.get(name)
+        if field is None:
+            # Unknown fields are reported by the standard validation rules
+            return 0, 0
+
+        key = f'{parent_type.name}.{name}'
+        named_type = get_named_type(field.type)
+        weight = self.config['FIELD_WEIGHTS'].get(key, 1 if is_composite_type(named_type) else 0)
+        cost = weight * multiplier
+        if not node.selection_set:
+            return 1, cost
+
+        size = self._size_argument(node)
+        if _is_list(field.type):
+            if size is None:
+                size = pending_size or self.config['LIST_SIZES'].get(key, self.config['DEFAULT_LIST_SIZE'])
+            child_multiplier = multiplier * max(size, 1)
+            child_pending = None
+        else:
+            # e.g. a connection: the size applies to the edges list below
+            child_multiplier = multiplier
+            child_pending = size if size is not None else pending_size
+
+        child_depth, child_cost = self._selection_set(
+            named_type, node.selection_set, child_multiplier, child_pending, visited
+        )
+        return child_depth + 1, cost + child_cost
+
+
+def query_cost_rule(variables=None, operation_name=None, on_result=None):
+    """
+    Build a validation rule that rejects the operation being executed when
+    it is over the depth/cost budget. ``on_result(depth, cost)`` receives
+    the estimate, e.g. to report it in the response extensions.
+    """
+    config = get_cost_settings()
+
+    class QueryCostRule(ValidationRule):
+        def enter_operation_definition(self, node, *_args):
+            name = node.name.value if node.name else None
+            if operation_name and name != operation_name:
+                return
+            fragments = {
+                definition.name.value: definition
+                for definition in self.context.document.definitions
+                if definition.kind == 'fragment_definition'
+            }
+            analyzer = QueryCostAnalyzer(self.context.schema, fragments, variables, config)
+            depth, cost = analyzer.analyze(node)
+            if on_result:
+                on_result(depth, cost)
+            if depth > config['MAX_DEPTH']:
+                self.report_error(GraphQLError(
+                    f"Query depth {depth} exceeds the maximum of {config['MAX_DEPTH']}", node
+                ))
+            if cost > config['MAX_COST']:
+                self.report_error(GraphQLError(
+                    f"Query cost {cost} exceeds the maximum of {config['MAX_COST']}", node
+                ))
+
+    return QueryCostRule
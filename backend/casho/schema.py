@@ -2,7 +2,7 @@ import graphene
 from graphene_django.debug import DjangoDebug
 import graphql_jwt
 
-from users.schema import Query as UserQuery, Mutation as UserMutation
+from users.schema import ObtainJSONWebToken, Query as UserQuery, Mutation as UserMutation
 from transactions.schema import Query as TransactionQuery, Mutation as TransactionMutation
 
 
@@ -11,7 +11,7 @@ class Query(UserQuery, TransactionQuery, graphene.ObjectType):
 
 
 class Mutation(UserMutation, TransactionMutation, graphene.ObjectType):
-    token_auth = graphql_jwt.ObtainJSONWebToken.Field()
+    token_auth = ObtainJSONWebToken.Field()
     verify_token = graphql_jwt.Verify.Field()
     refresh_token = graphql_jwt.Refresh.Field()
 
@@ -5,6 +5,7 @@ Django settings for casho project.
 import os
 from pathlib import Path
 from decouple import config
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -27,9 +28,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'rest_framework',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'graphene_django',
     'django_filters',
@@ -83,6 +86,24 @@ DATABASES = {
     }
 }
 
+# Read replica for stats, lists, exports and report tasks (see casho/db_router.py). Without
+# POSTGRES_REPLICA_HOST the alias reads from the primary; tests get a separate database for it
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST': config('POSTGRES_REPLICA_HOST', default=DATABASES['default']['HOST']),
+    'PORT': config('POSTGRES_REPLICA_PORT', default=DATABASES['default']['PORT']),
+    'TEST': {'NAME': f"test_{DATABASES['default']['NAME']}_replica"},
+}
+DATABASE_ROUTERS = ['casho.db_router.ReplicaRouter']
+
+# A user's reads stay on the primary for this many seconds after they write
+REPLICA_READ_AFTER_WRITE_WINDOW = config('REPLICA_READ_AFTER_WRITE_WINDOW', default=10, cast=int)
+# After the window, their reads move to the replica only once it has replayed their last
+# write; its replay position is checked at most this often (seconds) per process, and a
+# user's last write is remembered this long (seconds)
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=1, cast=float)
+REPLICA_WRITE_STAMP_TIMEOUT = config('REPLICA_WRITE_STAMP_TIMEOUT', default=60 * 60 * 24, cast=int)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -99,6 +120,17 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing: PBKDF2-SHA256 at PASSWORD_HASH_ITERATIONS (see users/hashers.py); hashes with
+# another cost or from the other hashers are upgraded on the user's next successful login
+PASSWORD_HASH_ITERATIONS = config('PASSWORD_HASH_ITERATIONS', default=600000, cast=int)
+PASSWORD_HASHERS = [
+    'users.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # Internationalization
 LANGUAGE_CODE = 'zh-hans'
 TIME_ZONE = 'Asia/Shanghai'
@@ -123,7 +155,7 @@ AUTH_USER_MODEL = 'users.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -143,6 +175,48 @@ GRAPHENE = {
     'SCHEMA_INDENT': 2,
 }
 
+# Page sizes for GraphQL transaction queries
+GRAPHQL_DEFAULT_PAGE_SIZE = 20
+GRAPHQL_MAX_PAGE_SIZE = 100
+GRAPHQL_TRANSACTIONS_LIST_LIMIT = 1000
+GRAPHQL_BULK_MUTATION_LIMIT = 1000
+
+# Depth/cost budget checked before any resolver runs (see casho/query_cost.py)
+GRAPHQL_QUERY_COST = {
+    'MAX_DEPTH': 10,
+    'MAX_COST': 5000,
+    'DEFAULT_LIST_SIZE': 20,
+    'LIST_SIZES': {
+        'Query.transactions': GRAPHQL_TRANSACTIONS_LIST_LIMIT,
+        'Query.users': 1000,
+        'CategoryType.transactionSet': 100,
+        'AccountType.transactionSet': 100,
+    },
+    'FIELD_WEIGHTS': {
+        'Query.stats': 10,
+    },
+}
+
+# Parsed/validated GraphQL documents kept per worker (see casho/query_cache.py)
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+
+# Persisted queries; with ALLOWLIST_ONLY only queries from ALLOWLIST_FILE run. Otherwise signed-in
+# users register them, for CACHE_TIMEOUT seconds, up to MAX_REGISTRATIONS per REGISTRATION_WINDOW
+GRAPHQL_PERSISTED_QUERIES = {
+    'ENABLED': True,
+    'ALLOWLIST_ONLY': config('GRAPHQL_PERSISTED_QUERIES_ALLOWLIST_ONLY', default=False, cast=bool),
+    'ALLOWLIST_FILE': config('GRAPHQL_PERSISTED_QUERIES_ALLOWLIST_FILE', default=None),
+    'CACHE_TIMEOUT': config('GRAPHQL_PERSISTED_QUERIES_TIMEOUT', default=60 * 60 * 24, cast=int),
+    'MAX_QUERY_LENGTH': 10000,
+    'MAX_REGISTRATIONS': config('GRAPHQL_PERSISTED_QUERIES_MAX_REGISTRATIONS', default=100, cast=int),
+    'REGISTRATION_WINDOW': 60 * 60,
+}
+
+# graphql_jwt resolves the token's user through the same cache as the REST API
+GRAPHQL_JWT = {
+    'JWT_GET_USER_BY_NATURAL_KEY_HANDLER': 'users.authentication.get_cached_user_by_natural_key',
+}
+
 AUTHENTICATION_BACKENDS = [
     'graphql_jwt.backends.JSONWebTokenBackend',
     'django.contrib.auth.backends.ModelBackend',
@@ -166,6 +240,27 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    # 每月 1 日凌晨发送上月报告
+    'send-monthly-reports': {
+        'task': 'transactions.tasks.send_monthly_reports',
+        'schedule': crontab(minute=0, hour=3, day_of_month=1),
+    },
+    # 账户余额：每月 1 日生成上月末检查点，每天核对一次
+    'create-account-checkpoints': {
+        'task': 'transactions.tasks.create_account_checkpoints',
+        'schedule': crontab(minute=0, hour=1, day_of_month=1),
+    },
+    'reconcile-account-balances': {
+        'task': 'transactions.tasks.reconcile_account_balances',
+        'schedule': crontab(minute=0, hour=4),
+    },
+    # 提前创建交易表分区（未分区时不做任何事）
+    'create-transaction-partitions': {
+        'task': 'transactions.tasks.create_transaction_partitions',
+        'schedule': crontab(minute=30, hour=2),
+    },
+}
 
 # Cache settings
 CACHES = {
@@ -175,6 +270,74 @@ CACHES = {
     }
 }
 
+# Currencies (see transactions/fx.py): stats/reports default to DEFAULT_CURRENCY, which is
+# also assumed for transactions without an account; FxRate rows are quoted per FX_BASE_CURRENCY.
+# Rates are cached per currency and month in Redis and, for FX_LOCAL_CACHE_TTL seconds, per process
+DEFAULT_CURRENCY = config('DEFAULT_CURRENCY', default='CNY')
+FX_BASE_CURRENCY = config('FX_BASE_CURRENCY', default='USD')
+FX_CACHE_TIMEOUT = config('FX_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)
+FX_LOCAL_CACHE_TTL = config('FX_LOCAL_CACHE_TTL', default=60, cast=int)
+FX_LOCAL_CACHE_SIZE = 256
+
+# Authenticated users (see users/authentication.py): cached in Redis for AUTH_USER_CACHE_TIMEOUT
+# seconds and per process for AUTH_USER_LOCAL_CACHE_TTL, which bounds how long another worker
+# may keep serving a user after it is saved, deactivated or logs out
+AUTH_USER_CACHE_TIMEOUT = config('AUTH_USER_CACHE_TIMEOUT', default=300, cast=int)
+AUTH_USER_LOCAL_CACHE_TTL = config('AUTH_USER_LOCAL_CACHE_TTL', default=5, cast=int)
+AUTH_USER_LOCAL_CACHE_SIZE = 1024
+
+# Login (see users/login.py): failed attempts allowed per account from one client IP, per account
+# from all IPs and per client IP within LOGIN_FAILURE_WINDOW seconds before further attempts get 429
+# without hashing. The client IP is read from LOGIN_CLIENT_IP_HEADER (e.g. HTTP_X_FORWARDED_FOR behind
+# a proxy), taking the entry LOGIN_TRUSTED_PROXY_HOPS from the right: the one our own proxy appended.
+# At most LOGIN_HASH_CONCURRENCY password checks run at once across all workers (slots live in the
+# shared cache and expire after LOGIN_HASH_SLOT_TTL seconds), others get 503 with Retry-After at once
+LOGIN_MAX_ACCOUNT_FAILURES = config('LOGIN_MAX_ACCOUNT_FAILURES', default=5, cast=int)
+LOGIN_MAX_ACCOUNT_TOTAL_FAILURES = config('LOGIN_MAX_ACCOUNT_TOTAL_FAILURES', default=100, cast=int)
+LOGIN_MAX_IP_FAILURES = config('LOGIN_MAX_IP_FAILURES', default=50, cast=int)
+LOGIN_FAILURE_WINDOW = config('LOGIN_FAILURE_WINDOW', default=15 * 60, cast=int)
+LOGIN_CLIENT_IP_HEADER = config('LOGIN_CLIENT_IP_HEADER', default='REMOTE_ADDR')
+LOGIN_TRUSTED_PROXY_HOPS = config('LOGIN_TRUSTED_PROXY_HOPS', default=1, cast=int)
+LOGIN_HASH_CONCURRENCY = config('LOGIN_HASH_CONCURRENCY', default=2, cast=int)
+LOGIN_HASH_SLOT_TTL = config('LOGIN_HASH_SLOT_TTL', default=30, cast=int)
+
+# Stats cache settings
+STATS_CACHE_TIMEOUT = config('STATS_CACHE_TIMEOUT', default=300, cast=int)
+STATS_CACHE_STALE_WHILE_REVALIDATE = config('STATS_CACHE_STALE_WHILE_REVALIDATE', default=False, cast=bool)
+
+# Bank statement import: rows per bulk_create batch, row errors kept on the job
+TRANSACTION_IMPORT_BATCH_SIZE = config('TRANSACTION_IMPORT_BATCH_SIZE', default=1000, cast=int)
+TRANSACTION_IMPORT_MAX_ERRORS = 100
+
+# Weekly summary: user ids per chunk, and whether chunks run as a Celery chord
+WEEKLY_SUMMARY_CHUNK_SIZE = config('WEEKLY_SUMMARY_CHUNK_SIZE', default=5000, cast=int)
+WEEKLY_SUMMARY_FANOUT = config('WEEKLY_SUMMARY_FANOUT', default=False, cast=bool)
+
+# Monthly reports: users per batch task, batch task rate limit per worker, retries per batch
+MONTHLY_REPORT_BATCH_SIZE = config('MONTHLY_REPORT_BATCH_SIZE', default=200, cast=int)
+MONTHLY_REPORT_RATE_LIMIT = config('MONTHLY_REPORT_RATE_LIMIT', default='30/m')
+MONTHLY_REPORT_MAX_RETRIES = 5
+
+# Retention: keep this many days, delete in pk batches with a pause (seconds) in between,
+# optionally archiving each batch to <TRANSACTION_ARCHIVE_ROOT>/<user_id>/<YYYY-MM>.jsonl.gz
+TRANSACTION_RETENTION_DAYS = config('TRANSACTION_RETENTION_DAYS', default=730, cast=int)
+TRANSACTION_RETENTION_BATCH_SIZE = config('TRANSACTION_RETENTION_BATCH_SIZE', default=1000, cast=int)
+TRANSACTION_RETENTION_BATCH_PAUSE = config('TRANSACTION_RETENTION_BATCH_PAUSE', default=0.5, cast=float)
+TRANSACTION_RETENTION_ARCHIVE = config('TRANSACTION_RETENTION_ARCHIVE', default=False, cast=bool)
+TRANSACTION_ARCHIVE_ROOT = config('TRANSACTION_ARCHIVE_ROOT', default=os.path.join(BASE_DIR, 'archive'))
+
+# Partitioning of the transactions table (PostgreSQL, see transactions/partitions.py):
+# 'month' or 'year' partitions, and how many future partitions to keep created
+TRANSACTION_PARTITION_INTERVAL = config('TRANSACTION_PARTITION_INTERVAL', default='month')
+TRANSACTION_PARTITIONS_AHEAD = config('TRANSACTION_PARTITIONS_AHEAD', default=3, cast=int)
+
+# Text search configuration for the transactions.search_vector trigger (PostgreSQL);
+# the trigger is created with it, so run `manage.py rebuild_search_index` after changing it
+TRANSACTION_SEARCH_CONFIG = config('TRANSACTION_SEARCH_CONFIG', default='simple')
+
+# Rows fetched per server-side cursor round trip when streaming exports
+TRANSACTION_EXPORT_CHUNK_SIZE = config('TRANSACTION_EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
 # JWT settings
 from datetime import timedelta
 SIMPLE_JWT = {
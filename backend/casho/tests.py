@@ -0,0 +1,166 @@
+import json
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from graphql_jwt.shortcuts import get_token
+
+from transactions.models import Category, Transaction
+
+from .query_cache import document_cache, query_hash
+
+User = get_user_model()
+
+
+class GraphQLQueryCostTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        category = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        Transaction.objects.create(user=self.user, category=category, amount=50, date='2024-01-01')
+        self.client.force_login(self.user)
+
+    def query(self, query, variables=None):
+        return self.client.post(
+            '/graphql/', {'query': query, 'variables': variables or {}}, content_type='application/json'
+        )
+
+    def test_cost_reported_in_extensions(self):
+        response = self.query('{ categories { name transactionSet { id category { name } } } }')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertNotIn('errors', body)
+        # categories(1) + 20 transactionSets + 20*100 categories
+        self.assertEqual(body['extensions']['cost'], {'depth': 4, 'cost': 2021})
+
+    def test_connection_size_argument(self):
+        query = '''
+        query($first: Int) {
+          transactionsConnection(first: $first) { edges { node { category { name } } } }
+        }
+        '''
+        cost = self.query(query, {'first': 10}).json()['extensions']['cost']
+        # connection(1) + edges(1) + 10 nodes + 10 categories
+        self.assertEqual(cost['cost'], 22)
+
+    @override_settings(GRAPHQL_QUERY_COST={'MAX_DEPTH': 3})
+    def test_rejects_deep_query(self):
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                '/graphql/',
+                {'query': '{ transactions { category { transactionSet { id } } } }'},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 400)
+        body = response.json()
+        self.assertIn('depth', body['errors'][0]['message'])
+        self.assertNotIn('data', body)
+
+    def test_rejects_expensive_fan_out(self):
+        query = '''
+        fragment Deep on CategoryType { transactionSet { category { transactionSet { category { name } } } } }
+        { transactions { category { ...Deep } } }
+        '''
+        response = self.query(query)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cost', response.json()['errors'][0]['message'])
+
+    def test_introspection_is_free(self):
+        response = self.query('{ __schema { types { name fields { name type { name ofType { name } } } } } }')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['extensions']['cost']['cost'], 0)
+
+
+class GraphQLPersistedQueryTest(TestCase):
+    QUERY = '{ categories { name } }'
+
+    def setUp(self):
+        cache.clear()
+        document_cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.client.force_login(self.user)
+
+    def post(self, query=None, sha256=None, **extra):
+        body = {}
+        if query:
+            body['query'] = query
+        if sha256:
+            body['extensions'] = {'persistedQuery': {'version': 1, 'sha256Hash': sha256}}
+        return self.client.post('/graphql/', body, content_type='application/json', **extra)
+
+    def test_register_then_send_hash_only(self):
+        sha256 = query_hash(self.QUERY)
+        response = self.post(sha256=sha256)
+        self.assertEqual(response.json()['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        response = self.post(self.QUERY, sha256)
+        self.assertEqual(response.json()['data'], {'categories': [{'name': '餐饮'}]})
+
+        response = self.post(sha256=sha256)
+        self.assertEqual(response.json()['data'], {'categories': [{'name': '餐饮'}]})
+
+    def test_only_signed_in_users_register(self):
+        sha256 = query_hash(self.QUERY)
+        self.client.logout()
+        # Executed from its text, but not stored
+        response = self.post(self.QUERY, sha256)
+        self.assertEqual(response.json()['data'], {'categories': []})
+        self.assertEqual(self.post(sha256=sha256).json()['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        # graphql_jwt clients count as signed in
+        self.post(self.QUERY, sha256, HTTP_AUTHORIZATION=f'JWT {get_token(self.user)}')
+        self.assertEqual(self.post(sha256=sha256).json()['data'], {'categories': []})
+
+    @override_settings(GRAPHQL_PERSISTED_QUERIES={'MAX_REGISTRATIONS': 2, 'MAX_QUERY_LENGTH': 100})
+    def test_registrations_capped(self):
+        queries = [
+            self.QUERY, '{ accounts { name } }', '{ categories { id } }',
+            '{ %s }' % ' '.join(['categories { name }'] * 10),
+        ]
+        for query in queries:
+            self.assertNotIn('errors', self.post(query, query_hash(query)).json())
+        stored = ['errors' not in self.post(sha256=query_hash(query)).json() for query in queries]
+        # Per user per window, and never over MAX_QUERY_LENGTH
+        self.assertEqual(stored, [True, True, False, False])
+        # Registering an already stored query again does not count
+        self.post(self.QUERY, query_hash(self.QUERY))
+        self.assertEqual(cache.get(f'graphql:persisted:registrations:{self.user.pk}'), 3)
+
+    def test_hash_mismatch(self):
+        response = self.post(self.QUERY, query_hash('{ accounts { name } }'))
+        self.assertIn('errors', response.json())
+
+    def test_allowlist_only(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as allowlist:
+            json.dump({'Categories': self.QUERY}, allowlist)
+            allowlist.flush()
+            with override_settings(GRAPHQL_PERSISTED_QUERIES={
+                'ALLOWLIST_ONLY': True, 'ALLOWLIST_FILE': allowlist.name
+            }):
+                response = self.post(sha256=query_hash(self.QUERY))
+                self.assertEqual(response.json()['data'], {'categories': [{'name': '餐饮'}]})
+
+                response = self.post('{ accounts { name } }')
+                self.assertEqual(response.json()['errors'][0]['message'], 'PersistedQueryNotFound')
+
+    def test_document_cache_hits(self):
+        self.post(self.QUERY)
+        self.post(self.QUERY)
+        self.post(self.QUERY)
+        stats = document_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 1, 1))
+
+    def test_invalid_documents_are_cached_too(self):
+        for _ in range(2):
+            response = self.post('{ categories { nope } }')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(document_cache.stats()['hits'], 1)
@@ -5,9 +5,10 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 
+from .views import GraphQLView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('users.urls')),
@@ -0,0 +1,22 @@
+"""
+URL configuration for the ASGI deployment (casho/asgi.py): the read-heavy
+endpoints and the export (whose stream a sync view would have buffered
+whole) are served by their async views, everything else as in casho.urls.
+"""
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+
+from transactions.views import (
+    AsyncTransactionExportView, AsyncTransactionListCreateView, AsyncTransactionStatsView
+)
+
+from . import urls
+from .views import AsyncGraphQLView
+
+urlpatterns = [
+    path('api/transactions/', AsyncTransactionListCreateView.as_view(), name='transaction-list-create'),
+    path('api/transactions/stats/', AsyncTransactionStatsView.as_view(), name='transaction-stats'),
+    path('api/transactions/export/', AsyncTransactionExportView.as_view(), name='transaction-export'),
+    path('graphql/', csrf_exempt(AsyncGraphQLView.as_view(graphiql=True))),
+    *urls.urlpatterns,
+]
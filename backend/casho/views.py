@@ -0,0 +1,141 @@
+"""
+GraphQL endpoint.
+
+Extends graphene-django's GraphQLView so that parsing, validation
+(including the depth/cost budget from casho.query_cost) and execution are
+separate steps. Parsed and validated documents come from the LRU in
+casho.query_cache, which also resolves persisted queries, and the
+computed cost is returned under ``extensions.cost``. Resolvers add their
+own entries to ``request._graphql_extensions`` (e.g. the legacy
+``transactions`` list reports under ``extensions.truncated`` when it cut
+rows off).
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast, validate
+
+from .query_cache import PersistedQueryError, document_cache, resolve_query
+from .query_cost import query_cost_rule
+
+
+class GraphQLView(BaseGraphQLView):
+    def json_encode(self, request, d, pretty=False):
+        extensions = getattr(request, '_graphql_extensions', None)
+        if extensions:
+            d = {**d, 'extensions': extensions}
+        return super().json_encode(request, d, pretty=pretty)
+
+    def get_response(self, request, data, show_graphiql=False):
+        try:
+            return super().get_response(request, data, show_graphiql)
+        finally:
+            # DjangoDebugMiddleware only unwraps the connections' cursors when
+            # a query selects ``_debug``; otherwise they keep recording every
+            # later query of the thread into this request's debug context
+            debug = getattr(request, 'django_debug', None)
+            if debug is not None:
+                debug.disable_instrumentation()
+
+    @staticmethod
+    def get_request_extensions(request, data):
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        return extensions
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        try:
+            query, key = resolve_query(query, self.get_request_extensions(request, data), request)
+        except PersistedQueryError as e:
+            return ExecutionResult(errors=[e.graphql_error])
+
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        graphql_schema = self.schema.graphql_schema
+        document, validation_errors = document_cache.get_document(graphql_schema, query, key)
+        if document is None:
+            return ExecutionResult(errors=validation_errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if request.method.lower() == "get":
+            if operation_ast and operation_ast.operation != OperationType.QUERY:
+                if show_graphiql:
+                    return None
+
+                raise HttpError(
+                    HttpResponseNotAllowed(
+                        ["POST"],
+                        "Can only perform a {} operation from a POST request.".format(
+                            operation_ast.operation.value
+                        ),
+                    )
+                )
+
+        if validation_errors:
+            return ExecutionResult(errors=validation_errors)
+
+        def report_cost(depth, cost):
+            request._graphql_extensions = {'cost': {'depth': depth, 'cost': cost}}
+
+        # The cost depends on variables, so it is checked per request
+        cost_errors = validate(
+            graphql_schema, document, [query_cost_rule(variables, operation_name, report_cost)]
+        )
+        if cost_errors:
+            return ExecutionResult(errors=cost_errors)
+
+        try:
+            options = {
+                "root_value": self.get_root_value(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "context_value": self.get_context(request),
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                options["execution_context_class"] = self.execution_context_class
+
+            if (
+                operation_ast
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(graphql_schema, document, **options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            return execute(graphql_schema, document, **options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+
+class AsyncGraphQLView(GraphQLView):
+    """
+    GraphQLView for the ASGI deployment (casho/urls_async.py). The
+    resolvers use the sync ORM and mutations may run in
+    transaction.atomic, so the whole request is handled in one worker
+    thread while the event loop keeps serving other connections.
+    """
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        return await sync_to_async(super().dispatch)(request, *args, **kwargs)
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Category, Transaction, Account
+from django.db import transaction
+from django.db.models import Q
+from . import fx, search
+from .models import Category, Transaction, Account, FxRate, ImportJob, RetentionRun
 
 
 @admin.register(Category)
@@ -18,10 +21,54 @@ class TransactionAdmin(admin.ModelAdmin):
     ordering = ['-date', '-created_at']
     date_hierarchy = 'date'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not search.enabled(queryset):
+            return super().get_search_results(request, queryset, search_term)
+        # Indexed description search, plus exact user/category names instead of joined LIKE scans
+        matches = search.search(queryset, search_term, rank=False)
+        by_name = queryset.filter(Q(user__username=search_term) | Q(category__name=search_term))
+        return matches | by_name, False
+
 
 @admin.register(Account)
 class AccountAdmin(admin.ModelAdmin):
-    list_display = ['name', 'currency', 'balance', 'user', 'created_at']
+    list_display = ['name', 'currency', 'balance', 'opening_balance', 'user', 'created_at']
     list_filter = ['currency', 'created_at']
     search_fields = ['name', 'user__username']
-    ordering = ['-created_at'] 
\ No newline at end of file
+    ordering = ['-created_at']
+
+
+@admin.register(FxRate)
+class FxRateAdmin(admin.ModelAdmin):
+    list_display = ['currency', 'date', 'rate']
+    list_filter = ['currency']
+    ordering = ['-date', 'currency']
+    date_hierarchy = 'date'
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(fx.invalidate_rates)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(fx.invalidate_rates)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(fx.invalidate_rates)
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['user', 'format', 'status', 'rows_imported', 'rows_failed', 'created_at', 'finished_at']
+    list_filter = ['format', 'status', 'created_at']
+    search_fields = ['user__username']
+    ordering = ['-created_at']
+
+
+@admin.register(RetentionRun)
+class RetentionRunAdmin(admin.ModelAdmin):
+    list_display = ['cutoff_date', 'status', 'progress', 'rows_deleted', 'rows_archived', 'batches', 'started_at', 'finished_at']
+    list_filter = ['status', 'archive']
+    ordering = ['-started_at']
+
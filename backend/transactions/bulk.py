@@ -0,0 +1,56 @@
+"""
+Bulk inserts and deletes.
+
+bulk_create() and raw deletes skip save()/delete() and the model signals,
+so these helpers do the upkeep the signals would have done: fold the rows
+into the daily rollup and the account ledger, and bump the owners' stats
+data version.
+"""
+from django.db import transaction
+
+from . import ledger, rollups
+from .models import Category, Transaction
+from .stats_cache import bump_data_version
+
+
+def bulk_create_transactions(transactions, batch_size=500, keep_balances=False):
+    """
+    Insert unsaved Transaction instances (type must already be set).
+    keep_balances is for restoring deleted history: see ledger.apply_transactions().
+    """
+    with transaction.atomic():
+        created = Transaction.objects.bulk_create(transactions, batch_size=batch_size)
+        rollups.apply_deltas(created)
+        ledger.apply_transactions(created, keep_balances=keep_balances)
+        for user_id in {row.user_id for row in created}:
+            bump_data_version(user_id)
+    return created
+
+
+def bulk_create_categories(categories, batch_size=500):
+    with transaction.atomic():
+        created = Category.objects.bulk_create(categories, batch_size=batch_size)
+        for user_id in {row.user_id for row in created}:
+            bump_data_version(user_id)
+    return created
+
+
+def bulk_delete_transactions(ids, keep_balances=False):
+    """
+    Delete transactions by primary key with a single DELETE, without
+    loading model instances or sending per-row signals. Returns the
+    number of rows deleted. keep_balances is for retention: see
+    ledger.apply_transactions().
+    """
+    with transaction.atomic():
+        rows = list(Transaction.objects.filter(pk__in=ids).only(*rollups.KEY_FIELDS, 'amount'))
+        if not rows:
+            return 0
+        rollups.apply_deltas(rows, sign=-1)
+        ledger.apply_transactions(rows, sign=-1, keep_balances=keep_balances)
+        # Nothing references transactions, so there are no cascades to collect
+        deleted = Transaction.objects.filter(pk__in=[row.pk for row in rows])._raw_delete(Transaction.objects.db)
+        for user_id in {row.user_id for row in rows}:
+            bump_data_version(user_id)
+    return deleted
+
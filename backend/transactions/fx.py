@@ -0,0 +1,307 @@
+"""
+Currency conversion.
+
+FxRate holds daily rates against FX_BASE_CURRENCY: ``rate`` is how many
+units of ``currency`` one unit of the base currency buys. A day without a
+row uses the latest earlier rate (or, before the first one, the earliest
+rate). Rates are loaded from a CSV file with ``manage.py load_fx_rates``.
+
+Lookups read one month of forward-filled daily rates per currency at a
+time, through a small per-process cache in front of Django's cache
+(Redis). Both are keyed by a rates version that load_rates() bumps, so
+loading new rates invalidates them (other processes notice within
+FX_LOCAL_CACHE_TTL seconds) along with every converted stats payload.
+
+Aggregates are converted in batch (converted_totals()): the rollup query
+sums amounts already in the reporting currency straight to totals and
+splits only foreign amounts by day, which are then multiplied by that
+day's factor. Transactions without an account count as DEFAULT_CURRENCY.
+
+Stats requested without a currency are reported in user_currency(): the
+currency of the user's accounts when they all share one, so a user with
+only USD accounts needs no rates at all.
+"""
+import csv
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import date, timedelta
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, CharField, DateField, F, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Account, FxRate
+
+CURRENCIES = [code for code, _ in Account.CURRENCY_CHOICES]
+CURRENCY_SYMBOLS = {
+    'USD': '$',
+    'CAD': 'C$',
+    'CNY': '¥',
+}
+
+CENT = Decimal('0.01')
+ONE = Decimal('1')
+
+VERSION_KEY = 'fx:version'
+
+_lock = threading.Lock()
+_local_months = OrderedDict()
+_local_version = {'value': None, 'expires': 0.0}
+
+
+class FxRateMissing(Exception):
+    """No rate has been loaded for a currency"""
+
+
+def reporting_currency(currency=None):
+    """Validated reporting currency code, DEFAULT_CURRENCY when not given"""
+    currency = (currency or settings.DEFAULT_CURRENCY).upper()
+    if currency not in CURRENCIES:
+        raise ValueError(f'Unknown currency "{currency}"')
+    return currency
+
+
+def user_currency(user_id):
+    """The currency all of a user's accounts are in, else DEFAULT_CURRENCY"""
+    currencies = list(_account_currencies(user_id))
+    return currencies[0] if len(currencies) == 1 else settings.DEFAULT_CURRENCY
+
+
+async def auser_currency(user_id):
+    """user_currency() through the async ORM"""
+    currencies = [currency async for currency in _account_currencies(user_id)]
+    return currencies[0] if len(currencies) == 1 else settings.DEFAULT_CURRENCY
+
+
+def _account_currencies(user_id):
+    # Two are enough to tell "one currency" from "several"
+    return Account.objects.filter(user_id=user_id).values_list('currency', flat=True).distinct()[:2]
+
+
+def user_currencies(user_ids):
+    """user_currency() for each of user_ids, in one query"""
+    currencies = defaultdict(set)
+    rows = Account.objects.filter(user_id__in=user_ids).values_list('user_id', 'currency').distinct()
+    for user_id, currency in rows:
+        currencies[user_id].add(currency)
+    return {
+        user_id: next(iter(currencies[user_id])) if len(currencies[user_id]) == 1 else settings.DEFAULT_CURRENCY
+        for user_id in user_ids
+    }
+
+
+def currency_symbol(currency):
+    return CURRENCY_SYMBOLS.get(currency, f'{currency} ')
+
+
+def rates_version():
+    """Current rates version, re-read from the shared cache at most every FX_LOCAL_CACHE_TTL seconds"""
+    now = time.monotonic()
+    if _local_version['value'] is not None and now < _local_version['expires']:
+        return _local_version['value']
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock, as stats_cache.data_version() does
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    _local_version.update(value=version, expires=now + settings.FX_LOCAL_CACHE_TTL)
+    return version
+
+
+def clear_local_cache():
+    with _lock:
+        _local_months.clear()
+        _local_version.update(value=None, expires=0.0)
+
+
+def _month_end(month):
+    return (month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def _load_month(currency, month):
+    """{day: rate} for every day of month, or {} when the currency has no rates at all"""
+    end = _month_end(month)
+    rates = FxRate.objects.filter(currency=currency)
+    changes = dict(rates.filter(date__gte=month, date__lte=end).values_list('date', 'rate'))
+    current = rates.filter(date__lt=month).order_by('-date').values_list('rate', flat=True).first()
+    if current is None:
+        current = (
+            changes[min(changes)] if changes
+            else rates.filter(date__gt=end).order_by('date').values_list('rate', flat=True).first()
+        )
+    if current is None:
+        return {}
+
+    days = {}
+    day = month
+    while day <= end:
+        current = changes.get(day, current)
+        days[day] = current
+        day += timedelta(days=1)
+    return days
+
+
+def _month_rates(currency, month):
+    version = rates_version()
+    key = (version, currency, month)
+    with _lock:
+        days = _local_months.get(key)
+        if days is not None:
+            _local_months.move_to_end(key)
+            return days
+
+    cache_key = f'fx:{version}:{currency}:{month:%Y-%m}'
+    days = cache.get(cache_key)
+    if days is None:
+        days = _load_month(currency, month)
+        cache.set(cache_key, days, settings.FX_CACHE_TIMEOUT)
+
+    with _lock:
+        _local_months[key] = days
+        while len(_local_months) > settings.FX_LOCAL_CACHE_SIZE:
+            _local_months.popitem(last=False)
+    return days
+
+
+def rate(currency, day):
+    """Units of currency per unit of FX_BASE_CURRENCY on day"""
+    if currency == settings.FX_BASE_CURRENCY:
+        return ONE
+    days = _month_rates(currency, day.replace(day=1))
+    if not days:
+        raise FxRateMissing(f'No FX rates loaded for {currency}')
+    return days[day]
+
+
+def factor(from_currency, to_currency, day):
+    """Multiplier taking an amount in from_currency to to_currency on day"""
+    if from_currency == to_currency:
+        return ONE
+    return rate(to_currency, day) / rate(from_currency, day)
+
+
+def convert(amount, from_currency, to_currency, day):
+    return (amount * factor(from_currency, to_currency, day)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def currency_expression(prefix=''):
+    """Currency of a transaction or rollup row: its account's, else DEFAULT_CURRENCY"""
+    return Coalesce(
+        F(f'{prefix}account__currency'), Value(settings.DEFAULT_CURRENCY), output_field=CharField()
+    )
+
+
+def converted_totals(queryset, fields, currency, missing=None):
+    """
+    Sum ``amount`` over a rollup queryset grouped by fields, converted to
+    currency. Returns {tuple of field values: total}. One query, plus rate
+    lookups (usually cache hits) only when foreign amounts are present.
+
+    Raises FxRateMissing when a needed rate is not loaded, unless
+    ``missing`` is a dict: the groups that could not be converted are then
+    left out of the result and recorded there as {key: FxRateMissing}.
+    """
+    return _fold_totals(_converted_rows(queryset, fields, currency), fields, currency, missing)
+
+
+async def aconverted_totals(queryset, fields, currency, missing=None):
+    """converted_totals() through the async ORM; rate lookups, when needed, run in a worker thread"""
+    rows = [row async for row in _converted_rows(queryset, fields, currency)]
+    if any(row['fx_day'] is not None for row in rows):
+        return await sync_to_async(_fold_totals)(rows, fields, currency, missing)
+    return _fold_totals(rows, fields, currency, missing)
+
+
+def _converted_rows(queryset, fields, currency):
+    return queryset.annotate(
+        fx_currency=currency_expression(),
+    ).annotate(
+        # Amounts already in the reporting currency need no per-day split
+        fx_day=Case(
+            When(fx_currency=currency, then=Value(None, output_field=DateField())),
+            default=F('date'),
+            output_field=DateField(),
+        ),
+    ).values(*fields, 'fx_currency', 'fx_day').annotate(fx_total=Sum('amount')).order_by()
+
+
+def _fold_totals(rows, fields, currency, missing):
+    totals = defaultdict(lambda: Decimal('0'))
+    factors = {}
+    for row in rows:
+        key = tuple(row[field] for field in fields)
+        total = row['fx_total']
+        if row['fx_day'] is not None:
+            pair = (row['fx_currency'], row['fx_day'])
+            if pair not in factors:
+                try:
+                    factors[pair] = factor(pair[0], currency, pair[1])
+                except FxRateMissing as e:
+                    if missing is None:
+                        raise
+                    factors[pair] = e
+            if isinstance(factors[pair], FxRateMissing):
+                missing[key] = factors[pair]
+                continue
+            total = total * factors[pair]
+        totals[key] += total
+    return {
+        key: total.quantize(CENT, rounding=ROUND_HALF_UP)
+        for key, total in totals.items()
+        if missing is None or key not in missing
+    }
+
+
+def read_rates_file(path):
+    """
+    Parse a CSV of ``date,currency,rate`` rows (header row required; rate
+    in units of currency per unit of FX_BASE_CURRENCY). Raises ValueError
+    naming the first bad line.
+    """
+    rates = []
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        missing = {'date', 'currency', 'rate'} - {name.strip().lower() for name in reader.fieldnames or []}
+        if missing:
+            raise ValueError(f'Missing columns: {", ".join(sorted(missing))}')
+        for row in reader:
+            row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+            try:
+                currency = row['currency'].upper()
+                day = date.fromisoformat(row['date'])
+                value = Decimal(row['rate'])
+            except (ValueError, InvalidOperation):
+                raise ValueError(f'Line {reader.line_num}: invalid row {row}')
+            if currency not in CURRENCIES or value <= 0:
+                raise ValueError(f'Line {reader.line_num}: invalid row {row}')
+            rates.append(FxRate(currency=currency, date=day, rate=value))
+    return rates
+
+
+def load_rates(rates, batch_size=1000):
+    """Upsert FxRate instances and invalidate every cached rate; returns the number written"""
+    with transaction.atomic():
+        FxRate.objects.bulk_create(
+            rates,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['currency', 'date'],
+            update_fields=['rate'],
+        )
+        transaction.on_commit(invalidate_rates)
+    return len(rates)
+
+
+def invalidate_rates():
+    """Retire every cached rate and converted stats payload after FxRate rows change"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        pass
+    clear_local_cache()
+    rates_version()
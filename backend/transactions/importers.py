@@ -0,0 +1,219 @@
+"""
+Streaming bank statement import.
+
+Parsers read the uploaded file incrementally and yield one
+(line number, row dict) at a time; run_import() turns rows into
+Transaction instances and inserts them with bulk_create in fixed-size
+batches, so memory stays flat however large the file is. Each batch is
+committed on its own, in the same transaction as the job's progress
+counters and row errors. rows_processed is therefore the number of parsed
+rows whose outcome is committed: running a failed job again skips that
+many rows and carries on from there.
+
+Row dicts use the keys date, amount, description, category and type.
+When type is missing it is taken from the sign of amount (negative means
+expense); rows without a category go to DEFAULT_CATEGORY_NAME. Categories
+that do not exist yet are created on first use.
+"""
+import csv
+import io
+import json
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .bulk import bulk_create_transactions
+from .models import Category, ImportJob, Transaction
+
+DEFAULT_CATEGORY_NAME = '未分类'
+
+_amount_field = Transaction._meta.get_field('amount')
+_date_field = Transaction._meta.get_field('date')
+_description_length = Transaction._meta.get_field('description').max_length
+_category_name_length = Category._meta.get_field('name').max_length
+
+
+def _text(raw):
+    return io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+
+def parse_csv(raw):
+    reader = csv.reader(_text(raw))
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [column.strip().lower() for column in header]
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        yield reader.line_num, dict(zip(columns, row))
+
+
+def parse_jsonl(raw):
+    for line_num, line in enumerate(_text(raw), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_num, row
+
+
+_OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+def _ofx_tags(stream, chunk_size=64 * 1024):
+    """Yield (closing, tag, text) from OFX 1.x SGML or 2.x XML, one chunk at a time"""
+    buffer = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        # Only tags whose text is complete, i.e. followed by another '<'
+        cut = buffer.rfind('<')
+        if cut <= 0:
+            continue
+        for match in _OFX_TAG.finditer(buffer, 0, cut):
+            yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+        buffer = buffer[cut:]
+    for match in _OFX_TAG.finditer(buffer):
+        yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+
+
+def parse_ofx(raw):
+    number = 0
+    fields = None
+    for closing, tag, text in _ofx_tags(_text(raw)):
+        if tag == 'STMTTRN':
+            if closing and fields is not None:
+                number += 1
+                posted = fields.get('DTPOSTED', '')
+                yield number, {
+                    'date': f'{posted[:4]}-{posted[4:6]}-{posted[6:8]}' if len(posted) >= 8 else posted,
+                    'amount': fields.get('TRNAMT'),
+                    'description': fields.get('NAME') or fields.get('MEMO', ''),
+                }
+                fields = None
+            elif not closing:
+                fields = {}
+        elif fields is not None and not closing:
+            fields[tag] = text
+
+
+PARSERS = {
+    ImportJob.CSV: parse_csv,
+    ImportJob.OFX: parse_ofx,
+    ImportJob.JSONL: parse_jsonl,
+}
+
+
+class CategoryMap:
+    """(name, type) -> category id for one user, creating missing categories on first use"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.ids = {
+            (name.casefold(), type): category_id
+            for category_id, name, type in Category.objects.filter(user_id=user_id).values_list('id', 'name', 'type')
+        }
+
+    def resolve(self, name, type):
+        name = (name or '').strip()[:_category_name_length] or DEFAULT_CATEGORY_NAME
+        key = (name.casefold(), type)
+        if key not in self.ids:
+            category, _ = Category.objects.get_or_create(user_id=self.user_id, name=name, type=type)
+            self.ids[key] = category.id
+        return self.ids[key]
+
+
+def build_transaction(row, job, categories):
+    """Unsaved Transaction for one parsed row; raises ValidationError for a bad row"""
+    if not isinstance(row, dict):
+        raise ValidationError('Row is not an object')
+
+    amount = _amount_field.to_python(str(row.get('amount') or '').replace(',', '').strip())
+    if amount is None:
+        raise ValidationError('amount is required')
+    type = str(row.get('type') or '').strip().lower()
+    if not type:
+        type = Transaction.EXPENSE if amount < 0 else Transaction.INCOME
+    elif type not in (Transaction.INCOME, Transaction.EXPENSE):
+        raise ValidationError(f'Unknown type "{type}"')
+    amount = _amount_field.clean(abs(amount), None)
+    date = _date_field.clean(str(row.get('date') or '').strip(), None)
+
+    return Transaction(
+        user_id=job.user_id,
+        account_id=job.account_id,
+        category_id=categories.resolve(row.get('category'), type),
+        type=type,
+        amount=amount,
+        description=str(row.get('description') or '').strip()[:_description_length],
+        date=date,
+    )
+
+
+def run_import(job, batch_size=None):
+    """
+    Stream job.file into the transactions table; returns the refreshed job.
+    A job that failed part way resumes after its last committed batch;
+    a completed job is left alone.
+    """
+    batch_size = batch_size or settings.TRANSACTION_IMPORT_BATCH_SIZE
+    max_errors = settings.TRANSACTION_IMPORT_MAX_ERRORS
+    job.refresh_from_db()
+    if job.status == ImportJob.COMPLETED:
+        return job
+    jobs = ImportJob.objects.filter(pk=job.pk)
+    jobs.update(status=ImportJob.RUNNING, finished_at=None)
+
+    categories = CategoryMap(job.user_id)
+    resume_after = job.rows_processed
+    progress = {
+        'rows_processed': job.rows_processed, 'rows_imported': job.rows_imported, 'rows_failed': job.rows_failed,
+    }
+    # Row errors of the committed batches; the entry for the failure itself is dropped
+    committed_errors = [error for error in job.errors if error['line'] is not None]
+    errors = list(committed_errors)
+    batch = []
+
+    def flush(bytes_read):
+        with transaction.atomic():
+            if batch:
+                bulk_create_transactions(batch, batch_size=batch_size)
+                progress['rows_imported'] += len(batch)
+            jobs.update(bytes_read=bytes_read, errors=errors, **progress)
+        batch.clear()
+        committed_errors[:] = errors
+
+    try:
+        with job.file.open('rb') as raw:
+            for number, (line_num, row) in enumerate(PARSERS[job.format](raw), start=1):
+                if number <= resume_after:
+                    continue
+                progress['rows_processed'] += 1
+                try:
+                    batch.append(build_transaction(row, job, categories))
+                except ValidationError as e:
+                    progress['rows_failed'] += 1
+                    if len(errors) < max_errors:
+                        errors.append({'line': line_num, 'errors': e.messages})
+                if len(batch) >= batch_size:
+                    flush(raw.tell())
+            flush(job.file_size)
+    except Exception as e:
+        # The counters keep describing the committed batches, i.e. where a re-run resumes
+        errors = [*committed_errors, {'line': None, 'errors': [str(e)]}]
+        jobs.update(status=ImportJob.FAILED, errors=errors, finished_at=timezone.now())
+        raise
+
+    # The upload is only kept around for failed jobs
+    job.file.delete(save=False)
+    jobs.update(status=ImportJob.COMPLETED, file='', finished_at=timezone.now())
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,209 @@
+"""
+Account ledger.
+
+Account.balance is kept equal to ``opening_balance`` plus the signed sum
+(income positive, expense negative) of the account's transactions. Every
+write applies its delta with an atomic ``F()`` update: signals.py does it
+for ORM saves/deletes and bulk.py for bulk inserts and deletes.
+
+AccountBalanceCheckpoint rows store an account's closing balance at the
+end of a day (month ends, see create_checkpoints()). A write dated on or
+before a checkpoint shifts that checkpoint by the same delta, so
+balance_as_of() is one indexed lookup for the nearest checkpoint plus a
+sum over the few transactions after it.
+
+Retention deletes history without changing today's balance: those paths
+pass ``keep_balances=True``, which folds the removed amounts into
+opening_balance instead (and restores take them back out).
+reconcile() recomputes balances and checkpoints from the transactions and
+repairs any drift.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .models import Account, AccountBalanceCheckpoint, Transaction
+
+ZERO = Decimal('0')
+
+
+def signed_amount(prefix=''):
+    """Expression for a transaction's effect on its account balance"""
+    return Case(
+        When(**{f'{prefix}type': Transaction.INCOME}, then=F(f'{prefix}amount')),
+        default=-F(f'{prefix}amount'),
+        output_field=DecimalField(),
+    )
+
+
+def signed_sum(prefix=''):
+    return Coalesce(Sum(signed_amount(prefix)), Value(ZERO), output_field=DecimalField())
+
+
+def entry_amount(type, amount):
+    amount = Transaction._meta.get_field('amount').to_python(amount)
+    return amount if type == Transaction.INCOME else -amount
+
+
+def apply_delta(account_id, day, delta):
+    """Move an account's balance, and its checkpoints on or after day, by delta"""
+    if not account_id or not delta:
+        return
+    Account.objects.filter(pk=account_id).update(balance=F('balance') + delta)
+    AccountBalanceCheckpoint.objects.filter(account_id=account_id, date__gte=day).update(
+        balance=F('balance') + delta
+    )
+
+
+def apply_transactions(transactions, sign=1, keep_balances=False):
+    """
+    Apply a batch of inserted (sign=1) or deleted (sign=-1) transactions.
+    With keep_balances the balance stays put and opening_balance absorbs
+    the change instead.
+    """
+    deltas = defaultdict(lambda: ZERO)
+    for instance in transactions:
+        if instance.account_id:
+            deltas[(instance.account_id, instance.date)] += sign * entry_amount(instance.type, instance.amount)
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        if keep_balances:
+            totals = defaultdict(lambda: ZERO)
+            for (account_id, _), delta in deltas.items():
+                totals[account_id] += delta
+            for account_id, delta in totals.items():
+                Account.objects.filter(pk=account_id).update(opening_balance=F('opening_balance') - delta)
+            return
+        for (account_id, day), delta in sorted(deltas.items()):
+            apply_delta(account_id, day, delta)
+
+
+def forget_range(start_date, end_date):
+    """Fold transactions dated start_date <= date < end_date into opening balances, before they are dropped"""
+    rows = Transaction.objects.filter(
+        account__isnull=False, date__gte=start_date, date__lt=end_date
+    ).values('account_id').annotate(total=signed_sum()).order_by()
+    for row in rows:
+        Account.objects.filter(pk=row['account_id']).update(opening_balance=F('opening_balance') + row['total'])
+
+
+def balance_as_of(account, day):
+    """Closing balance of account at the end of day"""
+    checkpoint = AccountBalanceCheckpoint.objects.filter(
+        account=account, date__lte=day
+    ).order_by('-date').values('date', 'balance').first()
+
+    entries = Transaction.objects.filter(account=account, date__lte=day)
+    if checkpoint:
+        base = checkpoint['balance']
+        entries = entries.filter(date__gt=checkpoint['date'])
+    else:
+        base = account.opening_balance
+    return base + entries.aggregate(total=signed_sum())['total']
+
+
+def month_end(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def create_checkpoints(day=None, account_ids=None):
+    """
+    Upsert a checkpoint at day (default: the end of last month) for every
+    account: its balance minus everything dated after day, in one query.
+    Returns the number of checkpoints written.
+    """
+    if day is None:
+        day = date.today().replace(day=1) - timedelta(days=1)
+    later = Transaction.objects.filter(
+        account_id=OuterRef('pk'), date__gt=day
+    ).values('account_id').annotate(total=signed_sum()).values('total')
+    accounts = Account.objects.annotate(later=Coalesce(Subquery(later), Value(ZERO), output_field=DecimalField()))
+    if account_ids is not None:
+        accounts = accounts.filter(pk__in=account_ids)
+
+    checkpoints = [
+        AccountBalanceCheckpoint(account_id=account_id, date=day, balance=balance - later)
+        for account_id, balance, later in accounts.values_list('id', 'balance', 'later')
+    ]
+    AccountBalanceCheckpoint.objects.bulk_create(
+        checkpoints,
+        update_conflicts=True,
+        unique_fields=['account', 'date'],
+        update_fields=['balance'],
+    )
+    return len(checkpoints)
+
+
+def backfill_checkpoints(account_ids=None):
+    """
+    Month-end checkpoints for each account's whole history, from one
+    grouped query of monthly totals. Returns the number written.
+    """
+    accounts = Account.objects.all()
+    if account_ids is not None:
+        accounts = accounts.filter(pk__in=account_ids)
+    opening = dict(accounts.values_list('id', 'opening_balance'))
+
+    months = Transaction.objects.filter(account_id__in=opening).annotate(
+        month=TruncMonth('date')
+    ).values('account_id', 'month').annotate(total=signed_sum()).order_by('account_id', 'month')
+
+    last_month = date.today().replace(day=1) - timedelta(days=1)
+    checkpoints = []
+    running = {}
+    for row in months:
+        account_id = row['account_id']
+        running[account_id] = running.get(account_id, opening[account_id]) + row['total']
+        day = month_end(row['month'])
+        if day <= last_month:
+            checkpoints.append(AccountBalanceCheckpoint(account_id=account_id, date=day, balance=running[account_id]))
+    with transaction.atomic():
+        AccountBalanceCheckpoint.objects.filter(account_id__in=opening).delete()
+        AccountBalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=1000)
+    return len(checkpoints)
+
+
+def reconcile(repair=True):
+    """
+    Compare every balance and checkpoint with the transactions. Returns
+    (balance drifts, checkpoint drifts) as lists of (account_id, date,
+    stored, expected); with repair the stored values are corrected.
+    """
+    totals = Transaction.objects.filter(
+        account_id=OuterRef('pk')
+    ).values('account_id').annotate(total=signed_sum()).values('total')
+    drifted = Account.objects.annotate(
+        expected=F('opening_balance') + Coalesce(Subquery(totals), Value(ZERO), output_field=DecimalField())
+    ).exclude(balance=F('expected'))
+
+    balance_drifts = []
+    for account_id, balance, expected in drifted.values_list('id', 'balance', 'expected'):
+        balance_drifts.append((account_id, None, balance, expected))
+        if repair:
+            with transaction.atomic():
+                # Recompute under the row lock so concurrent deltas are not lost
+                account = Account.objects.select_for_update().get(pk=account_id)
+                total = Transaction.objects.filter(account_id=account_id).aggregate(total=signed_sum())['total']
+                Account.objects.filter(pk=account_id).update(balance=account.opening_balance + total)
+
+    later = Transaction.objects.filter(
+        account_id=OuterRef('account_id'), date__gt=OuterRef('date')
+    ).values('account_id').annotate(total=signed_sum()).values('total')
+    stale = AccountBalanceCheckpoint.objects.annotate(
+        expected=F('account__balance') - Coalesce(Subquery(later), Value(ZERO), output_field=DecimalField())
+    ).exclude(balance=F('expected'))
+
+    checkpoint_drifts = list(stale.values_list('account_id', 'date', 'balance', 'expected'))
+    if repair and checkpoint_drifts:
+        create_checkpoints_for = defaultdict(list)
+        for account_id, day, _, _ in checkpoint_drifts:
+            create_checkpoints_for[day].append(account_id)
+        for day, account_ids in create_checkpoints_for.items():
+            create_checkpoints(day, account_ids)
+    return balance_drifts, checkpoint_drifts
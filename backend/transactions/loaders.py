@@ -0,0 +1,120 @@
+"""
+Request-scoped batch loaders for the GraphQL relation resolvers.
+
+The GraphQL view executes synchronously, so resolvers cannot defer work
+the way promise/async DataLoaders do. Instead, whoever materialises a list
+of rows queues the keys its children will ask for (``want``); the first
+``load`` that misses fetches every queued key in a single query. A
+response therefore costs one query per relation per nesting level, not
+one per row.
+
+The transaction lists only hold the requesting user's rows, at most as
+many per category/account as the cost estimate assumes for
+``transactionSet`` (casho/query_cost.py), newest first.
+"""
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from casho.query_cost import list_size
+
+from .models import Account, Category, Transaction
+
+
+class BatchLoader:
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self.cache = {}
+        self.queue = set()
+
+    def want(self, keys):
+        self.queue.update(key for key in keys if key is not None and key not in self.cache)
+
+    def prime(self, key, value):
+        self.cache[key] = value
+        self.queue.discard(key)
+
+    def _missing(self):
+        return self.default() if self.default else None
+
+    def load(self, key):
+        if key is None:
+            return self._missing()
+        if key not in self.cache:
+            self.queue.add(key)
+            keys = list(self.queue)
+            self.queue.clear()
+            loaded = self.batch_load_fn(keys)
+            for batch_key in keys:
+                self.cache[batch_key] = loaded.get(batch_key) or self._missing()
+        return self.cache[key]
+
+
+class Loaders:
+    """All loaders for one GraphQL request"""
+
+    def __init__(self, user=None):
+        self.user_id = user.pk if user is not None and user.is_authenticated else None
+        self.category = BatchLoader(self._categories)
+        self.account = BatchLoader(self._accounts)
+        self.user = BatchLoader(get_user_model().objects.in_bulk)
+        self.transactions_by_category = BatchLoader(
+            lambda keys: self._transactions_by('category_id', keys, 'CategoryType.transactionSet'), default=list
+        )
+        self.transactions_by_account = BatchLoader(
+            lambda keys: self._transactions_by('account_id', keys, 'AccountType.transactionSet'), default=list
+        )
+
+    def _categories(self, keys):
+        categories = Category.objects.in_bulk(keys)
+        self.want_category_relations(categories.values())
+        return categories
+
+    def _accounts(self, keys):
+        accounts = Account.objects.in_bulk(keys)
+        self.want_account_relations(accounts.values())
+        return accounts
+
+    def _transactions_by(self, field, keys, size_key):
+        grouped = defaultdict(list)
+        if self.user_id is None:
+            return grouped
+        ordering = [F('date').desc(), F('created_at').desc()]
+        rows = list(
+            Transaction.objects.filter(user_id=self.user_id, **{f'{field}__in': keys})
+            .annotate(position=Window(RowNumber(), partition_by=F(field), order_by=ordering))
+            .filter(position__lte=list_size(size_key))
+            .order_by(*ordering)
+        )
+        self.want_transaction_relations(rows)
+        for row in rows:
+            grouped[getattr(row, field)].append(row)
+        return grouped
+
+    def want_transaction_relations(self, transactions):
+        self.category.want(row.category_id for row in transactions)
+        self.account.want(row.account_id for row in transactions)
+        self.user.want(row.user_id for row in transactions)
+
+    def want_category_relations(self, categories):
+        self.transactions_by_category.want(row.pk for row in categories)
+        self.user.want(row.user_id for row in categories)
+
+    def want_account_relations(self, accounts):
+        self.transactions_by_account.want(row.pk for row in accounts)
+        self.user.want(row.user_id for row in accounts)
+
+
+def get_loaders(info):
+    """Loaders bound to the current request, created on first use"""
+    context = info.context
+    loaders = getattr(context, '_graphql_loaders', None)
+    if loaders is None:
+        user = getattr(context, 'user', None)
+        loaders = context._graphql_loaders = Loaders(user)
+        if user is not None and user.is_authenticated:
+            loaders.user.prime(user.pk, user)
+    return loaders
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import ledger
+
+
+class Command(BaseCommand):
+    help = 'Backfill account balance checkpoints or reconcile balances with transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backfill', action='store_true',
+            help='Rebuild month-end checkpoints for the whole history',
+        )
+        parser.add_argument(
+            '--account', type=int, action='append', dest='account_ids',
+            help='Limit --backfill to this account id (can be repeated)',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift; exit non-zero if any is found',
+        )
+
+    def handle(self, *args, backfill=False, account_ids=None, check=False, **options):
+        if backfill:
+            written = ledger.backfill_checkpoints(account_ids)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {written} checkpoints'))
+            return
+
+        balance_drifts, checkpoint_drifts = ledger.reconcile(repair=not check)
+        for account_id, day, stored, expected in (balance_drifts + checkpoint_drifts)[:50]:
+            self.stderr.write(f'account {account_id} {day or "balance"}: stored {stored}, expected {expected}')
+        if check and (balance_drifts or checkpoint_drifts):
+            raise CommandError(
+                f'{len(balance_drifts)} balances and {len(checkpoint_drifts)} checkpoints out of date'
+            )
+        action = 'Found' if check else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {len(balance_drifts)} balance and {len(checkpoint_drifts)} checkpoint drifts'
+        ))
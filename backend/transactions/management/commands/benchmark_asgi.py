@@ -0,0 +1,212 @@
+import asyncio
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from transactions.bulk import bulk_create_transactions
+from transactions.models import Category, Transaction
+
+User = get_user_model()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def host():
+    return next((name for name in settings.ALLOWED_HOSTS if name and '*' not in name), 'localhost').lstrip('.')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the WSGI (casho.wsgi) and ASGI (casho.asgi) deployments serving an endpoint '
+        'with simulated database latency: each runs in a child process, which reports its '
+        'memory and how many requests it had in flight. Creates a temporary user with '
+        'transactions in the configured database and deletes it afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/transactions/', help='Authenticated GET endpoint')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once on ASGI')
+        parser.add_argument('--requests', type=int, default=20, help='Requests served one at a time on WSGI')
+        parser.add_argument('--db-latency', type=float, default=50, help='Milliseconds added to every query')
+        parser.add_argument('--memory-budget', type=int, default=1024, help='MB to size both deployments for')
+        parser.add_argument('--child', choices=['wsgi', 'asgi'], help=None)
+        parser.add_argument('--token', help=None)
+
+    def handle(self, *args, path, concurrency, requests, db_latency, memory_budget, child=None, token=None,
+               **options):
+        if child:
+            self.run_child(child, path, token, concurrency, requests, db_latency)
+            return
+        if concurrency < 1 or requests < 1:
+            raise CommandError('--concurrency and --requests must be at least 1')
+
+        owner = self.create_user()
+        try:
+            token = str(RefreshToken.for_user(owner).access_token)
+            results = {
+                deployment: self.spawn(deployment, path, token, concurrency, requests, db_latency)
+                for deployment in ('wsgi', 'asgi')
+            }
+        finally:
+            OutstandingToken.objects.filter(user=owner).delete()
+            owner.delete()
+
+        wsgi, asgi = results['wsgi'], results['asgi']
+        self.stdout.write(
+            f"{'deployment':<11} {'in flight':>9} {'threads':>8} {'req/s':>8} {'base MB':>8} {'peak MB':>8} "
+            f"{'MB/request':>11}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<11} {result['in_flight']:>9} {result['threads']:>8} {result['per_second']:>8.1f} "
+                f"{result['base_mb']:>8.1f} {result['peak_mb']:>8.1f} {result['mb_per_request']:>11.2f}"
+            )
+        # A sync worker is a whole process per in-flight request
+        wsgi_capacity = int(memory_budget // wsgi['peak_mb'])
+        asgi_capacity = int(max(memory_budget - asgi['base_mb'], 0) // max(asgi['mb_per_request'], 0.01))
+        self.stdout.write(self.style.SUCCESS(
+            f'Concurrent requests in {memory_budget} MB: WSGI sync workers {wsgi_capacity}, '
+            f'one ASGI process {asgi_capacity} (bounded in practice by database connections)'
+        ))
+        self.stdout.write(
+            'Django 4.2 runs each async ORM and cache call through sync_to_async: an in-flight ASGI '
+            'request holds an executor thread (see "threads") while each of its queries runs, and '
+            '/graphql/ (AsyncGraphQLView) holds one for the whole request. The capacity above comes from '
+            'requests waiting between queries without a thread or a process, not from database I/O on '
+            'the event loop'
+        )
+
+    def create_user(self):
+        owner = User.objects.create_user(username='benchmark-asgi', email='benchmark-asgi@example.invalid')
+        category = Category.objects.create(name='餐饮', type='expense', user=owner)
+        today = date.today()
+        bulk_create_transactions([
+            Transaction(user=owner, category=category, type='expense', amount=Decimal(i % 500 + 1),
+                        description=f'交易 {i}', date=today - timedelta(days=i % 365))
+            for i in range(200)
+        ])
+        return owner
+
+    def spawn(self, deployment, path, token, concurrency, requests, db_latency):
+        command = [
+            sys.executable, '-m', 'django', 'benchmark_asgi', '--child', deployment, '--token', token,
+            '--path', path, '--concurrency', str(concurrency), '--requests', str(requests),
+            '--db-latency', str(db_latency),
+        ]
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        completed = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f'{deployment} run failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run_child(self, deployment, path, token, concurrency, requests, db_latency):
+        def delay(execute, sql, params, many, context):
+            time.sleep(db_latency / 1000)
+            return execute(sql, params, many, context)
+
+        def slow_queries(sender, connection, **kwargs):
+            # Fired on every reconnect of the same (per-thread) connection object
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        connection_created.connect(slow_queries, weak=False)
+        path, _, query = path.partition('?')
+        if deployment == 'wsgi':
+            result = self.run_wsgi(path, query, token, requests)
+        else:
+            result = asyncio.run(self.run_asgi(path, query, token, concurrency))
+        self.stdout.write(json.dumps(result))
+
+    def run_wsgi(self, path, query, token, requests):
+        from casho.wsgi import application
+
+        def call():
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': host(), 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': host(), 'HTTP_AUTHORIZATION': f'Bearer {token}', 'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': True,
+                'wsgi.run_once': False,
+            }
+            statuses = []
+            response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            if not statuses[0].startswith('200'):
+                raise CommandError(f'{path} answered {statuses[0]}')
+
+        call()
+        base = peak_rss_mb()
+        started = time.perf_counter()
+        for _ in range(requests):
+            call()
+        elapsed = time.perf_counter() - started
+        peak = peak_rss_mb()
+        return {
+            'in_flight': 1, 'threads': threading.active_count(), 'per_second': requests / elapsed,
+            'base_mb': base, 'peak_mb': peak, 'mb_per_request': peak,
+        }
+
+    async def run_asgi(self, path, query, token, concurrency):
+        from casho.asgi import application
+
+        async def call():
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'server': (host(), 80), 'client': ('127.0.0.1', 0),
+                'headers': [(b'host', host().encode()), (b'authorization', f'Bearer {token}'.encode())],
+            }
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            await application(scope, receive, send)
+            if messages[0]['status'] != 200:
+                raise CommandError(f'{path} answered {messages[0]["status"]}')
+
+        await call()
+        base = peak_rss_mb()
+        threads = threading.active_count()
+
+        async def sample():
+            nonlocal threads
+            while True:
+                threads = max(threads, threading.active_count())
+                await asyncio.sleep(0.005)
+
+        sampler = asyncio.ensure_future(sample())
+        started = time.perf_counter()
+        await asyncio.gather(*(call() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+        peak = peak_rss_mb()
+        return {
+            'in_flight': concurrency, 'threads': threads, 'per_second': concurrency / elapsed,
+            'base_mb': base, 'peak_mb': peak, 'mb_per_request': (peak - base) / concurrency,
+        }
@@ -0,0 +1,118 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from transactions.bulk import bulk_create_transactions
+from transactions.models import Category, Transaction
+from transactions.serializers import TransactionRowSerializer, TransactionSerializer
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+def serialize_instances(queryset, size):
+    return TransactionSerializer(list(queryset[:size]), many=True).data
+
+
+def serialize_joined_instances(queryset, size):
+    return TransactionSerializer(list(queryset.select_related('category')[:size]), many=True).data
+
+
+def serialize_rows(queryset, size):
+    return TransactionRowSerializer(list(TransactionRowSerializer.rows(queryset)[:size]), many=True).data
+
+
+PATHS = [
+    ('instances', serialize_instances),
+    ('select_related', serialize_joined_instances),
+    ('rows', serialize_rows),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the transaction list serialization paths (model instances, select_related, '
+        'values() rows) per page size: queries, time to rendered JSON, and that the bytes match. '
+        'Runs on synthetic rows inside a rolled-back transaction unless --user is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='20,100,500,1000', help='Comma-separated page sizes')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path and size; the best is reported')
+        parser.add_argument('--user', help='Benchmark an existing user\'s transactions (username)')
+
+    def handle(self, *args, sizes, repeat, user=None, **options):
+        try:
+            sizes = [int(size) for size in sizes.split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+
+        if user:
+            try:
+                owner = User.objects.get(username=user)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{user}" does not exist')
+            self.run(owner, sizes, repeat)
+            return
+
+        try:
+            with transaction.atomic():
+                self.run(self.create_rows(max(sizes)), sizes, repeat)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_rows(self, count):
+        rng = random.Random(0)
+        owner = User.objects.create_user(username='benchmark-list', email='benchmark-list@example.invalid')
+        categories = [
+            Category.objects.create(name=f'分类{i}', type=rng.choice(['income', 'expense']), icon='🍜', user=owner)
+            for i in range(10)
+        ]
+        today = date.today()
+        rows = []
+        for i in range(count):
+            category = rng.choice(categories)
+            rows.append(Transaction(
+                user=owner, category=category, type=category.type,
+                amount=Decimal(rng.randint(1, 10 ** 6)) / 100,
+                description=f'交易 {i}' if i % 3 else '',
+                date=today - timedelta(days=rng.randint(0, 365)),
+            ))
+        bulk_create_transactions(rows)
+        return owner
+
+    def run(self, owner, sizes, repeat):
+        queryset = Transaction.objects.filter(user=owner).order_by('-date', '-created_at')
+        renderer = JSONRenderer()
+        self.stdout.write(f"{'size':>6} {'path':<15} {'queries':>7} {'ms':>9} {'speedup':>8}")
+        for size in sizes:
+            baseline = None
+            expected = None
+            for name, serialize in PATHS:
+                best = None
+                for _ in range(repeat):
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        body = renderer.render(serialize(queryset, size))
+                        elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                if expected is None:
+                    expected = body
+                elif body != expected:
+                    raise CommandError(f'{name} output differs from instances at page size {size}')
+                baseline = baseline or best
+                self.stdout.write(
+                    f'{size:>6} {name:<15} {len(queries):>7} {best * 1000:>9.2f} {baseline / best:>7.1f}x'
+                )
+        self.stdout.write(self.style.SUCCESS('All paths rendered identical JSON'))
@@ -0,0 +1,101 @@
+import csv
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from transactions import rollups
+from transactions.importers import DEFAULT_CATEGORY_NAME
+from transactions.models import Category, Transaction
+from transactions.stats_cache import bump_data_version
+
+User = get_user_model()
+
+COLUMNS = ('date', 'amount', 'description', 'category', 'type')
+STAGING_TABLE = 'transaction_copy_staging'
+
+
+class Command(BaseCommand):
+    help = (
+        'Load historical transactions for one user from a CSV file with PostgreSQL COPY. '
+        'Columns: date, amount, description, category, type (header row required)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to load')
+        parser.add_argument('--user', required=True, help='Username that owns the transactions')
+
+    def handle(self, *args, path, user, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('COPY loading requires PostgreSQL')
+        try:
+            owner = User.objects.get(username=user)
+        except User.DoesNotExist:
+            raise CommandError(f'User "{user}" does not exist')
+
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            header = [column.strip().lower() for column in next(csv.reader([f.readline()]), [])]
+            unknown = set(header) - set(COLUMNS)
+            if unknown:
+                raise CommandError(f'Unknown columns: {", ".join(sorted(unknown))}')
+            if not {'date', 'amount'} <= set(header):
+                raise CommandError('The date and amount columns are required')
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                loaded = self.copy(cursor, f, header)
+                created = self.insert(cursor, owner.id)
+                rollups.rebuild([owner.id])
+                bump_data_version(owner.id)
+
+        self.stdout.write(self.style.SUCCESS(f'Loaded {loaded} rows, inserted {created} transactions'))
+
+    def copy(self, cursor, f, header):
+        """COPY the rest of the file into a temp table and normalise type/amount/category there"""
+        cursor.execute(
+            f'CREATE TEMP TABLE {STAGING_TABLE} ('
+            ' date date, amount numeric(10, 2), description text, category text, type text'
+            ') ON COMMIT DROP'
+        )
+        cursor.copy_expert(f'COPY {STAGING_TABLE} ({", ".join(header)}) FROM STDIN WITH (FORMAT csv)', f)
+        loaded = cursor.rowcount
+
+        cursor.execute(
+            f"UPDATE {STAGING_TABLE} SET"
+            f" type = COALESCE(NULLIF(lower(trim(type)), ''),"
+            f"  CASE WHEN amount < 0 THEN %s ELSE %s END),"
+            f" amount = abs(amount),"
+            f" description = left(COALESCE(trim(description), ''), %s),"
+            f" category = left(COALESCE(NULLIF(trim(category), ''), %s), %s)",
+            [
+                Transaction.EXPENSE, Transaction.INCOME,
+                Transaction._meta.get_field('description').max_length,
+                DEFAULT_CATEGORY_NAME, Category._meta.get_field('name').max_length,
+            ],
+        )
+        cursor.execute(
+            f'SELECT count(*) FROM {STAGING_TABLE}'
+            f' WHERE type NOT IN (%s, %s) OR date IS NULL OR amount IS NULL',
+            [Transaction.INCOME, Transaction.EXPENSE],
+        )
+        invalid = cursor.fetchone()[0]
+        if invalid:
+            raise CommandError(f'{invalid} rows have an unknown type or a missing date/amount; nothing was loaded')
+        return loaded
+
+    def insert(self, cursor, user_id):
+        categories = Category._meta.db_table
+        cursor.execute(
+            f'INSERT INTO {categories} (name, type, icon, color, user_id, created_at)'
+            f" SELECT DISTINCT category, type, '', %s, %s, now() FROM {STAGING_TABLE}"
+            f' ON CONFLICT (name, user_id, type) DO NOTHING',
+            [Category._meta.get_field('color').default, user_id],
+        )
+        cursor.execute(
+            f'INSERT INTO {Transaction._meta.db_table}'
+            f' (user_id, category_id, type, amount, description, date, created_at, updated_at)'
+            f' SELECT %s, c.id, s.type, s.amount, s.description, s.date, now(), now()'
+            f' FROM {STAGING_TABLE} s'
+            f' JOIN {categories} c ON c.user_id = %s AND c.name = s.category AND c.type = s.type',
+            [user_id, user_id],
+        )
+        return cursor.rowcount
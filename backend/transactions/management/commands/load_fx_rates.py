@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import fx
+
+
+class Command(BaseCommand):
+    help = (
+        'Load daily exchange rates from a CSV file with date, currency and rate columns '
+        '(rate = units of currency per unit of FX_BASE_CURRENCY). Existing rates are replaced'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to load')
+
+    def handle(self, *args, path, **options):
+        try:
+            rates = fx.read_rates_file(path)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        written = fx.load_rates(rates)
+        self.stdout.write(self.style.SUCCESS(f'Loaded {written} rates'))
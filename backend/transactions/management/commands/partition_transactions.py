@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from transactions import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Manage PostgreSQL range partitions of the transactions table: convert the table '
+        '(--convert), create future partitions, or list them (--list)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='store_true',
+            help='Rebuild the table as a partitioned table and copy every row (takes an exclusive lock)',
+        )
+        parser.add_argument('--interval', choices=partitions.INTERVALS, help='Partition size for --convert')
+        parser.add_argument('--ahead', type=int, help='Future partitions to create')
+        parser.add_argument('--keep-legacy', action='store_true', help='Keep the old table as <table>_legacy')
+        parser.add_argument('--list', action='store_true', dest='list_only', help='List partitions and exit')
+
+    def handle(self, *args, convert=False, interval=None, ahead=None, keep_legacy=False, list_only=False,
+               **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+
+        if list_only:
+            for name, start, end in partitions.list_partitions():
+                self.stdout.write(f'{name}: {start} .. {end}' if start else f'{name}: DEFAULT')
+            return
+
+        if convert:
+            if partitions.is_partitioned():
+                self.stdout.write('The table is already partitioned')
+            else:
+                copied = partitions.convert(interval=interval, ahead=ahead, keep_legacy=keep_legacy)
+                self.stdout.write(self.style.SUCCESS(f'Partitioned the table and copied {copied} rows'))
+        elif not partitions.is_partitioned():
+            raise CommandError('The table is not partitioned yet; run with --convert first')
+
+        created = partitions.create_partitions(ahead=ahead, interval=interval)
+        self.stdout.write(self.style.SUCCESS(f'Created {len(created)} partitions'))
@@ -0,0 +1,41 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from transactions.models import RetentionRun
+from transactions.retention import run_retention, start_run
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete transactions older than the retention period in primary-key batches, '
+        'optionally archiving them first. Resumes an interrupted run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=date.fromisoformat, help='Cutoff date (YYYY-MM-DD) for a new run')
+        parser.add_argument('--archive', action='store_true', default=None, help='Archive rows before deleting them')
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--pause', type=float, help='Seconds to sleep between batches')
+        parser.add_argument('--status', action='store_true', help='Show recent runs and exit')
+
+    def handle(self, *args, before=None, archive=None, batch_size=None, pause=None, status=False, **options):
+        if status:
+            for run in RetentionRun.objects.all()[:10]:
+                self.stdout.write(
+                    f'#{run.id} before {run.cutoff_date} {run.status} {run.progress:.0%}: '
+                    f'{run.rows_deleted} deleted, {run.rows_archived} archived in {run.batches} batches '
+                    f'(started {run.started_at:%Y-%m-%d %H:%M}){" - " + run.error if run.error else ""}'
+                )
+            return
+
+        run = start_run(before, archive)
+        self.stdout.write(f'Run #{run.id}: deleting transactions before {run.cutoff_date}')
+
+        def report(run):
+            self.stdout.write(f'  batch {run.batches}: {run.rows_deleted} deleted, up to id {run.last_id} ({run.progress:.0%})')
+
+        run = run_retention(run, batch_size=batch_size, pause=pause, on_batch=report)
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {run.rows_deleted} transactions ({run.rows_archived} archived) in {run.batches} batches'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the daily transaction rollups from raw transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare the rollups with raw transactions; exit non-zero on drift',
+        )
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='Limit to this user id (can be repeated)',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, verify=False, user_ids=None, batch_size=1000, **options):
+        if verify:
+            mismatches = rollups.verify(user_ids)
+            for key, expected, actual in mismatches[:50]:
+                self.stderr.write(f'{key}: expected {expected}, found {actual}')
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} rollup rows out of date')
+            self.stdout.write(self.style.SUCCESS('Rollups match raw transactions'))
+            return
+
+        written = rollups.rebuild(user_ids, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} rollup rows'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from transactions import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate the transaction search trigger and recompute search vectors (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, batch_size=5000, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Transaction search indexing requires PostgreSQL')
+        updated = search.rebuild(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {updated} transactions'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from transactions.retention import restore_archive
+
+
+class Command(BaseCommand):
+    help = 'Restore archived transactions written by the retention job'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, dest='user_id', help='Only restore this user id')
+        parser.add_argument('--month', help='Only restore this month (YYYY-MM)')
+        parser.add_argument('--root', help='Archive directory (default: TRANSACTION_ARCHIVE_ROOT)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, user_id=None, month=None, root=None, batch_size=1000, **options):
+        restored = restore_archive(root, user_id=user_id, month=month, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Restored {restored} transactions'))
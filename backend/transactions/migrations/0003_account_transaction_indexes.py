@@ -0,0 +1,132 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Account',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Account Name')),
+                ('currency', models.CharField(choices=[('USD', 'US Dollar'), ('CAD', 'Canadian Dollar'), ('CNY', 'Chinese Yuan')], max_length=10, verbose_name='Currency')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Balance')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Account',
+                'verbose_name_plural': 'Accounts',
+                'db_table': 'accounts',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='category',
+            options={'verbose_name': 'Category', 'verbose_name_plural': 'Categories'},
+        ),
+        migrations.AlterModelOptions(
+            name='transaction',
+            options={'ordering': ['-date', '-created_at'], 'verbose_name': 'Transaction', 'verbose_name_plural': 'Transactions'},
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='color',
+            field=models.CharField(default='#000000', max_length=7, verbose_name='Color'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Created At'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='icon',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Icon'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='Category Name'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='type',
+            field=models.CharField(choices=[('income', 'Income'), ('expense', 'Expense')], max_length=10, verbose_name='Type'),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Amount'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.category', verbose_name='Category'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Created At'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='date',
+            field=models.DateField(verbose_name='Transaction Date'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='description',
+            field=models.CharField(blank=True, max_length=200, verbose_name='Description'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='type',
+            field=models.CharField(choices=[('income', 'Income'), ('expense', 'Expense')], max_length=10, verbose_name='Type'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Updated At'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-date', '-created_at'], name='txn_user_date_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'type', 'date'], include=('amount', 'category'), name='txn_user_type_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='transactions.account', verbose_name='Account'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='account',
+            unique_together={('name', 'user')},
+        ),
+    ]
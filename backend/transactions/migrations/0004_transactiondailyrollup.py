@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    TransactionDailyRollup = apps.get_model('transactions', 'TransactionDailyRollup')
+    rows = Transaction.objects.values('user_id', 'category_id', 'type', 'date').annotate(
+        total=models.Sum('amount'), rows=models.Count('id')
+    ).order_by()
+    batch = []
+    for row in rows.iterator(chunk_size=1000):
+        batch.append(TransactionDailyRollup(
+            user_id=row['user_id'], category_id=row['category_id'], type=row['type'],
+            date=row['date'], amount=row['total'], count=row['rows'],
+        ))
+        if len(batch) >= 1000:
+            TransactionDailyRollup.objects.bulk_create(batch)
+            batch = []
+    TransactionDailyRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0003_account_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('income', 'Income'), ('expense', 'Expense')], max_length=10, verbose_name='Type')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Amount')),
+                ('count', models.IntegerField(default=0, verbose_name='Count')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.category', verbose_name='Category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Transaction Daily Rollup',
+                'verbose_name_plural': 'Transaction Daily Rollups',
+                'db_table': 'transaction_daily_rollups',
+                'unique_together': {('user', 'date', 'category', 'type')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0004_transactiondailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/', verbose_name='File')),
+                ('format', models.CharField(choices=[('csv', 'CSV'), ('ofx', 'OFX'), ('jsonl', 'JSON Lines')], max_length=10, verbose_name='Format')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('file_size', models.BigIntegerField(default=0, verbose_name='File Size')),
+                ('bytes_read', models.BigIntegerField(default=0, verbose_name='Bytes Read')),
+                ('rows_processed', models.IntegerField(default=0, verbose_name='Rows Processed')),
+                ('rows_imported', models.IntegerField(default=0, verbose_name='Rows Imported')),
+                ('rows_failed', models.IntegerField(default=0, verbose_name='Rows Failed')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Errors')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='transactions.account', verbose_name='Account')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Import Job',
+                'verbose_name_plural': 'Import Jobs',
+                'db_table': 'import_jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
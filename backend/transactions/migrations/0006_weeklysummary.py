@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0005_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField(verbose_name='Start Date')),
+                ('end_date', models.DateField(verbose_name='End Date')),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Income')),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Expense')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Balance')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Weekly Summary',
+                'verbose_name_plural': 'Weekly Summaries',
+                'db_table': 'weekly_summaries',
+                'unique_together': {('user', 'start_date', 'end_date')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_weeklysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff_date', models.DateField(verbose_name='Cutoff Date')),
+                ('archive', models.BooleanField(default=False, verbose_name='Archive')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=10, verbose_name='Status')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Last ID')),
+                ('max_id', models.BigIntegerField(default=0, verbose_name='Max ID')),
+                ('batches', models.IntegerField(default=0, verbose_name='Batches')),
+                ('rows_deleted', models.BigIntegerField(default=0, verbose_name='Rows Deleted')),
+                ('rows_archived', models.BigIntegerField(default=0, verbose_name='Rows Archived')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished At')),
+            ],
+            options={
+                'verbose_name': 'Retention Run',
+                'verbose_name_plural': 'Retention Runs',
+                'db_table': 'retention_runs',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
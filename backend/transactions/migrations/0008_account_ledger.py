@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_opening_balances(apps, schema_editor):
+    # Balances were never moved by transactions, so keep what users see and
+    # make opening_balance the part not explained by recorded transactions
+    Account = apps.get_model('transactions', 'Account')
+    Transaction = apps.get_model('transactions', 'Transaction')
+    signed = models.Case(
+        models.When(type='income', then=models.F('amount')),
+        default=-models.F('amount'),
+        output_field=models.DecimalField(),
+    )
+    totals = dict(
+        Transaction.objects.filter(account__isnull=False).values('account_id').annotate(
+            total=models.Sum(signed)
+        ).order_by().values_list('account_id', 'total')
+    )
+    for account in Account.objects.only('id', 'balance').iterator():
+        Account.objects.filter(pk=account.pk).update(opening_balance=account.balance - totals.get(account.pk, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0007_retentionrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Balance')),
+            ],
+            options={
+                'verbose_name': 'Account Balance Checkpoint',
+                'verbose_name_plural': 'Account Balance Checkpoints',
+                'db_table': 'account_balance_checkpoints',
+            },
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='opening_balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Opening Balance'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'date'], include=('amount', 'type'), name='txn_account_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='accountbalancecheckpoint',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.account', verbose_name='Account'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='accountbalancecheckpoint',
+            unique_together={('account', 'date')},
+        ),
+        migrations.RunPython(set_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_rollups_by_account(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    TransactionDailyRollup = apps.get_model('transactions', 'TransactionDailyRollup')
+    TransactionDailyRollup.objects.all().delete()
+    rows = Transaction.objects.values('user_id', 'category_id', 'type', 'date', 'account_id').annotate(
+        total=models.Sum('amount'), rows=models.Count('id')
+    ).order_by()
+    batch = []
+    for row in rows.iterator(chunk_size=1000):
+        batch.append(TransactionDailyRollup(
+            user_id=row['user_id'], category_id=row['category_id'], type=row['type'], date=row['date'],
+            account_id=row['account_id'], amount=row['total'], count=row['rows'],
+        ))
+        if len(batch) >= 1000:
+            TransactionDailyRollup.objects.bulk_create(batch)
+            batch = []
+    TransactionDailyRollup.objects.bulk_create(batch)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0008_account_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('USD', 'US Dollar'), ('CAD', 'Canadian Dollar'), ('CNY', 'Chinese Yuan')], max_length=10, verbose_name='Currency')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=20, verbose_name='Rate')),
+            ],
+            options={
+                'verbose_name': 'FX Rate',
+                'verbose_name_plural': 'FX Rates',
+                'db_table': 'fx_rates',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='transactiondailyrollup',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='transactiondailyrollup',
+            name='account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='transactions.account', verbose_name='Account'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='transactiondailyrollup',
+            unique_together={('user', 'date', 'category', 'type', 'account')},
+        ),
+        migrations.AddConstraint(
+            model_name='transactiondailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('account__isnull', True)), fields=('user', 'date', 'category', 'type'), name='rollup_unique_without_account'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='fxrate',
+            unique_together={('currency', 'date')},
+        ),
+        migrations.RunPython(split_rollups_by_account, migrations.RunPython.noop),
+    ]
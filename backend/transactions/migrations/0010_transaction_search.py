@@ -0,0 +1,47 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+def add_search_column(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from transactions import search
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE transactions ADD COLUMN IF NOT EXISTS {search.COLUMN} tsvector')
+        for sql in search.trigger_sql('transactions'):
+            cursor.execute(sql)
+        search.backfill(cursor, 'transactions')
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS txn_search_vector_idx ON transactions USING gin ({search.COLUMN})'
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS txn_description_trgm_idx ON transactions USING gin (description gin_trgm_ops)'
+        )
+
+
+def drop_search_column(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from transactions import search
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {search.TRIGGER} ON transactions')
+        cursor.execute(f'DROP FUNCTION IF EXISTS {search.FUNCTION}()')
+        cursor.execute('DROP INDEX IF EXISTS txn_description_trgm_idx')
+        cursor.execute(f'ALTER TABLE transactions DROP COLUMN IF EXISTS {search.COLUMN}')
+
+
+class Migration(migrations.Migration):
+    # Each backfill batch commits on its own instead of the whole table
+    # being rewritten and locked in one transaction
+    atomic = False
+
+    dependencies = [
+        ('transactions', '0009_fx_rates_rollup_account'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(add_search_column, drop_search_column),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0011_keyset_list_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-date', '-created_at', '-id'], name='txn_user_keyset_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='txn_user_date_created_id_idx',
+        ),
+    ]
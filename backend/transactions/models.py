@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -41,7 +41,9 @@ class Account(models.Model):
     ]
     name = models.CharField(max_length=100, verbose_name='Account Name')
     currency = models.CharField(max_length=10, choices=CURRENCY_CHOICES, verbose_name='Currency')
+    # balance = opening_balance + signed sum of the account's transactions, see ledger.py
     balance = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Balance')
+    opening_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Opening Balance')
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='User')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Updated At')
@@ -81,6 +83,28 @@ class Transaction(models.Model):
         verbose_name = 'Transaction'
         verbose_name_plural = 'Transactions'
         ordering = ['-date', '-created_at']
+        indexes = [
+            # List views and GraphQL: per-user history, newest first; the id
+            # tiebreak lets keyset pages (pagination.KEYSET_ORDERING) start
+            # at the cursor instead of sorting the user's whole history
+            models.Index(
+                fields=['user', '-date', '-created_at', '-id'],
+                name='txn_user_keyset_idx',
+            ),
+            # Stats and reports: per-user date range split by type;
+            # amount/category are included so aggregates can use index-only scans
+            models.Index(
+                fields=['user', 'type', 'date'],
+                name='txn_user_type_date_idx',
+                include=['amount', 'category'],
+            ),
+            # Account ledger: balance-as-of sums after a checkpoint
+            models.Index(
+                fields=['account', 'date'],
+                name='txn_account_date_idx',
+                include=['amount', 'type'],
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.amount} - {self.description}"
@@ -89,4 +113,178 @@ class Transaction(models.Model):
         # Automatically set type to category type
         if not self.type:
             self.type = self.category.type
-        super().save(*args, **kwargs) 
\ No newline at end of file
+        # Keep the row and its daily rollup (see signals.py) in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class AccountBalanceCheckpoint(models.Model):
+    """Closing balance of an account at the end of a day"""
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, verbose_name='Account')
+    date = models.DateField(verbose_name='Date')
+    balance = models.DecimalField(max_digits=14, decimal_places=2, verbose_name='Balance')
+
+    class Meta:
+        db_table = 'account_balance_checkpoints'
+        verbose_name = 'Account Balance Checkpoint'
+        verbose_name_plural = 'Account Balance Checkpoints'
+        unique_together = ['account', 'date']
+
+    def __str__(self):
+        return f"{self.account_id} - {self.date} - {self.balance}"
+
+
+class FxRate(models.Model):
+    """Daily exchange rate: units of currency per one unit of FX_BASE_CURRENCY"""
+    currency = models.CharField(max_length=10, choices=Account.CURRENCY_CHOICES, verbose_name='Currency')
+    date = models.DateField(verbose_name='Date')
+    rate = models.DecimalField(max_digits=20, decimal_places=10, verbose_name='Rate')
+
+    class Meta:
+        db_table = 'fx_rates'
+        verbose_name = 'FX Rate'
+        verbose_name_plural = 'FX Rates'
+        unique_together = ['currency', 'date']
+
+    def __str__(self):
+        return f"{self.currency} - {self.date} - {self.rate}"
+
+
+class TransactionDailyRollup(models.Model):
+    """Per-day transaction totals, maintained on every Transaction write"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='User')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name='Category')
+    # Split by account so stats can convert each amount from its account's currency
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, verbose_name='Account', null=True, blank=True)
+    type = models.CharField(max_length=10, choices=Transaction.TYPE_CHOICES, verbose_name='Type')
+    date = models.DateField(verbose_name='Date')
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Amount')
+    count = models.IntegerField(default=0, verbose_name='Count')
+
+    class Meta:
+        db_table = 'transaction_daily_rollups'
+        verbose_name = 'Transaction Daily Rollup'
+        verbose_name_plural = 'Transaction Daily Rollups'
+        # Leading (user, date) also serves the stats range scans
+        unique_together = ['user', 'date', 'category', 'type', 'account']
+        constraints = [
+            # NULLs never collide in the unique index above
+            models.UniqueConstraint(
+                fields=['user', 'date', 'category', 'type'],
+                condition=models.Q(account__isnull=True),
+                name='rollup_unique_without_account',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.date} - {self.category_id} - {self.amount}"
+
+
+class ImportJob(models.Model):
+    """Bank statement import, processed in the background"""
+    CSV = 'csv'
+    OFX = 'ofx'
+    JSONL = 'jsonl'
+
+    FORMAT_CHOICES = [
+        (CSV, 'CSV'),
+        (OFX, 'OFX'),
+        (JSONL, 'JSON Lines'),
+    ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='User')
+    account = models.ForeignKey(Account, on_delete=models.SET_NULL, verbose_name='Account', null=True, blank=True)
+    file = models.FileField(upload_to='imports/%Y/%m/', verbose_name='File')
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, verbose_name='Format')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name='Status')
+    file_size = models.BigIntegerField(default=0, verbose_name='File Size')
+    bytes_read = models.BigIntegerField(default=0, verbose_name='Bytes Read')
+    rows_processed = models.IntegerField(default=0, verbose_name='Rows Processed')
+    rows_imported = models.IntegerField(default=0, verbose_name='Rows Imported')
+    rows_failed = models.IntegerField(default=0, verbose_name='Rows Failed')
+    errors = models.JSONField(default=list, blank=True, verbose_name='Errors')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Finished At')
+
+    class Meta:
+        db_table = 'import_jobs'
+        verbose_name = 'Import Job'
+        verbose_name_plural = 'Import Jobs'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.user_id} - {self.format} - {self.status}"
+
+
+class WeeklySummary(models.Model):
+    """Per-user totals for one weekly summary window, written by generate_weekly_summary"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='User')
+    start_date = models.DateField(verbose_name='Start Date')
+    end_date = models.DateField(verbose_name='End Date')
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Income')
+    expense = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Expense')
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Balance')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Updated At')
+
+    class Meta:
+        db_table = 'weekly_summaries'
+        verbose_name = 'Weekly Summary'
+        verbose_name_plural = 'Weekly Summaries'
+        unique_together = ['user', 'start_date', 'end_date']
+
+    def __str__(self):
+        return f"{self.user_id} - {self.start_date} - {self.balance}"
+
+
+class RetentionRun(models.Model):
+    """One run of the transaction retention job, kept for progress and auditing"""
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+
+    cutoff_date = models.DateField(verbose_name='Cutoff Date')
+    archive = models.BooleanField(default=False, verbose_name='Archive')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RUNNING, verbose_name='Status')
+    last_id = models.BigIntegerField(default=0, verbose_name='Last ID')
+    max_id = models.BigIntegerField(default=0, verbose_name='Max ID')
+    batches = models.IntegerField(default=0, verbose_name='Batches')
+    rows_deleted = models.BigIntegerField(default=0, verbose_name='Rows Deleted')
+    rows_archived = models.BigIntegerField(default=0, verbose_name='Rows Archived')
+    error = models.TextField(blank=True, verbose_name='Error')
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name='Started At')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Finished At')
+
+    class Meta:
+        db_table = 'retention_runs'
+        verbose_name = 'Retention Run'
+        verbose_name_plural = 'Retention Runs'
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.cutoff_date} - {self.status} - {self.rows_deleted}"
+
+    @property
+    def progress(self):
+        if self.status == self.COMPLETED:
+            return 1.0
+        if not self.max_id:
+            return 0.0
+        return round(min(self.last_id / self.max_id, 1.0), 4)
@@ -0,0 +1,234 @@
+"""
+Keyset (cursor) pagination for the transaction list.
+
+Pages are addressed by the last row seen on the (-date, -created_at, -id)
+ordering instead of an OFFSET. "After the cursor" is a single row
+comparison, ``(date, created_at, id) < (cursor values)``, in the column
+order of the (user, -date, -created_at, -id) index: PostgreSQL uses it
+as the Index Cond of a scan that starts at the cursor and already
+returns rows in page order, so every page costs the same however deep
+the client has scrolled. An OR chain of per-column comparisons could
+only be applied row by row, and an ordering that mixes directions
+cannot be one row comparison. The total count is opt-in:
+``?count=exact`` runs COUNT(*), ``?count=estimate`` reads the planner's
+row estimate on PostgreSQL.
+
+Cursor pages only come in this ordering: ``?ordering=`` is rejected,
+and search results are listed newest first rather than by relevance.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import BooleanField, F, Func, Value
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    """Planner row estimate on PostgreSQL, exact count elsewhere"""
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+KEYSET_ORDERING = ('-date', '-created_at', '-id')
+
+
+def encode_cursor(row, reverse=False):
+    """Opaque cursor for a transaction's (instance or values() row) position in KEYSET_ORDERING"""
+    if isinstance(row, dict):
+        cursor = {'d': row['date'].isoformat(), 'c': row['created_at'].isoformat(), 'i': row['id']}
+    else:
+        cursor = {'d': row.date.isoformat(), 'c': row.created_at.isoformat(), 'i': row.pk}
+    if reverse:
+        cursor['r'] = 1
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(encoded):
+    """Inverse of encode_cursor; raises ValueError for anything malformed"""
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        cursor['d'] = parse_date(cursor['d'])
+        cursor['c'] = parse_datetime(cursor['c'])
+        cursor['i'] = int(cursor['i'])
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeEncodeError):
+        raise ValueError('Invalid cursor')
+    if cursor['d'] is None or cursor['c'] is None:
+        raise ValueError('Invalid cursor')
+    return cursor
+
+
+class Row(Func):
+    """Row constructor: (a, b, c)"""
+    template = '(%(expressions)s)'
+
+
+class RowComparison(Func):
+    """(a, b, c) < (x, y, z), compared column by column like an ORDER BY"""
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+    def __init__(self, left, operator, right):
+        self.arg_joiner = f' {operator} '
+        super().__init__(left, right)
+
+
+def keyset_filter(cursor, ordering=KEYSET_ORDERING):
+    """Rows strictly after the cursor position in the given ordering, whose fields all sort the same way"""
+    directions = {field.startswith('-') for field in ordering}
+    if len(directions) != 1:
+        raise ValueError('Keyset orderings must sort every field the same way')
+    values = {'date': cursor['d'], 'created_at': cursor['c'], 'id': cursor['i']}
+    names = [field.lstrip('-') for field in ordering]
+    return RowComparison(
+        Row(*(F(name) for name in names)),
+        '<' if directions.pop() else '>',
+        Row(*(Value(values[name]) for name in names)),
+    )
+
+
+class TransactionCursorPagination(BasePagination):
+    ordering = KEYSET_ORDERING
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_query_param = 'count'
+    ordering_query_param = api_settings.ORDERING_PARAM
+    invalid_cursor_message = 'Invalid cursor'
+    invalid_ordering_message = 'Cursor pagination only supports the default ordering'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        count_mode = self.start_page(request)
+        if count_mode == 'exact':
+            self.count = queryset.count()
+        elif count_mode == 'estimate':
+            self.count = estimate_count(queryset)
+        return self.finish_page(list(self.page_queryset(queryset)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() through the async ORM"""
+        count_mode = self.start_page(request)
+        if count_mode == 'exact':
+            self.count = await queryset.acount()
+        elif count_mode == 'estimate':
+            self.count = await sync_to_async(estimate_count)(queryset)
+        return self.finish_page([row async for row in self.page_queryset(queryset)])
+
+    def start_page(self, request):
+        """Read the request's page parameters; returns the ?count= mode"""
+        if request.query_params.get(self.ordering_query_param):
+            raise ValidationError({self.ordering_query_param: self.invalid_ordering_message})
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+        self.reverse = bool(self.cursor and self.cursor.get('r'))
+        self.count = None
+        return request.query_params.get(self.count_query_param)
+
+    def page_queryset(self, queryset):
+        """The page's rows plus one, to tell whether another page follows"""
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.cursor:
+            queryset = queryset.filter(keyset_filter(self.cursor, ordering))
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            # Walking backwards: the page we came from is the next one
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return decode_cursor(encoded)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse=False):
+        return replace_query_param(self.base_url, self.cursor_query_param, encode_cursor(row, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if self.count is not None:
+            payload['count'] = self.count
+            payload.move_to_end('count', last=False)
+        return Response(payload)
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """PageNumberPagination whose apaginate_queryset() counts and fetches through the async ORM"""
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count is a cached_property; filling it in keeps page() from querying
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+
+        self.request = request
+        self.page.object_list = [row async for row in self.page.object_list]
+        return list(self.page)
@@ -0,0 +1,268 @@
+"""
+PostgreSQL range partitioning of the transactions table by ``date``.
+
+The table stays unpartitioned until ``manage.py partition_transactions
+--convert`` rebuilds it as a partitioned table (one partition per month or
+year, per TRANSACTION_PARTITION_INTERVAL, plus a DEFAULT partition for
+dates outside every range). The primary key becomes (id, date), as
+PostgreSQL requires the partition key in every unique index; ids still
+come from one sequence, so Django keeps treating ``id`` as the key.
+
+Once partitioned:
+
+* create_partitions() adds partitions ahead of time (celery beat runs it
+  daily via tasks.create_transaction_partitions). Rows dated past that
+  horizon land in DEFAULT, and PostgreSQL refuses a new partition whose
+  range DEFAULT already holds rows for; such rows are moved into the new
+  partition as it is created;
+* retention.run_retention() detaches and drops whole expired partitions
+  (expired_partitions()/drop_partition()) instead of deleting their rows;
+* date-bounded queries (list/GraphQL filters, exports, retention) only
+  touch the partitions their range overlaps.
+
+Everything here is a no-op on other databases.
+"""
+import re
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import search
+from .models import Transaction
+
+INTERVALS = ('month', 'year')
+
+_BOUND = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+
+def table_name():
+    return Transaction._meta.db_table
+
+
+def period_start(day, interval):
+    if interval == 'year':
+        return date(day.year, 1, 1)
+    return date(day.year, day.month, 1)
+
+
+def next_period(start, interval):
+    if interval == 'year':
+        return date(start.year + 1, 1, 1)
+    if start.month == 12:
+        return date(start.year + 1, 1, 1)
+    return date(start.year, start.month + 1, 1)
+
+
+def partition_name(start, interval):
+    suffix = f'{start:%Y}' if interval == 'year' else f'{start:%Y_%m}'
+    return f'{table_name()}_p{suffix}'
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table_name()]
+        )
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions():
+    """[(name, start, end)] for every range partition, oldest first; the DEFAULT partition has no bounds"""
+    if not is_partitioned():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i"
+            " JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+            [table_name()],
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or '')
+        if match:
+            partitions.append((name, date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))))
+        else:
+            partitions.append((name, None, None))
+    return sorted(partitions, key=lambda partition: partition[1] or date.min)
+
+
+def _default_partition(cursor):
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass(%s) AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'",
+        [table_name()],
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _has_identity(cursor, table):
+    cursor.execute(
+        "SELECT attidentity FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = 'id'", [table]
+    )
+    return bool(cursor.fetchone()[0])
+
+
+def _create_partition(cursor, start, interval):
+    table = table_name()
+    end = next_period(start, interval)
+    create = (
+        f'CREATE TABLE IF NOT EXISTS {partition_name(start, interval)} PARTITION OF {table}'
+        f' FOR VALUES FROM (%s) TO (%s)'
+    )
+    default = _default_partition(cursor)
+    if default:
+        cursor.execute(f'SELECT 1 FROM {default} WHERE date >= %s AND date < %s LIMIT 1', [start, end])
+    if not default or cursor.fetchone() is None:
+        cursor.execute(create, [start, end])
+        return
+
+    # DEFAULT holds rows for this range: take it out, add the partition,
+    # move the rows over through the parent and put DEFAULT back
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {default}')
+    cursor.execute(create, [start, end])
+    overriding = ' OVERRIDING SYSTEM VALUE' if _has_identity(cursor, table) else ''
+    cursor.execute(
+        f'INSERT INTO {table}{overriding} SELECT * FROM {default} WHERE date >= %s AND date < %s', [start, end]
+    )
+    cursor.execute(f'DELETE FROM {default} WHERE date >= %s AND date < %s', [start, end])
+    cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT')
+
+
+def create_partitions(ahead=None, interval=None, today=None):
+    """Make sure partitions exist from the current period through `ahead` more; returns the names created"""
+    if not is_partitioned():
+        return []
+    ahead = settings.TRANSACTION_PARTITIONS_AHEAD if ahead is None else ahead
+    interval = interval or settings.TRANSACTION_PARTITION_INTERVAL
+    existing = {name for name, _, _ in list_partitions()}
+
+    created = []
+    start = period_start(today or date.today(), interval)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for _ in range(ahead + 1):
+            if partition_name(start, interval) not in existing:
+                _create_partition(cursor, start, interval)
+                created.append(partition_name(start, interval))
+            start = next_period(start, interval)
+    return created
+
+
+def convert(interval=None, ahead=None, keep_legacy=False):
+    """
+    Rebuild the transactions table as a partitioned table, copying every
+    row. Runs in one transaction under an ACCESS EXCLUSIVE lock, so plan a
+    maintenance window on large tables. Index and foreign key names are
+    kept. Returns the number of rows copied.
+    """
+    if connection.vendor != 'postgresql':
+        raise RuntimeError('Partitioning requires PostgreSQL')
+    if is_partitioned():
+        return 0
+    interval = interval or settings.TRANSACTION_PARTITION_INTERVAL
+    if interval not in INTERVALS:
+        raise ValueError(f'Unknown partition interval "{interval}"')
+    ahead = settings.TRANSACTION_PARTITIONS_AHEAD if ahead is None else ahead
+    table = table_name()
+    legacy = f'{table}_legacy'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # ALTER TABLE refuses to run while deferred FK checks are pending
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(
+            "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint"
+            " WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'f', 'c')",
+            [table],
+        )
+        constraints = cursor.fetchall()
+        constraint_names = {name for name, _, _ in constraints}
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+            [table],
+        )
+        indexes = [(name, sql) for name, sql in cursor.fetchall() if name not in constraint_names]
+        identity = _has_identity(cursor, table)
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+
+        # Move the old table and its index/constraint names out of the way
+        cursor.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+        for name, _, _ in constraints:
+            cursor.execute(f'ALTER TABLE {legacy} RENAME CONSTRAINT {name} TO {name[:55]}_legacy')
+        for name, _ in indexes:
+            cursor.execute(f'ALTER INDEX {name} RENAME TO {name[:55]}_legacy')
+
+        cursor.execute(
+            f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING STORAGE)'
+            f' PARTITION BY RANGE (date)'
+        )
+        for name, contype, definition in constraints:
+            if contype == 'p':
+                cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} PRIMARY KEY (id, date)')
+            else:
+                cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+        for _, sql in indexes:
+            # Index definitions were read before the rename, so they name the new table
+            cursor.execute(sql)
+
+        cursor.execute(f'SELECT min(date) FROM {legacy}')
+        first = cursor.fetchone()[0] or date.today()
+        start = period_start(first, interval)
+        end = period_start(date.today(), interval)
+        for _ in range(ahead):
+            end = next_period(end, interval)
+        while start <= end:
+            _create_partition(cursor, start, interval)
+            start = next_period(start, interval)
+        cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+        overriding = ' OVERRIDING SYSTEM VALUE' if identity else ''
+        cursor.execute(f'INSERT INTO {table}{overriding} SELECT * FROM {legacy}')
+        copied = cursor.rowcount
+
+        # Triggers are not copied by LIKE; add the search one back once the rows are in
+        cursor.execute(
+            "SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND tgname = %s", [legacy, search.TRIGGER]
+        )
+        if cursor.fetchone():
+            for sql in search.trigger_sql(table):
+                cursor.execute(sql)
+
+        if identity:
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT max(id) FROM {legacy}), 0) + 1, false)",
+                [table],
+            )
+        elif sequence:
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+
+        if not keep_legacy:
+            cursor.execute(f'DROP TABLE {legacy}')
+        cursor.execute(f'ANALYZE {table}')
+    return copied
+
+
+def expired_partitions(cutoff):
+    """[(name, start, end)] of the partitions whose whole range is before cutoff"""
+    return [
+        (name, start, end) for name, start, end in list_partitions()
+        if end is not None and end <= cutoff
+    ]
+
+
+def drop_partition(name):
+    """Detach and drop one partition; returns how many rows it held. Call inside a transaction."""
+    with connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'SELECT count(*) FROM {name}')
+        rows = cursor.fetchone()[0]
+        cursor.execute(f'ALTER TABLE {table_name()} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
+    return rows
@@ -0,0 +1,231 @@
+"""
+Transaction retention.
+
+Rows older than the cutoff are removed in primary-key batches: each batch
+is its own short transaction (see bulk.bulk_delete_transactions), with a
+pause in between so replication and autovacuum keep up. When the table is
+partitioned (see partitions.py), partitions that lie entirely before the
+cutoff are detached and dropped instead. Progress lives
+in a RetentionRun row; an interrupted run is resumed from its last id.
+
+With archiving on, each batch is first appended to gzip-compressed JSON
+Lines files, one per user and month (``<root>/<user_id>/<YYYY-MM>.jsonl.gz``).
+restore_archive() reads them back; rows that already exist are skipped,
+so restoring twice is harmless. Neither deleting nor restoring history
+changes account balances (see ledger.py).
+"""
+import glob
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import ledger, partitions, rollups
+from .bulk import bulk_create_transactions, bulk_delete_transactions
+from .importers import CategoryMap
+from .models import (
+    Account, AccountBalanceCheckpoint, Category, RetentionRun, Transaction, TransactionDailyRollup
+)
+from .stats_cache import bump_data_version
+
+User = get_user_model()
+
+ARCHIVE_FIELDS = (
+    'id', 'user_id', 'account_id', 'category_id', 'category__name', 'type', 'amount',
+    'description', 'date', 'created_at', 'updated_at',
+)
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder, but datetimes keep their microseconds so restores are exact"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def archive_path(root, user_id, month):
+    return os.path.join(root, str(user_id), f'{month}.jsonl.gz')
+
+
+def archive_rows(rows, root):
+    """Append transaction value dicts to their per-user/month archive files; returns rows written"""
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row['user_id'], row['date'].strftime('%Y-%m'))].append(row)
+
+    for (user_id, month), group in groups.items():
+        path = archive_path(root, user_id, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Every append adds a gzip member; gzip.open() reads them back as one stream
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for row in group:
+                f.write(json.dumps(row, cls=ArchiveEncoder, ensure_ascii=False) + '\n')
+    return sum(len(group) for group in groups.values())
+
+
+def start_run(cutoff_date=None, archive=None):
+    """Resume the latest unfinished run, or start one for cutoff_date (default: the retention period)"""
+    run = RetentionRun.objects.exclude(status=RetentionRun.COMPLETED).first()
+    if run is not None:
+        RetentionRun.objects.filter(pk=run.pk).update(status=RetentionRun.RUNNING, error='')
+        run.refresh_from_db()
+        return run
+
+    if cutoff_date is None:
+        cutoff_date = timezone.now().date() - timedelta(days=settings.TRANSACTION_RETENTION_DAYS)
+    if archive is None:
+        archive = settings.TRANSACTION_RETENTION_ARCHIVE
+    max_id = Transaction.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    return RetentionRun.objects.create(cutoff_date=cutoff_date, archive=archive, max_id=max_id)
+
+
+def run_retention(run, batch_size=None, pause=None, archive_root=None, on_batch=None):
+    """Delete (and optionally archive) everything before run.cutoff_date; returns the finished run"""
+    batch_size = batch_size or settings.TRANSACTION_RETENTION_BATCH_SIZE
+    pause = settings.TRANSACTION_RETENTION_BATCH_PAUSE if pause is None else pause
+    archive_root = archive_root or settings.TRANSACTION_ARCHIVE_ROOT
+    progress_fields = ['last_id', 'batches', 'rows_deleted', 'rows_archived']
+
+    try:
+        # Pin every account's balance just before the cutoff; older checkpoints
+        # cannot be checked against the remaining history
+        checkpoint_day = run.cutoff_date - timedelta(days=1)
+        ledger.create_checkpoints(checkpoint_day)
+        AccountBalanceCheckpoint.objects.filter(date__lt=checkpoint_day).delete()
+
+        if partitions.is_partitioned():
+            # Whole partitions before the cutoff go at once; only the rest is deleted row by row
+            for name, start, end in partitions.expired_partitions(run.cutoff_date):
+                if run.archive:
+                    rows = Transaction.objects.filter(date__gte=start, date__lt=end).order_by('id')
+                    for batch in _batches(rows.values(*ARCHIVE_FIELDS).iterator(chunk_size=batch_size), batch_size):
+                        run.rows_archived += archive_rows(batch, archive_root)
+                with transaction.atomic():
+                    ledger.forget_range(start, end)
+                    run.rows_deleted += partitions.drop_partition(name)
+                    for user_id in rollups.delete_range(start, end):
+                        bump_data_version(user_id)
+                run.batches += 1
+                run.save(update_fields=progress_fields)
+                if on_batch:
+                    on_batch(run)
+
+        while True:
+            ids = list(
+                Transaction.objects.filter(date__lt=run.cutoff_date, id__gt=run.last_id)
+                .order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            if run.archive:
+                rows = Transaction.objects.filter(id__in=ids).order_by('id').values(*ARCHIVE_FIELDS)
+                run.rows_archived += archive_rows(rows, archive_root)
+            run.rows_deleted += bulk_delete_transactions(ids, keep_balances=True)
+            run.last_id = ids[-1]
+            run.batches += 1
+            run.save(update_fields=progress_fields)
+            if on_batch:
+                on_batch(run)
+            if len(ids) < batch_size:
+                break
+            time.sleep(pause)
+    except Exception as e:
+        run.status = RetentionRun.FAILED
+        run.error = str(e)
+        run.save(update_fields=['status', 'error'])
+        raise
+
+    # Rollup rows whose transactions are all gone
+    TransactionDailyRollup.objects.filter(date__lt=run.cutoff_date, count__lte=0).delete()
+    run.status = RetentionRun.COMPLETED
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'finished_at'])
+    return run
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _read_archive(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _restore_batch(rows, category_maps):
+    """Insert archived rows that are not in the table yet; returns the number inserted"""
+    rows = list({row['id']: row for row in rows}.values())
+    ids = [row['id'] for row in rows]
+    existing = set(Transaction.objects.filter(id__in=ids).values_list('id', flat=True))
+    rows = [row for row in rows if row['id'] not in existing]
+    if not rows:
+        return 0
+
+    user_ids = set(User.objects.filter(id__in={row['user_id'] for row in rows}).values_list('id', flat=True))
+    category_ids = set(Category.objects.filter(id__in={row['category_id'] for row in rows}).values_list('id', flat=True))
+    account_ids = set(Account.objects.filter(id__in={row['account_id'] for row in rows}).values_list('id', flat=True))
+
+    transactions = []
+    created_at = {}
+    for row in rows:
+        if row['user_id'] not in user_ids:
+            continue
+        category_id = row['category_id']
+        if category_id not in category_ids:
+            # The category was deleted since; recreate it by name
+            if row['user_id'] not in category_maps:
+                category_maps[row['user_id']] = CategoryMap(row['user_id'])
+            category_id = category_maps[row['user_id']].resolve(row['category__name'], row['type'])
+        transactions.append(Transaction(
+            id=row['id'],
+            user_id=row['user_id'],
+            account_id=row['account_id'] if row['account_id'] in account_ids else None,
+            category_id=category_id,
+            type=row['type'],
+            amount=row['amount'],
+            description=row['description'],
+            date=parse_date(row['date']),
+        ))
+        created_at[row['id']] = parse_datetime(row['created_at'])
+
+    if transactions:
+        bulk_create_transactions(transactions, keep_balances=True)
+        # bulk_create stamps created_at with the current time; put the original back
+        Transaction.objects.filter(id__in=created_at).update(created_at=Case(
+            *[When(id=pk, then=Value(value)) for pk, value in created_at.items()],
+            output_field=DateTimeField(),
+        ))
+    return len(transactions)
+
+
+def restore_archive(root=None, user_id=None, month=None, batch_size=1000):
+    """Restore archived transactions, optionally for one user and/or month ('YYYY-MM')"""
+    root = root or settings.TRANSACTION_ARCHIVE_ROOT
+    pattern = archive_path(root, user_id if user_id is not None else '*', month or '*')
+    restored = 0
+    category_maps = {}
+    for path in sorted(glob.glob(pattern)):
+        for batch in _batches(_read_archive(path), batch_size):
+            restored += _restore_batch(batch, category_maps)
+    return restored
@@ -0,0 +1,174 @@
+"""
+Daily transaction rollups.
+
+TransactionDailyRollup keeps one row per (user, category, type, date,
+account) with the summed amount and row count; the account gives stats the
+currency to convert from (see fx.py). signals.py applies deltas on every ORM
+save/delete; paths that bypass signals (bulk_create, QuerySet.update)
+must call apply_deltas() themselves, and rebuild() repairs anything else.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+
+from .models import Transaction, TransactionDailyRollup
+
+KEY_FIELDS = ('user_id', 'category_id', 'type', 'date', 'account_id')
+
+_amount_field = Transaction._meta.get_field('amount')
+_date_field = Transaction._meta.get_field('date')
+
+
+def rollup_key(user_id, category_id, type, date, account_id):
+    return (user_id, category_id, type, _date_field.to_python(date), account_id)
+
+
+def instance_key(instance):
+    return rollup_key(instance.user_id, instance.category_id, instance.type, instance.date, instance.account_id)
+
+
+def instance_amount(instance):
+    return _amount_field.to_python(instance.amount)
+
+
+def apply_delta(key, amount, count):
+    """Add amount/count to the rollup row for key, creating it if needed"""
+    rows = TransactionDailyRollup.objects.filter(_key_q(key))
+    if rows.update(amount=F('amount') + amount, count=F('count') + count):
+        return
+    if count <= 0:
+        # Nothing to take away from: the row is already gone, e.g. its
+        # category is being cascade-deleted together with the transactions
+        return
+    try:
+        with transaction.atomic():
+            TransactionDailyRollup.objects.create(**dict(zip(KEY_FIELDS, key)), amount=amount, count=count)
+    except IntegrityError:
+        # Created concurrently by another writer
+        rows.update(amount=F('amount') + amount, count=F('count') + count)
+
+
+def _key_q(key):
+    return Q(**dict(zip(KEY_FIELDS, key)))
+
+
+def apply_deltas(transactions, sign=1):
+    """
+    Fold a batch of transactions into the rollup: one SELECT for the
+    existing keys, one UPDATE for all of them and one bulk INSERT for the
+    rest, whatever the batch size.
+    """
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for instance in transactions:
+        delta = deltas[instance_key(instance)]
+        delta[0] += instance_amount(instance)
+        delta[1] += 1
+    if not deltas:
+        return
+
+    any_key = Q()
+    for key in deltas:
+        any_key |= _key_q(key)
+
+    with transaction.atomic():
+        rows = TransactionDailyRollup.objects.filter(any_key)
+        existing = {
+            rollup_key(*row) for row in rows.values_list(*KEY_FIELDS)
+        }
+        if existing:
+            amount_cases = [When(_key_q(key), then=Value(sign * deltas[key][0])) for key in existing]
+            count_cases = [When(_key_q(key), then=Value(sign * deltas[key][1])) for key in existing]
+            rows.update(
+                amount=F('amount') + Case(*amount_cases, default=Value(Decimal('0')), output_field=DecimalField()),
+                count=F('count') + Case(*count_cases, default=Value(0), output_field=IntegerField()),
+            )
+
+        missing = [key for key in deltas if key not in existing]
+        if sign < 0 or not missing:
+            return
+        try:
+            with transaction.atomic():
+                TransactionDailyRollup.objects.bulk_create([
+                    TransactionDailyRollup(
+                        **dict(zip(KEY_FIELDS, key)), amount=deltas[key][0], count=deltas[key][1]
+                    )
+                    for key in missing
+                ])
+        except IntegrityError:
+            # Some keys were created concurrently; fall back to per-key upserts
+            for key in missing:
+                apply_delta(key, deltas[key][0], deltas[key][1])
+
+
+def delete_range(start_date, end_date):
+    """
+    Drop the rollup rows for start_date <= date < end_date, for when every
+    transaction in that range has been removed at once (e.g. a dropped
+    partition). Returns the ids of the users that had rows there.
+    """
+    rows = TransactionDailyRollup.objects.filter(date__gte=start_date, date__lt=end_date)
+    user_ids = set(rows.values_list('user_id', flat=True).distinct())
+    rows.delete()
+    return user_ids
+
+
+def _raw_rollups(user_ids=None):
+    queryset = Transaction.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    return queryset.values(*KEY_FIELDS).annotate(
+        total=Sum('amount'), rows=Count('id')
+    ).order_by()
+
+
+def rebuild(user_ids=None, batch_size=1000):
+    """Recompute rollup rows from raw transactions; returns the number of rows written"""
+    written = 0
+    with transaction.atomic():
+        existing = TransactionDailyRollup.objects.all()
+        if user_ids is not None:
+            existing = existing.filter(user_id__in=user_ids)
+        existing.delete()
+
+        batch = []
+        for row in _raw_rollups(user_ids).iterator(chunk_size=batch_size):
+            batch.append(TransactionDailyRollup(
+                user_id=row['user_id'],
+                category_id=row['category_id'],
+                type=row['type'],
+                date=row['date'],
+                account_id=row['account_id'],
+                amount=row['total'],
+                count=row['rows'],
+            ))
+            if len(batch) >= batch_size:
+                TransactionDailyRollup.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            TransactionDailyRollup.objects.bulk_create(batch)
+            written += len(batch)
+    return written
+
+
+def verify(user_ids=None):
+    """Return a list of (key, expected, actual) mismatches between raw rows and the rollup"""
+    expected = {
+        tuple(row[field] for field in KEY_FIELDS): (row['total'], row['rows'])
+        for row in _raw_rollups(user_ids).iterator()
+    }
+    rollups = TransactionDailyRollup.objects.filter(count__gt=0)
+    if user_ids is not None:
+        rollups = rollups.filter(user_id__in=user_ids)
+
+    mismatches = []
+    for row in rollups.values(*KEY_FIELDS, 'amount', 'count').iterator():
+        key = tuple(row[field] for field in KEY_FIELDS)
+        actual = (row['amount'], row['count'])
+        want = expected.pop(key, None)
+        if want != actual:
+            mismatches.append((key, want, actual))
+    mismatches.extend((key, want, None) for key, want in expected.items())
+    return mismatches
@@ -1,8 +1,17 @@
 import graphene
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from graphene_django import DjangoObjectType
-from django.db.models import Sum, Q
 from datetime import datetime, timedelta
+
+from casho.db_router import read_alias
+
+from . import fx
+from .bulk import bulk_create_categories, bulk_create_transactions
+from .loaders import get_loaders
 from .models import Category, Transaction, Account
+from .pagination import KEYSET_ORDERING, decode_cursor, encode_cursor, keyset_filter
+from .stats_cache import get_stats
 
 
 class CategoryType(DjangoObjectType):
@@ -10,18 +19,44 @@ class CategoryType(DjangoObjectType):
         model = Category
         fields = '__all__'
 
+    def resolve_user(self, info):
+        return get_loaders(info).user.load(self.user_id)
+
+    def resolve_transaction_set(self, info):
+        return get_loaders(info).transactions_by_category.load(self.pk)
+
 
 class TransactionType(DjangoObjectType):
     class Meta:
         model = Transaction
         fields = '__all__'
 
+    def resolve_user(self, info):
+        return get_loaders(info).user.load(self.user_id)
+
+    def resolve_category(self, info):
+        return get_loaders(info).category.load(self.category_id)
+
+    def resolve_account(self, info):
+        return get_loaders(info).account.load(self.account_id)
+
+
+class TransactionConnection(graphene.relay.Connection):
+    class Meta:
+        node = TransactionType
+
 
 class AccountType(DjangoObjectType):
     class Meta:
         model = Account
         fields = '__all__'
 
+    def resolve_user(self, info):
+        return get_loaders(info).user.load(self.user_id)
+
+    def resolve_transaction_set(self, info):
+        return get_loaders(info).transactions_by_account.load(self.pk)
+
 
 class CategoryInput(graphene.InputObjectType):
     name = graphene.String(required=True)
@@ -38,6 +73,7 @@ class TransactionInput(graphene.InputObjectType):
 
 
 class StatsType(graphene.ObjectType):
+    currency = graphene.String()
     total_income = graphene.Decimal()
     total_expense = graphene.Decimal()
     balance = graphene.Decimal()
@@ -91,15 +127,157 @@ class CreateTransaction(graphene.Mutation):
         return transaction
 
 
+class BulkItemError(graphene.ObjectType):
+    index = graphene.Int()
+    message = graphene.String()
+
+
+def _check_bulk_size(inputs):
+    limit = settings.GRAPHQL_BULK_MUTATION_LIMIT
+    if len(inputs) > limit:
+        raise Exception(f"At most {limit} items per request")
+
+
+def _field_errors(instance, exclude):
+    try:
+        instance.clean_fields(exclude=exclude)
+    except ValidationError as e:
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in e.message_dict.items())
+    return None
+
+
+class CreateCategories(graphene.Mutation):
+    """Create many categories in one request; invalid items are reported per index"""
+    class Arguments:
+        inputs = graphene.List(graphene.NonNull(CategoryInput), required=True)
+        all_or_nothing = graphene.Boolean(default_value=False)
+
+    categories = graphene.List(CategoryType)
+    errors = graphene.List(BulkItemError)
+
+    def mutate(self, info, inputs, all_or_nothing=False):
+        user = info.context.user
+        if not user.is_authenticated:
+            raise Exception("User not logged in")
+        _check_bulk_size(inputs)
+
+        taken = set(Category.objects.filter(user=user).values_list('name', 'type'))
+        categories = []
+        errors = []
+        for index, item in enumerate(inputs):
+            category = Category(
+                user=user,
+                name=item.name,
+                type=item.type,
+                icon=item.icon or '',
+                color=item.color or '#000000'
+            )
+            message = _field_errors(category, exclude=['user'])
+            if message is None and (item.name, item.type) in taken:
+                message = "Category already exists"
+            if message:
+                errors.append(BulkItemError(index=index, message=message))
+                continue
+            taken.add((item.name, item.type))
+            categories.append(category)
+
+        if errors and all_or_nothing:
+            return CreateCategories(categories=[], errors=errors)
+        return CreateCategories(categories=bulk_create_categories(categories), errors=errors)
+
+
+class CreateTransactions(graphene.Mutation):
+    """Create many transactions in one request; invalid items are reported per index"""
+    class Arguments:
+        inputs = graphene.List(graphene.NonNull(TransactionInput), required=True)
+        all_or_nothing = graphene.Boolean(default_value=False)
+
+    transactions = graphene.List(TransactionType)
+    errors = graphene.List(BulkItemError)
+
+    def mutate(self, info, inputs, all_or_nothing=False):
+        user = info.context.user
+        if not user.is_authenticated:
+            raise Exception("User not logged in")
+        _check_bulk_size(inputs)
+
+        # One query validates ownership of every referenced category
+        category_ids = {str(item.category_id) for item in inputs}
+        categories = {
+            str(category.pk): category
+            for category in Category.objects.filter(
+                user=user, pk__in=[pk for pk in category_ids if pk.isdigit()]
+            )
+        }
+
+        transactions = []
+        errors = []
+        for index, item in enumerate(inputs):
+            category = categories.get(str(item.category_id))
+            if category is None:
+                errors.append(BulkItemError(index=index, message="Category does not exist"))
+                continue
+            transaction = Transaction(
+                user=user,
+                category=category,
+                type=category.type,
+                amount=item.amount,
+                description=item.description or '',
+                date=item.date
+            )
+            message = _field_errors(transaction, exclude=['user', 'category', 'account'])
+            if message:
+                errors.append(BulkItemError(index=index, message=message))
+                continue
+            transactions.append(transaction)
+
+        if errors and all_or_nothing:
+            return CreateTransactions(transactions=[], errors=errors)
+        created = bulk_create_transactions(transactions)
+        loaders = get_loaders(info)
+        for category in categories.values():
+            loaders.category.prime(category.pk, category)
+        return CreateTransactions(transactions=created, errors=errors)
+
+
+def flag_truncated(info, limit):
+    """Report under the response's extensions.truncated that this list field returned only its first limit rows"""
+    extensions = getattr(info.context, '_graphql_extensions', None)
+    if extensions is None:
+        extensions = info.context._graphql_extensions = {}
+    extensions.setdefault('truncated', []).append({'path': info.path.as_list(), 'limit': limit})
+
+
+def filter_transactions(user, start_date=None, end_date=None, category_id=None):
+    queryset = Transaction.objects.filter(user=user)
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+    if category_id:
+        queryset = queryset.filter(category_id=category_id)
+    return queryset
+
+
 class Query(graphene.ObjectType):
     categories = graphene.List(CategoryType, type=graphene.String())
     transactions = graphene.List(TransactionType, 
                                 start_date=graphene.Date(), 
                                 end_date=graphene.Date(),
-                                category_id=graphene.ID())
+                                category_id=graphene.ID(),
+                                deprecation_reason='Returns at most GRAPHQL_TRANSACTIONS_LIST_LIMIT rows '
+                                                   '(flagged under extensions.truncated); '
+                                                   'use transactionsConnection')
+    transactions_connection = graphene.Field(TransactionConnection,
+                                             first=graphene.Int(),
+                                             after=graphene.String(),
+                                             start_date=graphene.Date(),
+                                             end_date=graphene.Date(),
+                                             category_id=graphene.ID())
     stats = graphene.Field(StatsType, 
                           start_date=graphene.Date(), 
-                          end_date=graphene.Date())
+                          end_date=graphene.Date(),
+                          currency=graphene.String())
     accounts = graphene.List(AccountType)
 
     def resolve_categories(self, info, type=None):
@@ -110,25 +288,65 @@ class Query(graphene.ObjectType):
         queryset = Category.objects.filter(user=user)
         if type:
             queryset = queryset.filter(type=type)
-        return queryset
+        categories = list(queryset)
+        get_loaders(info).want_category_relations(categories)
+        return categories
 
     def resolve_transactions(self, info, start_date=None, end_date=None, category_id=None):
         user = info.context.user
         if not user.is_authenticated:
             return []
         
-        queryset = Transaction.objects.filter(user=user)
-        
-        if start_date:
-            queryset = queryset.filter(date__gte=start_date)
-        if end_date:
-            queryset = queryset.filter(date__lte=end_date)
-        if category_id:
-            queryset = queryset.filter(category_id=category_id)
-        
-        return queryset.order_by('-date', '-created_at')
+        queryset = filter_transactions(user, start_date, end_date, category_id).using(read_alias(user.pk))
+        limit = settings.GRAPHQL_TRANSACTIONS_LIST_LIMIT
+        transactions = list(queryset.order_by('-date', '-created_at')[:limit + 1])
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            flag_truncated(info, limit)
+        get_loaders(info).want_transaction_relations(transactions)
+        return transactions
+
+    def resolve_transactions_connection(self, info, first=None, after=None,
+                                        start_date=None, end_date=None, category_id=None):
+        user = info.context.user
+        if not user.is_authenticated:
+            return None
+
+        if first is None:
+            first = settings.GRAPHQL_DEFAULT_PAGE_SIZE
+        if first < 0:
+            raise Exception("first must be non-negative")
+        first = min(first, settings.GRAPHQL_MAX_PAGE_SIZE)
+
+        queryset = filter_transactions(user, start_date, end_date, category_id).using(
+            read_alias(user.pk)
+        ).order_by(*KEYSET_ORDERING)
+        if after:
+            try:
+                queryset = queryset.filter(keyset_filter(decode_cursor(after)))
+            except ValueError:
+                raise Exception("Invalid cursor")
+
+        transactions = list(queryset[:first + 1])
+        has_next_page = len(transactions) > first
+        transactions = transactions[:first]
+        get_loaders(info).want_transaction_relations(transactions)
 
-    def resolve_stats(self, info, start_date=None, end_date=None):
+        edges = [
+            TransactionConnection.Edge(node=transaction, cursor=encode_cursor(transaction))
+            for transaction in transactions
+        ]
+        return TransactionConnection(
+            edges=edges,
+            page_info=graphene.relay.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_next_page=has_next_page,
+                has_previous_page=bool(after),
+            )
+        )
+
+    def resolve_stats(self, info, start_date=None, end_date=None, currency=None):
         user = info.context.user
         if not user.is_authenticated:
             return None
@@ -138,31 +356,26 @@ class Query(graphene.ObjectType):
             start_date = datetime.now().date() - timedelta(days=30)
         if not end_date:
             end_date = datetime.now().date()
-        
-        # Get statistics
-        transactions = Transaction.objects.filter(
-            user=user,
-            date__range=[start_date, end_date]
-        )
-        
-        total_income = transactions.filter(type='income').aggregate(
-            total=Sum('amount'))['total'] or 0
-        total_expense = transactions.filter(type='expense').aggregate(
-            total=Sum('amount'))['total'] or 0
-        balance = total_income - total_expense
-        
+
+        try:
+            stats = get_stats(user, start_date, end_date, currency)
+        except ValueError:
+            raise Exception(f"Unknown currency; use one of {', '.join(fx.CURRENCIES)}")
+        except fx.FxRateMissing as e:
+            raise Exception(f"{e}; request another currency")
+
         # Statistics by category
-        category_stats = {}
-        for category in Category.objects.filter(user=user):
-            category_total = transactions.filter(category=category).aggregate(
-                total=Sum('amount'))['total'] or 0
-            if category_total > 0:
-                category_stats[category.name] = float(category_total)
-        
+        category_stats = {
+            row['category__name']: float(row['total'])
+            for row in stats['category_stats']
+            if row['total'] > 0
+        }
+
         return StatsType(
-            total_income=total_income,
-            total_expense=total_expense,
-            balance=balance,
+            currency=stats['currency'],
+            total_income=stats['income_total'],
+            total_expense=stats['expense_total'],
+            balance=stats['balance'],
             category_stats=category_stats
         )
 
@@ -170,9 +383,13 @@ class Query(graphene.ObjectType):
         user = info.context.user
         if not user.is_authenticated:
             return []
-        return Account.objects.filter(user=user)
+        accounts = list(Account.objects.filter(user=user))
+        get_loaders(info).want_account_relations(accounts)
+        return accounts
 
 
 class Mutation(graphene.ObjectType):
     create_category = CreateCategory.Field()
-    create_transaction = CreateTransaction.Field() 
\ No newline at end of file
+    create_transaction = CreateTransaction.Field()
+    create_categories = CreateCategories.Field()
+    create_transactions = CreateTransactions.Field() 
\ No newline at end of file
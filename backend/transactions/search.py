@@ -0,0 +1,153 @@
+"""
+Transaction description search.
+
+On PostgreSQL the transactions table carries a ``search_vector`` tsvector
+column, filled by a trigger on every insert and description update (so
+bulk inserts, COPY and QuerySet.update() are covered), with a GIN index,
+plus a pg_trgm GIN index on ``description`` (migration 0010). The column
+is deliberately not a model field: list queries never load it.
+
+A search matches rows where every word prefix-matches the tsvector, where
+the term is a fuzzy (trigram word similarity) match, or where the
+description contains it, the last two both served by the trigram index.
+Results rank by ts_rank plus trigram similarity. Elsewhere search falls
+back to a plain ``icontains`` filter.
+"""
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVectorExact, SearchVectorField, TrigramWordSimilarity
+)
+from django.db import connections
+from django.db.models import Count, Expression, F, Lookup, Q, Value
+from django.db.models.functions import Coalesce
+
+from .models import Transaction
+
+COLUMN = 'search_vector'
+TRIGGER = 'transactions_search_vector_trigger'
+FUNCTION = 'transactions_search_vector_update'
+RANK = 'search_rank'
+
+_WORD = re.compile(r'\w+')
+
+
+def enabled(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def trigger_sql(table=None):
+    """Statements that (re)create the function and trigger keeping search_vector current"""
+    table = table or Transaction._meta.db_table
+    config = settings.TRANSACTION_SEARCH_CONFIG
+    return [
+        f"CREATE OR REPLACE FUNCTION {FUNCTION}() RETURNS trigger AS $$"
+        f" BEGIN NEW.{COLUMN} := to_tsvector('{config}'::regconfig, coalesce(NEW.description, ''));"
+        f" RETURN NEW; END $$ LANGUAGE plpgsql",
+        f'DROP TRIGGER IF EXISTS {TRIGGER} ON {table}',
+        f'CREATE TRIGGER {TRIGGER} BEFORE INSERT OR UPDATE OF description ON {table}'
+        f' FOR EACH ROW EXECUTE FUNCTION {FUNCTION}()',
+    ]
+
+
+class SearchVectorColumn(Expression):
+    """The unmapped search_vector column of the query's base table"""
+    output_field = SearchVectorField()
+
+    def as_sql(self, compiler, connection):
+        table = compiler.quote_name_unless_alias(compiler.query.base_table)
+        return f'{table}.{connection.ops.quote_name(COLUMN)}', []
+
+
+class IContains(Lookup):
+    """description ILIKE '%term%', which unlike icontains' UPPER() LIKE can use the trigram index"""
+    lookup_name = 'ilike_contains'
+
+    def process_rhs(self, compiler, connection):
+        rhs, params = super().process_rhs(compiler, connection)
+        return rhs, [f'%{connection.ops.prep_for_like_query(param)}%' for param in params]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', lhs_params + rhs_params
+
+
+def prefix_query(term):
+    """tsquery matching rows where every word of term starts a lexeme, or None when term has no words"""
+    words = _WORD.findall(term.lower())
+    if not words:
+        return None
+    return SearchQuery(
+        ' & '.join(f'{word}:*' for word in words), search_type='raw', config=settings.TRANSACTION_SEARCH_CONFIG
+    )
+
+
+def search(queryset, term, rank=True):
+    """Filter queryset to transactions matching term; with rank, annotate RANK (higher is better)"""
+    term = term.strip()
+    if not term:
+        return queryset
+    if not enabled(queryset):
+        return queryset.filter(description__icontains=term)
+
+    query = prefix_query(term)
+    condition = Q(description__trigram_word_similar=term) | Q(IContains(F('description'), term))
+    if query is not None:
+        condition |= Q(SearchVectorExact(SearchVectorColumn(), query))
+    queryset = queryset.filter(condition)
+    if rank:
+        score = TrigramWordSimilarity(term, 'description')
+        if query is not None:
+            score = Coalesce(SearchRank(SearchVectorColumn(), query), Value(0.0)) + score
+        queryset = queryset.annotate(**{RANK: score})
+    return queryset
+
+
+def suggest(queryset, prefix, limit=10):
+    """Most used descriptions among queryset whose words start with prefix, for autocomplete"""
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    if enabled(queryset):
+        query = prefix_query(prefix)
+        if query is None:
+            return []
+        queryset = queryset.filter(SearchVectorExact(SearchVectorColumn(), query))
+    else:
+        queryset = queryset.filter(description__icontains=prefix)
+    rows = queryset.exclude(description='').values('description').annotate(
+        uses=Count('id')
+    ).order_by('-uses', 'description')[:limit]
+    return [row['description'] for row in rows]
+
+
+def backfill(cursor, table, batch_size=5000, config=None):
+    """Compute search_vector for every existing row of table, in id batches; returns the number of rows updated"""
+    config = config or settings.TRANSACTION_SEARCH_CONFIG
+    updated = 0
+    last_id = 0
+    while True:
+        # Short id-range statements instead of one long table rewrite
+        cursor.execute(f'SELECT max(id) FROM (SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT %s) t',
+                       [last_id, batch_size])
+        upper = cursor.fetchone()[0]
+        if upper is None:
+            return updated
+        cursor.execute(
+            f"UPDATE {table} SET {COLUMN} = to_tsvector(%s::regconfig, coalesce(description, ''))"
+            f' WHERE id > %s AND id <= %s',
+            [config, last_id, upper],
+        )
+        updated += cursor.rowcount
+        last_id = upper
+
+
+def rebuild(batch_size=5000):
+    """Recreate the trigger (e.g. after changing TRANSACTION_SEARCH_CONFIG) and recompute every search_vector"""
+    table = Transaction._meta.db_table
+    with connections['default'].cursor() as cursor:
+        for sql in trigger_sql(table):
+            cursor.execute(sql)
+        return backfill(cursor, table, batch_size)
@@ -1,5 +1,7 @@
+import os
+
 from rest_framework import serializers
-from .models import Category, Transaction, Account
+from .models import Category, Transaction, Account, ImportJob
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -25,6 +27,37 @@ class TransactionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
+class TransactionRowSerializer(serializers.BaseSerializer):
+    """
+    TransactionSerializer 的只读快速版本：直接序列化 rows() 的 values() 行。
+    复用 TransactionSerializer 的字段做转换，输出逐字节一致
+    """
+    @classmethod
+    def columns(cls):
+        """[(field name, values() column, to_representation or None for raw pk)] in TransactionSerializer order"""
+        if not hasattr(cls, '_columns'):
+            columns = []
+            for name, field in TransactionSerializer().fields.items():
+                if isinstance(field, serializers.RelatedField):
+                    columns.append((name, f'{field.source}_id', None))
+                else:
+                    columns.append((name, field.source.replace('.', '__'), field.to_representation))
+            cls._columns = columns
+        return cls._columns
+
+    @classmethod
+    def rows(cls, queryset):
+        """Only the serialized columns, with the category ones joined in"""
+        return queryset.values(*[column for _, column, _ in cls.columns()])
+
+    def to_representation(self, row):
+        data = {}
+        for name, column, to_representation in self.columns():
+            value = row[column]
+            data[name] = value if value is None or to_representation is None else to_representation(value)
+        return data
+
+
 class TransactionCreateSerializer(serializers.ModelSerializer):
     """创建交易序列化器"""
     class Meta:
@@ -45,5 +78,60 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
 class AccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = Account
-        fields = ['id', 'name', 'currency', 'balance', 'user', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'user'] 
\ No newline at end of file
+        fields = ['id', 'name', 'currency', 'balance', 'opening_balance', 'user', 'created_at', 'updated_at']
+        # balance follows the account's transactions (see ledger.py)
+        read_only_fields = ['id', 'balance', 'created_at', 'updated_at', 'user']
+
+    def validate(self, attrs):
+        # Older clients send the starting amount as balance
+        if self.instance is None and 'opening_balance' not in attrs and 'balance' in self.initial_data:
+            attrs['opening_balance'] = serializers.DecimalField(max_digits=14, decimal_places=2).run_validation(
+                self.initial_data['balance']
+            )
+        return attrs
+
+    def create(self, validated_data):
+        validated_data['balance'] = validated_data.get('opening_balance', 0)
+        return super().create(validated_data)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    """导入任务序列化器"""
+    file = serializers.FileField(write_only=True)
+    format = serializers.ChoiceField(choices=ImportJob.FORMAT_CHOICES, required=False)
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'file', 'format', 'account', 'status', 'progress', 'file_size', 'bytes_read',
+            'rows_processed', 'rows_imported', 'rows_failed', 'errors', 'created_at', 'finished_at'
+        ]
+        read_only_fields = [
+            'id', 'status', 'file_size', 'bytes_read', 'rows_processed', 'rows_imported',
+            'rows_failed', 'errors', 'created_at', 'finished_at'
+        ]
+
+    def get_progress(self, obj):
+        if obj.status == ImportJob.COMPLETED:
+            return 1.0
+        if not obj.file_size:
+            return 0.0
+        return round(min(obj.bytes_read / obj.file_size, 1.0), 4)
+
+    def validate(self, attrs):
+        user = self.context['request'].user
+        account = attrs.get('account')
+        if account is not None and account.user_id != user.id:
+            raise serializers.ValidationError("账户不存在")
+
+        if not attrs.get('format'):
+            # 根据文件扩展名推断格式
+            extension = os.path.splitext(attrs['file'].name)[1].lower().lstrip('.')
+            extension = {'qfx': ImportJob.OFX, 'ndjson': ImportJob.JSONL}.get(extension, extension)
+            if extension not in dict(ImportJob.FORMAT_CHOICES):
+                raise serializers.ValidationError({'format': "无法识别的文件格式"})
+            attrs['format'] = extension
+
+        attrs['file_size'] = attrs['file'].size
+        return attrs
@@ -0,0 +1,76 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import ledger, rollups
+from .models import Account, Category, Transaction
+from .stats_cache import bump_data_version, forget_default_currency
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_previous_transaction(sender, instance, raw=False, **kwargs):
+    """Snapshot the stored row so post_save can move its amount out of the old rollup"""
+    instance._rollup_previous = None
+    if raw or instance.pk is None:
+        return
+    instance._rollup_previous = sender.objects.filter(pk=instance.pk).values(
+        *rollups.KEY_FIELDS, 'amount'
+    ).first()
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollup_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    instance._rollup_previous = None
+
+    key = rollups.instance_key(instance)
+    amount = rollups.instance_amount(instance)
+    if previous is None:
+        rollups.apply_delta(key, amount, 1)
+        ledger.apply_delta(instance.account_id, key[3], ledger.entry_amount(instance.type, amount))
+        return
+
+    previous_entry = ledger.entry_amount(previous['type'], previous['amount'])
+    entry = ledger.entry_amount(instance.type, amount)
+    if (previous['account_id'], previous['date']) == (instance.account_id, key[3]):
+        ledger.apply_delta(instance.account_id, key[3], entry - previous_entry)
+    else:
+        ledger.apply_delta(previous['account_id'], previous['date'], -previous_entry)
+        ledger.apply_delta(instance.account_id, key[3], entry)
+
+    previous_key = rollups.rollup_key(*(previous[field] for field in rollups.KEY_FIELDS))
+    if previous_key == key:
+        if previous['amount'] != amount:
+            rollups.apply_delta(key, amount - previous['amount'], 0)
+    else:
+        rollups.apply_delta(previous_key, -previous['amount'], -1)
+        rollups.apply_delta(key, amount, 1)
+    if previous['user_id'] != instance.user_id:
+        bump_data_version(previous['user_id'])
+
+
+@receiver(post_delete, sender=Transaction)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    key = rollups.instance_key(instance)
+    amount = rollups.instance_amount(instance)
+    rollups.apply_delta(key, -amount, -1)
+    ledger.apply_delta(instance.account_id, key[3], -ledger.entry_amount(instance.type, amount))
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_stats_cache(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_data_version(instance.user_id)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_default_currency(sender, instance, raw=False, **kwargs):
+    if not raw:
+        forget_default_currency(instance.user_id)
@@ -0,0 +1,173 @@
+"""
+Transaction statistics shared by the REST views, GraphQL schema and Celery tasks.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from casho.db_router import replica_reads
+
+from . import fx
+from .models import Transaction, TransactionDailyRollup, WeeklySummary
+
+logger = logging.getLogger(__name__)
+
+PERIOD_DAYS = {
+    'week': 7,
+    'month': 30,
+    'year': 365,
+}
+DEFAULT_PERIOD = 'month'
+
+
+def period_range(period, today=None):
+    """Return (start_date, end_date) for a stats period; unknown periods fall back to a month"""
+    end_date = today or timezone.now().date()
+    days = PERIOD_DAYS.get(period, PERIOD_DAYS[DEFAULT_PERIOD])
+    return end_date - timedelta(days=days), end_date
+
+
+def compute_stats(user, start_date, end_date, currency=None):
+    """
+    Totals, balance and per-category breakdown for a user's date range, in
+    ``currency`` (default: DEFAULT_CURRENCY). ``user`` may be a User
+    instance or a user id.
+
+    A single grouped query over the daily rollup returns one row per
+    (category, type), split by day only for amounts in other currencies
+    (see fx.converted_totals()); the overall totals are folded from those
+    rows, so the cost grows with days x categories rather than with
+    transactions.
+    """
+    currency = fx.reporting_currency(currency)
+    totals = fx.converted_totals(_rollups(user, start_date, end_date), ('category__name', 'type'), currency)
+    return _stats_payload(start_date, end_date, currency, totals)
+
+
+async def acompute_stats(user, start_date, end_date, currency=None):
+    """compute_stats() through the async ORM"""
+    currency = fx.reporting_currency(currency)
+    totals = await fx.aconverted_totals(_rollups(user, start_date, end_date), ('category__name', 'type'), currency)
+    return _stats_payload(start_date, end_date, currency, totals)
+
+
+def _rollups(user, start_date, end_date):
+    return TransactionDailyRollup.objects.filter(
+        user=user,
+        date__gte=start_date,
+        date__lte=end_date,
+        count__gt=0
+    )
+
+
+def _stats_payload(start_date, end_date, currency, totals):
+    category_stats = sorted(
+        (
+            {'category__name': name, 'type': type, 'total': total}
+            for (name, type), total in totals.items()
+        ),
+        key=lambda row: row['total'],
+        reverse=True,
+    )
+
+    income_total = Decimal('0')
+    expense_total = Decimal('0')
+    for row in category_stats:
+        if row['type'] == Transaction.INCOME:
+            income_total += row['total']
+        elif row['type'] == Transaction.EXPENSE:
+            expense_total += row['total']
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'currency': currency,
+        'income_total': income_total,
+        'expense_total': expense_total,
+        'balance': income_total - expense_total,
+        'category_stats': category_stats,
+    }
+
+
+def compute_user_totals(start_date, end_date, user_ids=None, user_id_range=None, currency=None):
+    """
+    Income/expense totals in ``currency`` (default: DEFAULT_CURRENCY) for
+    every user with activity in the range, in one grouped query. A user
+    whose amounts cannot be converted (rates missing for one of their
+    currencies) gets a row with just ``fx_missing``, the error message, so
+    one such user does not fail the others.
+    """
+    queryset = TransactionDailyRollup.objects.filter(date__gte=start_date, date__lte=end_date)
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    if user_id_range is not None:
+        queryset = queryset.filter(user_id__gte=user_id_range[0], user_id__lte=user_id_range[1])
+
+    totals = {}
+    missing = {}
+    converted = fx.converted_totals(queryset, ('user_id', 'type'), fx.reporting_currency(currency), missing=missing)
+    skipped = {user_id: str(error) for (user_id, _), error in missing.items()}
+    for (user_id, type), total in converted.items():
+        if user_id in skipped:
+            continue
+        row = totals.setdefault(user_id, {
+            'user_id': user_id, 'income_total': Decimal('0'), 'expense_total': Decimal('0'),
+        })
+        if type == Transaction.INCOME:
+            row['income_total'] += total
+        elif type == Transaction.EXPENSE:
+            row['expense_total'] += total
+    for user_id, error in skipped.items():
+        totals[user_id] = {'user_id': user_id, 'fx_missing': error}
+    return totals
+
+
+def user_id_ranges(chunk_size):
+    """Split the user id space into inclusive (first_id, last_id) ranges of chunk_size ids"""
+    bounds = get_user_model().objects.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return []
+    return [
+        (first, min(first + chunk_size - 1, bounds['last']))
+        for first in range(bounds['first'], bounds['last'] + 1, chunk_size)
+    ]
+
+
+def store_weekly_summaries(start_date, end_date, first_id, last_id):
+    """
+    Write WeeklySummary rows (in DEFAULT_CURRENCY) for users
+    first_id..last_id: one grouped rollup query, one query for the user
+    ids (both on the read replica) and one bulk upsert. Users whose
+    amounts cannot be converted are logged and left without a row.
+    Returns the number of rows written.
+    """
+    with replica_reads():
+        totals = compute_user_totals(start_date, end_date, user_id_range=(first_id, last_id))
+        user_ids = list(
+            get_user_model().objects.filter(id__range=(first_id, last_id)).values_list('id', flat=True)
+        )
+
+    summaries = []
+    for user_id in user_ids:
+        row = totals.get(user_id, {})
+        if 'fx_missing' in row:
+            logger.warning('Weekly summary skipped for user %s: %s', user_id, row['fx_missing'])
+            continue
+        income = row.get('income_total', Decimal('0'))
+        expense = row.get('expense_total', Decimal('0'))
+        summaries.append(WeeklySummary(
+            user_id=user_id, start_date=start_date, end_date=end_date,
+            income=income, expense=expense, balance=income - expense,
+        ))
+    WeeklySummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['user', 'start_date', 'end_date'],
+        update_fields=['income', 'expense', 'balance', 'updated_at'],
+    )
+    return len(summaries)
+
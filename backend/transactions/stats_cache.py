@@ -0,0 +1,196 @@
+"""
+Cached stats payloads.
+
+Every entry is stored under Django's cache key ``version`` set to a
+per-user data version. Any transaction/category/account write bumps that
+counter, so invalidation is a single INCR and old entries simply age out.
+The bump also stamps the user's last-modified time; together they are
+the watermark behind the views' ETag/Last-Modified headers. Payloads
+are per reporting currency, and their keys carry the FX rates version
+(see fx.py) so loading new rates retires converted totals too. A
+request without a currency uses the user's own (fx.user_currency()),
+cached until one of their accounts changes.
+Payloads are computed from the read replica (casho/db_router.py) unless
+the user has just written.
+
+With STATS_CACHE_STALE_WHILE_REVALIDATE enabled, a miss on the current
+version serves the last payload computed for the same range and lets a
+Celery task recompute it in the background.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from casho.db_router import areplica_reads, record_write, replica_reads
+
+from . import fx
+from .stats import acompute_stats, compute_stats
+
+STATS_CACHE_TIMEOUT = getattr(settings, 'STATS_CACHE_TIMEOUT', 300)
+STALE_TIMEOUT = getattr(settings, 'STATS_CACHE_STALE_TIMEOUT', 60 * 60 * 24)
+REFRESH_LOCK_TIMEOUT = 60
+
+
+def _version_key(user_id):
+    return f'stats:version:{user_id}'
+
+
+def _modified_key(user_id):
+    return f'stats:modified:{user_id}'
+
+
+def _stats_key(user_id, start_date, end_date, currency):
+    return f'stats:{user_id}:{currency}:{fx.rates_version()}:{start_date.isoformat()}:{end_date.isoformat()}'
+
+
+def _currency_key(user_id):
+    return f'stats:currency:{user_id}'
+
+
+def _stale_key(user_id, start_date, end_date, currency):
+    return f'stats-stale:{user_id}:{currency}:{start_date.isoformat()}:{end_date.isoformat()}'
+
+
+def data_version(user_id):
+    """Current data version for a user, initialised on first use"""
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # Start from the clock so an evicted counter never falls back onto
+        # a version that still has payloads cached against it
+        cache.add(_version_key(user_id), int(time.time() * 1000), timeout=None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def watermark(user_id):
+    """
+    (data version, last-modified unix time) for a user in one cache round
+    trip; the conditional GET views build ETag/Last-Modified from it
+    """
+    values = cache.get_many([_version_key(user_id), _modified_key(user_id)])
+    version = values.get(_version_key(user_id))
+    modified = values.get(_modified_key(user_id))
+    if version is None:
+        version = data_version(user_id)
+    if modified is None:
+        # Unknown: anything cached by a client may be older than this
+        modified = time.time()
+        cache.add(_modified_key(user_id), modified, timeout=None)
+    return version, modified
+
+
+def _incr_version(user_id):
+    cache.set(_modified_key(user_id), time.time(), timeout=None)
+    # Also keeps the user's reads off the replica until it has caught up
+    record_write(user_id)
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        data_version(user_id)
+
+
+def bump_data_version(user_id):
+    """Invalidate every cached stats payload for a user"""
+    _incr_version(user_id)
+    # Bump again after commit so a reader that raced the write cannot pin
+    # pre-commit data to the new version
+    transaction.on_commit(lambda: _incr_version(user_id))
+
+
+def store_stats(user_id, start_date, end_date, stats, version=None):
+    if version is None:
+        version = data_version(user_id)
+    currency = stats['currency']
+    cache.set(_stats_key(user_id, start_date, end_date, currency), stats, STATS_CACHE_TIMEOUT, version=version)
+    if getattr(settings, 'STATS_CACHE_STALE_WHILE_REVALIDATE', False):
+        cache.set(_stale_key(user_id, start_date, end_date, currency), stats, STALE_TIMEOUT)
+
+
+def refresh_stats(user_id, start_date, end_date, currency=None):
+    """Recompute and store the payload for the current data version"""
+    version = data_version(user_id)
+    with replica_reads(user_id):
+        stats = compute_stats(user_id, start_date, end_date, currency)
+    store_stats(user_id, start_date, end_date, stats, version=version)
+    return stats
+
+
+def default_currency(user_id):
+    """fx.user_currency() behind the cache"""
+    currency = cache.get(_currency_key(user_id))
+    if currency is None:
+        with replica_reads(user_id):
+            currency = fx.user_currency(user_id)
+        cache.set(_currency_key(user_id), currency, STATS_CACHE_TIMEOUT)
+    return currency
+
+
+async def adefault_currency(user_id):
+    """default_currency() through the async cache and ORM"""
+    currency = await cache.aget(_currency_key(user_id))
+    if currency is None:
+        async with areplica_reads(user_id):
+            currency = await fx.auser_currency(user_id)
+        await cache.aset(_currency_key(user_id), currency, STATS_CACHE_TIMEOUT)
+    return currency
+
+
+def forget_default_currency(user_id):
+    """Drop the cached default currency after one of the user's accounts changes"""
+    cache.delete(_currency_key(user_id))
+    transaction.on_commit(lambda: cache.delete(_currency_key(user_id)))
+
+
+def get_stats(user, start_date, end_date, currency=None):
+    """compute_stats() behind the per-user versioned cache; currency defaults to the user's own"""
+    currency = fx.reporting_currency(currency) if currency else default_currency(user.pk)
+    version, stats = cached_stats(user.pk, start_date, end_date, currency)
+    if stats is not None:
+        return stats
+    with replica_reads(user.pk):
+        stats = compute_stats(user, start_date, end_date, currency)
+    store_stats(user.pk, start_date, end_date, stats, version=version)
+    return stats
+
+
+async def aget_stats(user, start_date, end_date, currency=None):
+    """
+    get_stats() for the ASGI stats view: the cache lookups run in one
+    worker thread hop, the user's currency and a miss go through the
+    async ORM
+    """
+    currency = fx.reporting_currency(currency) if currency else await adefault_currency(user.pk)
+    version, stats = await sync_to_async(cached_stats)(user.pk, start_date, end_date, currency)
+    if stats is not None:
+        return stats
+    async with areplica_reads(user.pk):
+        stats = await acompute_stats(user, start_date, end_date, currency)
+    await sync_to_async(store_stats)(user.pk, start_date, end_date, stats, version=version)
+    return stats
+
+
+def cached_stats(user_id, start_date, end_date, currency):
+    """
+    (data version, payload): the payload cached for that version, else
+    the stale one (refreshed by a Celery task) when
+    STATS_CACHE_STALE_WHILE_REVALIDATE is on, else None
+    """
+    version = data_version(user_id)
+    stats = cache.get(_stats_key(user_id, start_date, end_date, currency), version=version)
+    if stats is not None:
+        return version, stats
+
+    if getattr(settings, 'STATS_CACHE_STALE_WHILE_REVALIDATE', False):
+        stale = cache.get(_stale_key(user_id, start_date, end_date, currency))
+        if stale is not None:
+            lock_key = (
+                f'stats-refresh:{user_id}:{version}:{currency}:{start_date.isoformat()}:{end_date.isoformat()}'
+            )
+            if cache.add(lock_key, 1, REFRESH_LOCK_TIMEOUT):
+                from .tasks import refresh_stats_cache
+                refresh_stats_cache.delay(user_id, start_date.isoformat(), end_date.isoformat(), currency)
+            return version, stale
+    return version, None
@@ -1,9 +1,47 @@
-from celery import shared_task
-from django.core.mail import send_mail
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPResponseException
+
+from celery import chord, group, shared_task
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.conf import settings
-from .models import Transaction
-from django.db.models import Sum
-from datetime import datetime, timedelta
+from django.core.cache import cache
+
+from casho.db_router import replica_reads
+
+from . import ledger
+from .fx import FxRateMissing, currency_symbol, user_currencies, user_currency
+from .importers import run_import
+from .models import ImportJob
+from .partitions import create_partitions
+from .retention import run_retention, start_run
+from .stats import compute_stats, compute_user_totals, store_weekly_summaries, user_id_ranges
+from .stats_cache import refresh_stats
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+RETENTION_LOCK_KEY = 'transactions:retention:lock'
+RETENTION_LOCK_TIMEOUT = 60 * 60 * 6
+
+
+def monthly_report_message(username, month, income_total, expense_total, balance, currency=None):
+    """月度报告邮件的标题和正文（金额已折算为 currency，默认 DEFAULT_CURRENCY）"""
+    symbol = currency_symbol(currency or settings.DEFAULT_CURRENCY)
+    subject = f'{month} 财务报告'
+    message = f"""
+        亲爱的 {username}，
+        
+        以下是您 {month} 的财务报告：
+        
+        总收入: {symbol}{income_total:.2f}
+        总支出: {symbol}{expense_total:.2f}
+        余额: {symbol}{balance:.2f}
+        
+        感谢使用 Casho！
+        """
+    return subject, message
 
 
 @shared_task
@@ -20,36 +58,15 @@ def send_monthly_report(user_id):
         start_date = now.replace(day=1).date()
         end_date = now.date()
         
-        transactions = Transaction.objects.filter(
-            user=user,
-            date__gte=start_date,
-            date__lte=end_date
+        with replica_reads():
+            currency = user_currency(user.id)
+            stats = compute_stats(user, start_date, end_date, currency)
+        subject, message = monthly_report_message(
+            user.username, now.strftime("%Y年%m月"),
+            stats['income_total'], stats['expense_total'], stats['balance'], currency
         )
         
-        income_total = transactions.filter(type='income').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        expense_total = transactions.filter(type='expense').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        balance = income_total - expense_total
-        
         # 发送邮件
-        subject = f'{now.strftime("%Y年%m月")} 财务报告'
-        message = f"""
-        亲爱的 {user.username}，
-        
-        以下是您 {now.strftime("%Y年%m月")} 的财务报告：
-        
-        总收入: ¥{income_total:.2f}
-        总支出: ¥{expense_total:.2f}
-        余额: ¥{balance:.2f}
-        
-        感谢使用 Casho！
-        """
-        
         send_mail(
             subject,
             message,
@@ -62,49 +79,200 @@ def send_monthly_report(user_id):
         
     except User.DoesNotExist:
         return f"用户 {user_id} 不存在"
+    except FxRateMissing as e:
+        logger.warning("用户 %s 的月度报告无法折算：%s", user_id, e)
+        return f"用户 {user_id} 缺少汇率，未发送月度报告"
+
+
+@shared_task
+def send_monthly_reports(start_date=None, end_date=None):
+    """
+    批量分派月度报告：默认统计上一个自然月。
+    按用户 id 分片，每片按用户的报告币种分组聚合，然后按批次投递发送任务。
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+
+    if start_date is None:
+        end = datetime.now().date().replace(day=1) - timedelta(days=1)
+        start = end.replace(day=1)
+    else:
+        start = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date)
+    month = start.strftime("%Y年%m月")
+
+    batch_size = settings.MONTHLY_REPORT_BATCH_SIZE
+    batches = 0
+    with replica_reads():
+        ranges = user_id_ranges(batch_size)
+    for first_id, last_id in ranges:
+        with replica_reads():
+            users = list(User.objects.filter(
+                id__gte=first_id, id__lte=last_id, is_active=True
+            ).exclude(email='').values_list('id', 'username', 'email'))
+            if not users:
+                continue
+            # 与单用户报告一致：按各自的报告币种统计，每种币种一次分组聚合查询
+            currencies = user_currencies([user_id for user_id, _, _ in users])
+            by_currency = defaultdict(list)
+            for user_id, currency in currencies.items():
+                by_currency[currency].append(user_id)
+            totals = {}
+            for currency, user_ids in by_currency.items():
+                totals.update(compute_user_totals(start, end, user_ids=user_ids, currency=currency))
+        reports = []
+        for user_id, username, email in users:
+            row = totals.get(user_id, {})
+            if 'fx_missing' in row:
+                # 缺少汇率只跳过该用户，不影响同批其他人
+                logger.warning("用户 %s 的月度报告无法折算：%s", user_id, row['fx_missing'])
+                continue
+            income_total = row.get('income_total', 0)
+            expense_total = row.get('expense_total', 0)
+            reports.append({
+                'username': username,
+                'email': email,
+                'currency': currencies[user_id],
+                'income_total': str(income_total),
+                'expense_total': str(expense_total),
+                'balance': str(income_total - expense_total),
+            })
+        if reports:
+            send_monthly_report_batch.delay(reports, month)
+            batches += 1
+
+    return f"{month} 月度报告已分为 {batches} 批投递"
+
+
+@shared_task(
+    bind=True,
+    rate_limit=settings.MONTHLY_REPORT_RATE_LIMIT,
+    max_retries=settings.MONTHLY_REPORT_MAX_RETRIES,
+    default_retry_delay=60,
+)
+def send_monthly_report_batch(self, reports, month):
+    """通过同一个 SMTP 连接发送一批月度报告；被永久拒收（5xx）的收件人记录后跳过，
+    临时故障（连接中断、4xx）时只重试尚未处理的部分"""
+    done = sent = 0
+    try:
+        with get_connection() as connection:
+            for report in reports:
+                subject, message = monthly_report_message(
+                    report['username'], month,
+                    Decimal(report['income_total']), Decimal(report['expense_total']), Decimal(report['balance']),
+                    report.get('currency'),
+                )
+                try:
+                    connection.send_messages([
+                        EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [report['email']])
+                    ])
+                    sent += 1
+                except SMTPException as exc:
+                    if not is_permanent_smtp_error(exc):
+                        raise
+                    logger.warning("%s 月度报告无法发送给 %s：%s", month, report['email'], exc)
+                done += 1
+    except (SMTPException, OSError) as exc:
+        raise self.retry(args=(reports[done:], month), exc=exc)
+    return f"{month} 月度报告已发送 {sent} 封，拒收 {done - sent} 封"
+
+
+def is_permanent_smtp_error(exc):
+    """收件人被拒或服务器返回 5xx：重试同一封邮件也不会成功"""
+    if isinstance(exc, SMTPRecipientsRefused):
+        return True
+    return isinstance(exc, SMTPResponseException) and exc.smtp_code >= 500
 
 
 @shared_task
 def cleanup_old_transactions():
-    """清理旧交易记录（保留2年）"""
-    cutoff_date = datetime.now().date() - timedelta(days=730)
-    deleted_count = Transaction.objects.filter(date__lt=cutoff_date).delete()[0]
-    return f"删除了 {deleted_count} 条旧交易记录"
+    """分批清理旧交易记录（默认保留2年），可先归档；中断后再次运行会从上次的位置继续"""
+    if not cache.add(RETENTION_LOCK_KEY, 1, RETENTION_LOCK_TIMEOUT):
+        return "清理任务正在运行"
+    try:
+        run = run_retention(start_run())
+    finally:
+        cache.delete(RETENTION_LOCK_KEY)
+    return f"删除了 {run.rows_deleted} 条旧交易记录（归档 {run.rows_archived} 条，{run.batches} 批）"
+
+
+@shared_task
+def create_transaction_partitions():
+    """提前创建未来的交易表分区"""
+    created = create_partitions()
+    return f"新建了 {len(created)} 个交易表分区"
+
+
+@shared_task
+def create_account_checkpoints():
+    """为所有账户生成上月末的余额检查点"""
+    written = ledger.create_checkpoints()
+    return f"生成了 {written} 个账户余额检查点"
+
+
+@shared_task
+def reconcile_account_balances(repair=True):
+    """核对账户余额与检查点，发现偏差时修复"""
+    balance_drifts, checkpoint_drifts = ledger.reconcile(repair=repair)
+    for account_id, day, stored, expected in balance_drifts + checkpoint_drifts:
+        logger.warning(
+            "账户 %s %s 余额偏差：记录 %s，应为 %s", account_id, day or '当前', stored, expected
+        )
+    return f"余额偏差 {len(balance_drifts)} 个，检查点偏差 {len(checkpoint_drifts)} 个"
 
 
 @shared_task
 def generate_weekly_summary():
-    """生成周报统计"""
-    from django.contrib.auth import get_user_model
-    User = get_user_model()
-    
-    now = datetime.now()
-    start_date = now.date() - timedelta(days=7)
-    end_date = now.date()
-    
-    summary = []
-    
-    for user in User.objects.all():
-        transactions = Transaction.objects.filter(
-            user=user,
-            date__gte=start_date,
-            date__lte=end_date
+    """生成周报统计，写入 WeeklySummary 表"""
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=7)
+    with replica_reads():
+        ranges = user_id_ranges(settings.WEEKLY_SUMMARY_CHUNK_SIZE)
+
+    if settings.WEEKLY_SUMMARY_FANOUT and len(ranges) > 1:
+        # 按用户 id 区间分片并行计算，全部完成后汇总
+        header = group(
+            generate_weekly_summary_chunk.s(first_id, last_id, start_date.isoformat(), end_date.isoformat())
+            for first_id, last_id in ranges
         )
-        
-        income_total = transactions.filter(type='income').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        expense_total = transactions.filter(type='expense').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        summary.append({
-            'user_id': user.id,
-            'username': user.username,
-            'income': float(income_total),
-            'expense': float(expense_total),
-            'balance': float(income_total - expense_total)
-        })
-    
-    return summary 
\ No newline at end of file
+        chord(header)(finish_weekly_summary.s(start_date.isoformat(), end_date.isoformat()))
+        return f"周报统计已分为 {len(ranges)} 个分片"
+
+    written = sum(
+        store_weekly_summaries(start_date, end_date, first_id, last_id)
+        for first_id, last_id in ranges
+    )
+    return f"已生成 {written} 条周报统计（{start_date} ~ {end_date}）"
+
+
+@shared_task
+def generate_weekly_summary_chunk(first_id, last_id, start_date, end_date):
+    """生成一个用户 id 区间的周报统计"""
+    return store_weekly_summaries(
+        date.fromisoformat(start_date), date.fromisoformat(end_date), first_id, last_id
+    )
+
+
+@shared_task
+def finish_weekly_summary(counts, start_date, end_date):
+    """汇总各分片的周报统计结果"""
+    return f"已生成 {sum(counts)} 条周报统计（{start_date} ~ {end_date}）"
+
+
+@shared_task
+def refresh_stats_cache(user_id, start_date, end_date, currency=None):
+    """后台重新计算统计缓存"""
+    refresh_stats(user_id, date.fromisoformat(start_date), date.fromisoformat(end_date), currency)
+    return f"已刷新用户 {user_id} 的统计缓存"
+
+
+@shared_task
+def import_transactions(job_id):
+    """后台导入银行流水文件"""
+    try:
+        job = ImportJob.objects.get(id=job_id)
+    except ImportJob.DoesNotExist:
+        return f"导入任务 {job_id} 不存在"
+
+    job = run_import(job)
+    return f"导入任务 {job_id} 完成：成功 {job.rows_imported} 条，失败 {job.rows_failed} 条"
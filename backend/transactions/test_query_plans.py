@@ -0,0 +1,230 @@
+import json
+import random
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+
+from . import partitions, rollups, search
+from .models import Category, RetentionRun, Transaction
+from .pagination import KEYSET_ORDERING, keyset_filter
+from .retention import run_retention
+
+User = get_user_model()
+
+
+def _plan_nodes(plan):
+    """Yield every node of an EXPLAIN (FORMAT JSON) plan tree"""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'EXPLAIN plans are PostgreSQL specific')
+class TransactionQueryPlanTest(TestCase):
+    """Fails when a hot per-user query degrades to a sequential scan of transactions"""
+    USERS = 20
+    ROWS_PER_USER = 500
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(42)
+        today = date.today()
+        rows = []
+        for i in range(cls.USERS):
+            user = User.objects.create_user(
+                username=f'planuser{i}',
+                email=f'planuser{i}@example.com',
+                password='testpass123'
+            )
+            categories = [
+                Category.objects.create(name='餐饮', type='expense', user=user),
+                Category.objects.create(name='工资', type='income', user=user),
+            ]
+            for _ in range(cls.ROWS_PER_USER):
+                category = rng.choice(categories)
+                rows.append(Transaction(
+                    user=user,
+                    category=category,
+                    type=category.type,
+                    amount=Decimal(rng.randint(100, 100000)) / 100,
+                    date=today - timedelta(days=rng.randint(0, 1500)),
+                ))
+            if i == 0:
+                cls.user = user
+        Transaction.objects.bulk_create(rows, batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Transaction._meta.db_table}')
+
+    def assertNoSeqScan(self, queryset):
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        for node in _plan_nodes(plan):
+            if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') == Transaction._meta.db_table:
+                self.fail(f'Sequential scan on {Transaction._meta.db_table}:\n{json.dumps(plan, indent=2)}')
+
+    def assertOrderedIndexScan(self, queryset, index, column):
+        """The rows come from a scan of index with a condition on column, in order, without a Sort"""
+        # Small tables can make sorting look as cheap as walking the index; this checks the
+        # index can serve the query at all, which is what keeps it cheap on large ones
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_sort = off')
+        try:
+            plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('RESET enable_sort')
+        nodes = list(_plan_nodes(plan))
+        if any(node['Node Type'] == 'Sort' for node in nodes) or not any(
+            node.get('Index Name') == index and column in node.get('Index Cond', '') for node in nodes
+        ):
+            self.fail(f'No ordered scan of {index} on {column}:\n{json.dumps(plan, indent=2)}')
+
+    def test_transaction_list(self):
+        queryset = Transaction.objects.filter(user=self.user).order_by('-date', '-created_at')[:20]
+        self.assertNoSeqScan(queryset)
+
+    def test_transaction_list_by_type(self):
+        queryset = Transaction.objects.filter(user=self.user, type='expense').order_by('-date', '-created_at')[:20]
+        self.assertNoSeqScan(queryset)
+
+    def test_transaction_list_keyset_page(self):
+        last = Transaction.objects.filter(user=self.user).order_by(*KEYSET_ORDERING)[300]
+        cursor = {'d': last.date, 'c': last.created_at, 'i': last.pk}
+        queryset = Transaction.objects.filter(user=self.user).filter(
+            keyset_filter(cursor)
+        ).order_by(*KEYSET_ORDERING)[:21]
+        self.assertNoSeqScan(queryset)
+        # The scan starts at the cursor instead of sorting every row after it
+        self.assertOrderedIndexScan(queryset, 'txn_user_keyset_idx', 'date')
+
+    def test_graphql_transactions_date_range(self):
+        end_date = date.today()
+        start_date = end_date - timedelta(days=30)
+        queryset = Transaction.objects.filter(
+            user=self.user, date__gte=start_date, date__lte=end_date
+        ).order_by('-date', '-created_at')
+        self.assertNoSeqScan(queryset)
+
+    def test_stats_totals_by_type(self):
+        end_date = date.today()
+        start_date = end_date - timedelta(days=365)
+        queryset = Transaction.objects.filter(
+            user=self.user, type='income', date__range=[start_date, end_date]
+        ).values('user').annotate(total=Sum('amount'))
+        self.assertNoSeqScan(queryset)
+
+    def test_stats_by_category(self):
+        end_date = date.today()
+        start_date = end_date - timedelta(days=30)
+        queryset = Transaction.objects.filter(
+            user=self.user, date__gte=start_date, date__lte=end_date
+        ).values('category__name', 'type').annotate(total=Sum('amount')).order_by('-total')
+        self.assertNoSeqScan(queryset)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Declarative partitioning is PostgreSQL specific')
+class TransactionPartitionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='partuser', email='partuser@example.com', password='x')
+        category = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.first_month = date.today().replace(day=1) - timedelta(days=200)
+        for days in range(0, 240, 10):
+            Transaction.objects.create(
+                user=self.user, category=category, amount=Decimal('1.00'), date=self.first_month + timedelta(days=days)
+            )
+        self.total = Transaction.objects.count()
+        self.copied = partitions.convert(interval='month', ahead=2)
+
+    def scanned_relations(self, queryset):
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        return {
+            node['Relation Name'] for node in _plan_nodes(plan)
+            if node.get('Relation Name', '').startswith(Transaction._meta.db_table)
+        }
+
+    def test_convert_keeps_rows_and_ids(self):
+        self.assertTrue(partitions.is_partitioned())
+        self.assertEqual(self.copied, self.total)
+        self.assertEqual(Transaction.objects.count(), self.total)
+        # New rows keep getting ids above the copied ones
+        latest = Transaction.objects.order_by('-id').first()
+        created = Transaction.objects.create(
+            user=self.user, category=latest.category, amount=Decimal('2.00'), date=date.today()
+        )
+        self.assertGreater(created.id, latest.id)
+        self.assertEqual(partitions.create_partitions(ahead=2), [])
+
+    def test_partition_created_over_rows_in_default(self):
+        # Past the pre-created horizon: lands in DEFAULT
+        later = partitions.period_start(date.today(), 'month')
+        for _ in range(4):
+            later = partitions.next_period(later, 'month')
+        row = Transaction.objects.create(
+            user=self.user, category=Category.objects.get(user=self.user), amount=Decimal('3.00'), date=later
+        )
+        created = partitions.create_partitions(ahead=4)
+        self.assertIn(partitions.partition_name(later, 'month'), created)
+        queryset = Transaction.objects.filter(date=later)
+        self.assertEqual(self.scanned_relations(queryset), {partitions.partition_name(later, 'month')})
+        self.assertEqual(list(queryset.values_list('id', flat=True)), [row.id])
+        self.assertEqual(Transaction.objects.count(), self.total + 1)
+
+    def test_date_range_prunes_partitions(self):
+        start = date.today().replace(day=1)
+        queryset = Transaction.objects.filter(user=self.user, date__gte=start, date__lte=start + timedelta(days=20))
+        self.assertEqual(self.scanned_relations(queryset), {partitions.partition_name(start, 'month')})
+
+    def test_retention_drops_whole_partitions(self):
+        cutoff = partitions.next_period(partitions.period_start(self.first_month, 'month'), 'month')
+        expired = partitions.expired_partitions(cutoff)
+        self.assertEqual(len(expired), 1)
+        old_rows = Transaction.objects.filter(date__lt=cutoff).count()
+
+        run = run_retention(RetentionRun.objects.create(cutoff_date=cutoff), pause=0)
+        self.assertEqual(run.rows_deleted, old_rows)
+        self.assertNotIn(expired[0][0], [name for name, _, _ in partitions.list_partitions()])
+        self.assertEqual(rollups.verify(), [])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'tsvector/pg_trgm search is PostgreSQL specific')
+class TransactionSearchIndexTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searchuser', email='searchuser@example.com', password='x')
+        self.category = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        rows = [
+            Transaction(user=self.user, category=self.category, type='expense', amount=Decimal('1.00'),
+                        description=f'row {i}', date=date.today())
+            for i in range(2000)
+        ]
+        Transaction.objects.bulk_create(rows + [
+            Transaction(user=self.user, category=self.category, type='expense', amount=Decimal('1.00'),
+                        description=description, date=date.today())
+            for description in ['Starbucks coffee', 'Coffee', 'Coffee beans and coffee filters']
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Transaction._meta.db_table}')
+
+    def test_trigger_keeps_vector_current(self):
+        row = Transaction.objects.get(description='Coffee')
+        Transaction.objects.filter(pk=row.pk).update(description='Bakery')
+        self.assertFalse(search.search(Transaction.objects.filter(pk=row.pk), 'coffee').exists())
+        self.assertTrue(search.search(Transaction.objects.filter(pk=row.pk), 'bake').exists())
+
+    def test_ranked_prefix_and_fuzzy_matches(self):
+        matches = list(search.search(Transaction.objects.filter(user=self.user), 'cof').order_by('-search_rank')
+                       .values_list('description', flat=True))
+        self.assertEqual(set(matches), {'Starbucks coffee', 'Coffee', 'Coffee beans and coffee filters'})
+        # Typo still found through trigram similarity
+        self.assertTrue(search.search(Transaction.objects.filter(user=self.user), 'starbuks').exists())
+        self.assertEqual(search.suggest(Transaction.objects.filter(user=self.user), 'coff', limit=1), ['Coffee'])
+
+    def test_search_uses_indexes(self):
+        queryset = search.search(Transaction.objects.all(), 'coffee', rank=False)
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        indexes = {node.get('Index Name') for node in _plan_nodes(plan)}
+        self.assertTrue({'txn_search_vector_idx', 'txn_description_trgm_idx'} & indexes, json.dumps(plan, indent=2))
+
@@ -1,12 +1,71 @@
-from django.test import TestCase
+import csv
+import functools
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from smtplib import SMTPDataError, SMTPException, SMTPRecipientsRefused
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
-from rest_framework.test import APITestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
-from .models import Category, Transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from casho.celery import app as celery_app
+from casho import db_router
+from casho.db_router import REPLICA
+from casho.views import AsyncGraphQLView
+from . import exporters, fx, importers, ledger, rollups
+from .bulk import bulk_create_transactions
+from .importers import run_import
+from .pagination import KEYSET_ORDERING
+from .retention import run_retention
+from .serializers import TransactionRowSerializer, TransactionSerializer
+from .models import (
+    Account, AccountBalanceCheckpoint, Category, FxRate, ImportJob, RetentionRun, Transaction, TransactionDailyRollup, WeeklySummary
+)
+from .stats import acompute_stats, compute_stats, compute_user_totals, store_weekly_summaries, user_id_ranges
+from .stats_cache import get_stats
+from .views import AsyncTransactionExportView, AsyncTransactionListCreateView, AsyncTransactionStatsView
+from .tasks import (
+    cleanup_old_transactions, generate_weekly_summary, refresh_stats_cache, send_monthly_report_batch,
+    send_monthly_reports
+)
 
 User = get_user_model()
 
 
+def eager_tasks(test):
+    """There is no Celery broker under test: run .delay(), groups and chords in-process"""
+    @functools.wraps(test)
+    def wrapper(*args, **kwargs):
+        previous = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        try:
+            return test(*args, **kwargs)
+        finally:
+            celery_app.conf.task_always_eager = previous
+    return wrapper
+
+
 class CategoryModelTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -89,4 +148,1395 @@ class TransactionAPITest(APITestCase):
         )
         response = self.client.get('/api/transactions/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data['results']), 1) 
\ No newline at end of file
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class TransactionStatsTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.salary = Category.objects.create(name='工资', type='income', user=self.user)
+        today = timezone.now().date()
+        Transaction.objects.create(user=self.user, category=self.food, amount=50, date=today)
+        Transaction.objects.create(user=self.user, category=self.food, amount=30, date=today)
+        Transaction.objects.create(user=self.user, category=self.salary, amount=1000, date=today)
+        Transaction.objects.create(
+            user=self.user, category=self.salary, amount=999, date=today - timedelta(days=400)
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_compute_stats(self):
+        today = timezone.now().date()
+        stats = compute_stats(self.user, today - timedelta(days=30), today)
+        self.assertEqual(stats['income_total'], Decimal('1000'))
+        self.assertEqual(stats['expense_total'], Decimal('80'))
+        self.assertEqual(stats['balance'], Decimal('920'))
+        self.assertEqual(
+            [(row['category__name'], row['total']) for row in stats['category_stats']],
+            [('工资', Decimal('1000')), ('餐饮', Decimal('80'))]
+        )
+
+    def test_compute_stats_single_query(self):
+        for i in range(10):
+            Category.objects.create(name=f'分类{i}', type='expense', user=self.user)
+        today = timezone.now().date()
+        with self.assertNumQueries(1):
+            compute_stats(self.user, today - timedelta(days=30), today)
+
+    def test_stats_endpoint(self):
+        response = self.client.get('/api/transactions/stats/', {'period': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['income_total'], 1000.0)
+        self.assertEqual(response.data['expense_total'], 80.0)
+        self.assertEqual(response.data['balance'], 920.0)
+        self.assertEqual(len(response.data['category_stats']), 2)
+
+    def test_graphql_stats(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            '/graphql/',
+            {'query': '{ stats { totalIncome totalExpense balance categoryStats } }'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = response.json()['data']['stats']
+        self.assertEqual(Decimal(stats['totalIncome']), Decimal('1000'))
+        self.assertEqual(Decimal(stats['totalExpense']), Decimal('80'))
+        self.assertEqual(json.loads(stats['categoryStats']), {'工资': 1000.0, '餐饮': 80.0})
+
+    def test_weekly_summary(self):
+        other = User.objects.create_user(
+            username='other',
+            email='other@example.com',
+            password='testpass123'
+        )
+        generate_weekly_summary()
+        summary = {row.user_id: row for row in WeeklySummary.objects.all()}
+        self.assertEqual(summary[self.user.id].income, Decimal('1000'))
+        self.assertEqual(summary[self.user.id].expense, Decimal('80'))
+        self.assertEqual(summary[other.id].balance, Decimal('0'))
+
+    @eager_tasks
+    def test_weekly_summary_chunks(self):
+        users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+            for i in range(5)
+        ]
+        for user in users:
+            category = Category.objects.create(name='餐饮', type='expense', user=user)
+            Transaction.objects.create(user=user, category=category, amount=10, date=timezone.now().date())
+
+        # Three queries per chunk of user ids, however many users or rows it holds
+        with override_settings(WEEKLY_SUMMARY_CHUNK_SIZE=2), CaptureQueriesContext(connection) as queries:
+            generate_weekly_summary()
+        chunks = len(user_id_ranges(2))
+        self.assertEqual(len(queries), 1 + 3 * chunks)
+        self.assertEqual(WeeklySummary.objects.count(), 6)
+
+        # Re-running the same window updates the rows in place; fan-out gives the same result
+        Transaction.objects.create(user=users[0], category=users[0].category_set.get(), amount=5, date=timezone.now().date())
+        with override_settings(WEEKLY_SUMMARY_CHUNK_SIZE=2, WEEKLY_SUMMARY_FANOUT=True):
+            generate_weekly_summary()
+        self.assertEqual(WeeklySummary.objects.count(), 6)
+        self.assertEqual(WeeklySummary.objects.get(user=users[0]).expense, Decimal('15'))
+
+
+class TransactionRollupTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.transport = Category.objects.create(name='交通', type='expense', user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def rollup(self, category, date):
+        row = TransactionDailyRollup.objects.filter(
+            user=self.user, category=category, date=date
+        ).values('amount', 'count').first()
+        return (row['amount'], row['count']) if row else None
+
+    def test_orm_create_update_delete(self):
+        transaction = Transaction.objects.create(
+            user=self.user, category=self.food, amount=50.00, date='2024-01-01'
+        )
+        Transaction.objects.create(user=self.user, category=self.food, amount=20, date='2024-01-01')
+        self.assertEqual(self.rollup(self.food, '2024-01-01'), (Decimal('70'), 2))
+
+        transaction.amount = Decimal('60')
+        transaction.save()
+        self.assertEqual(self.rollup(self.food, '2024-01-01'), (Decimal('80'), 2))
+
+        transaction.date = '2024-01-02'
+        transaction.category = self.transport
+        transaction.save()
+        self.assertEqual(self.rollup(self.food, '2024-01-01'), (Decimal('20'), 1))
+        self.assertEqual(self.rollup(self.transport, '2024-01-02'), (Decimal('60'), 1))
+
+        transaction.delete()
+        self.assertEqual(self.rollup(self.transport, '2024-01-02'), (Decimal('0'), 0))
+        self.assertEqual(rollups.verify(), [])
+
+    def test_rest_update_and_delete(self):
+        response = self.client.post('/api/transactions/', {
+            'category': self.food.id, 'amount': 50.00, 'date': '2024-01-01'
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        transaction = Transaction.objects.get()
+
+        response = self.client.patch(f'/api/transactions/{transaction.id}/', {'amount': '75.00'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.rollup(self.food, '2024-01-01'), (Decimal('75'), 1))
+
+        response = self.client.delete(f'/api/transactions/{transaction.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.rollup(self.food, '2024-01-01'), (Decimal('0'), 0))
+
+    def test_graphql_create(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/graphql/', {
+            'query': 'mutation($input: TransactionInput!) { createTransaction(input: $input) { id } }',
+            'variables': {'input': {'categoryId': self.food.id, 'amount': '12.50', 'date': '2024-01-01'}},
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.rollup(self.food, '2024-01-01'), (Decimal('12.5'), 1))
+
+    def test_category_cascade_delete(self):
+        Transaction.objects.create(user=self.user, category=self.food, amount=50, date='2024-01-01')
+        self.food.delete()
+        self.assertFalse(TransactionDailyRollup.objects.exists())
+
+    def test_rebuild_command(self):
+        Transaction.objects.create(user=self.user, category=self.food, amount=50, date='2024-01-01')
+        TransactionDailyRollup.objects.update(amount=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--verify', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollup(self.food, '2024-01-01'), (Decimal('50'), 1))
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+
+class StatsCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.today = timezone.now().date()
+        self.start_date = self.today - timedelta(days=30)
+        Transaction.objects.create(user=self.user, category=self.food, amount=50, date=self.today)
+
+    def test_cached_until_write(self):
+        get_stats(self.user, self.start_date, self.today)
+        with self.assertNumQueries(0):
+            stats = get_stats(self.user, self.start_date, self.today)
+        self.assertEqual(stats['expense_total'], Decimal('50'))
+
+        Transaction.objects.create(user=self.user, category=self.food, amount=30, date=self.today)
+        with self.assertNumQueries(1):
+            stats = get_stats(self.user, self.start_date, self.today)
+        self.assertEqual(stats['expense_total'], Decimal('80'))
+
+    def test_category_write_invalidates(self):
+        get_stats(self.user, self.start_date, self.today)
+        self.food.name = '外卖'
+        self.food.save()
+        stats = get_stats(self.user, self.start_date, self.today)
+        self.assertEqual(stats['category_stats'][0]['category__name'], '外卖')
+
+    @override_settings(STATS_CACHE_STALE_WHILE_REVALIDATE=True)
+    def test_stale_while_revalidate(self):
+        get_stats(self.user, self.start_date, self.today)
+        Transaction.objects.create(user=self.user, category=self.food, amount=30, date=self.today)
+
+        with mock.patch('transactions.tasks.refresh_stats_cache.delay') as delay:
+            with self.assertNumQueries(0):
+                stats = get_stats(self.user, self.start_date, self.today)
+            get_stats(self.user, self.start_date, self.today)
+        self.assertEqual(stats['expense_total'], Decimal('50'))
+        delay.assert_called_once_with(self.user.pk, self.start_date.isoformat(), self.today.isoformat(), 'CNY')
+
+        refresh_stats_cache(self.user.pk, self.start_date.isoformat(), self.today.isoformat())
+        with self.assertNumQueries(0):
+            stats = get_stats(self.user, self.start_date, self.today)
+        self.assertEqual(stats['expense_total'], Decimal('80'))
+
+
+class TransactionCursorPaginationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.salary = Category.objects.create(name='工资', type='income', user=self.user)
+        # Several rows share a date so the created_at/id tie-breakers matter
+        for i in range(25):
+            category = self.salary if i % 5 == 0 else self.food
+            Transaction.objects.create(
+                user=self.user, category=category, amount=i + 1,
+                description=f'午餐 {i}' if i % 2 else f'晚餐 {i}',
+                date=f'2024-01-{i // 3 + 1:02d}'
+            )
+        self.client.force_authenticate(user=self.user)
+        self.expected = list(
+            Transaction.objects.filter(user=self.user)
+            .order_by(*KEYSET_ORDERING).values_list('id', flat=True)
+        )
+
+    def walk(self, params):
+        ids = []
+        response = self.client.get('/api/transactions/', params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(row['id'] for row in response.data['results'])
+            if not response.data['next']:
+                return ids, response
+            response = self.client.get(response.data['next'])
+
+    def test_walks_all_pages_in_order(self):
+        ids, last = self.walk({'pagination': 'cursor', 'page_size': 7})
+        self.assertEqual(ids, self.expected)
+
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual([row['id'] for row in previous.data['results']], self.expected[14:21])
+
+    def test_filters_and_search(self):
+        ids, _ = self.walk({'pagination': 'cursor', 'page_size': 2, 'type': 'expense', 'search': '午餐'})
+        expected = list(
+            Transaction.objects.filter(user=self.user, type='expense', description__contains='午餐')
+            .order_by(*KEYSET_ORDERING).values_list('id', flat=True)
+        )
+        self.assertTrue(expected)
+        self.assertEqual(ids, expected)
+
+    def test_count_is_opt_in(self):
+        response = self.client.get('/api/transactions/', {'pagination': 'cursor', 'count': 'exact'})
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/transactions/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_ordering_rejected(self):
+        # Keyset pages only exist in the keyset ordering
+        response = self.client.get('/api/transactions/', {'pagination': 'cursor', 'ordering': 'amount'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ordering', response.data)
+
+
+@override_settings(GRAPHQL_QUERY_COST={'MAX_COST': 10 ** 9})
+class GraphQLBatchLoadingTest(TestCase):
+    QUERY = '''
+    {
+      transactions { id category { name transactionSet { id account { name } } } account { name } user { email } }
+      categories { name transactionSet { id category { name } } }
+      accounts { name transactionSet { id } }
+    }
+    '''
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.client.force_login(self.user)
+
+    def add_rows(self, count):
+        start = Category.objects.filter(user=self.user).count()
+        for i in range(start, start + count):
+            category = Category.objects.create(name=f'分类{i}', type='expense', user=self.user)
+            account = Account.objects.create(name=f'账户{i}', currency='CNY', user=self.user)
+            Transaction.objects.create(
+                user=self.user, category=category, account=account, amount=10, date='2024-01-01'
+            )
+
+    def run_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/graphql/', {'query': self.QUERY}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('errors', response.json())
+        return response.json()['data'], len(queries)
+
+    def test_constant_query_count(self):
+        self.add_rows(2)
+        data, small = self.run_query()
+        self.assertEqual(len(data['transactions']), 2)
+
+        self.add_rows(30)
+        data, large = self.run_query()
+        self.assertEqual(len(data['transactions']), 32)
+        self.assertEqual(small, large)
+
+        row = data['transactions'][0]
+        self.assertEqual(row['user']['email'], 'test@example.com')
+        self.assertEqual(row['category']['transactionSet'][0]['id'], row['id'])
+        self.assertEqual(row['account']['name'], row['category']['transactionSet'][0]['account']['name'])
+
+    @override_settings(GRAPHQL_QUERY_COST={**settings.GRAPHQL_QUERY_COST, 'LIST_SIZES': {
+        **settings.GRAPHQL_QUERY_COST['LIST_SIZES'], 'CategoryType.transactionSet': 2,
+    }})
+    def test_transaction_sets_bounded_and_owned(self):
+        category = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        for day in (1, 2, 3):
+            Transaction.objects.create(user=self.user, category=category, amount=day, date=f'2024-01-0{day}')
+        other = User.objects.create_user(username='other', email='other@example.com', password='x')
+        Transaction.objects.create(user=other, category=category, amount=99, date='2024-01-09')
+
+        query = '{ categories { transactionSet { amount } } }'
+        response = self.client.post('/graphql/', {'query': query}, content_type='application/json')
+        amounts = [row['amount'] for row in response.json()['data']['categories'][0]['transactionSet']]
+        self.assertEqual([Decimal(amount) for amount in amounts], [3, 2])
+
+
+class GraphQLTransactionConnectionTest(TestCase):
+    QUERY = '''
+    query($first: Int, $after: String, $categoryId: ID) {
+      transactionsConnection(first: $first, after: $after, categoryId: $categoryId) {
+        edges { cursor node { id } }
+        pageInfo { hasNextPage hasPreviousPage endCursor }
+      }
+    }
+    '''
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.salary = Category.objects.create(name='工资', type='income', user=self.user)
+        for i in range(12):
+            Transaction.objects.create(
+                user=self.user, category=self.food if i % 3 else self.salary,
+                amount=i + 1, date=f'2024-01-{i // 4 + 1:02d}'
+            )
+        self.client.force_login(self.user)
+
+    def query(self, **variables):
+        response = self.client.post(
+            '/graphql/', {'query': self.QUERY, 'variables': variables}, content_type='application/json'
+        )
+        return response.json()
+
+    def walk(self, **variables):
+        ids = []
+        after = None
+        while True:
+            page = self.query(after=after, **variables)['data']['transactionsConnection']
+            ids.extend(int(edge['node']['id']) for edge in page['edges'])
+            self.assertEqual(page['pageInfo']['hasPreviousPage'], after is not None)
+            if not page['pageInfo']['hasNextPage']:
+                return ids
+            after = page['pageInfo']['endCursor']
+
+    def test_walks_all_pages(self):
+        expected = list(
+            Transaction.objects.order_by(*KEYSET_ORDERING).values_list('id', flat=True)
+        )
+        self.assertEqual(self.walk(first=5), expected)
+
+    def test_keeps_filters(self):
+        expected = list(
+            Transaction.objects.filter(category=self.food)
+            .order_by(*KEYSET_ORDERING).values_list('id', flat=True)
+        )
+        self.assertEqual(self.walk(first=3, categoryId=self.food.id), expected)
+
+    @override_settings(GRAPHQL_MAX_PAGE_SIZE=4)
+    def test_page_size_is_capped(self):
+        page = self.query(first=1000)['data']['transactionsConnection']
+        self.assertEqual(len(page['edges']), 4)
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+    def test_invalid_cursor(self):
+        self.assertIn('errors', self.query(after='bogus'))
+
+    def test_legacy_list_flags_truncation(self):
+        def legacy(**variables):
+            query = 'query($categoryId: ID) { transactions(categoryId: $categoryId) { id } }'
+            response = self.client.post(
+                '/graphql/', {'query': query, 'variables': variables}, content_type='application/json'
+            )
+            return response.json()
+
+        with override_settings(GRAPHQL_TRANSACTIONS_LIST_LIMIT=8):
+            body = legacy()
+            self.assertEqual(len(body['data']['transactions']), 8)
+            self.assertEqual(body['extensions']['truncated'], [{'path': ['transactions'], 'limit': 8}])
+
+            body = legacy(categoryId=self.food.id)
+            self.assertEqual(len(body['data']['transactions']), 8)
+            self.assertNotIn('truncated', body['extensions'])
+
+
+class GraphQLBulkMutationTest(TestCase):
+    TRANSACTIONS = '''
+    mutation($inputs: [TransactionInput!]!, $allOrNothing: Boolean) {
+      createTransactions(inputs: $inputs, allOrNothing: $allOrNothing) {
+        transactions { id amount type category { name } }
+        errors { index message }
+      }
+    }
+    '''
+    CATEGORIES = '''
+    mutation($inputs: [CategoryInput!]!) {
+      createCategories(inputs: $inputs) { categories { id name } errors { index message } }
+    }
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        other = User.objects.create_user(
+            username='other',
+            email='other@example.com',
+            password='testpass123'
+        )
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.foreign = Category.objects.create(name='餐饮', type='expense', user=other)
+        self.client.force_login(self.user)
+
+    def mutate(self, query, **variables):
+        response = self.client.post(
+            '/graphql/', {'query': query, 'variables': variables}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def test_create_transactions_with_item_errors(self):
+        inputs = [
+            {'categoryId': self.food.id, 'amount': '10.00', 'date': '2024-01-01'},
+            {'categoryId': self.foreign.id, 'amount': '20.00', 'date': '2024-01-01'},
+            {'categoryId': self.food.id, 'amount': '30.00', 'date': '2024-01-01', 'description': '晚餐'},
+            {'categoryId': self.food.id, 'amount': '123456789.00', 'date': '2024-01-01'},
+        ]
+        result = self.mutate(self.TRANSACTIONS, inputs=inputs)['createTransactions']
+        self.assertEqual([error['index'] for error in result['errors']], [1, 3])
+        self.assertEqual(len(result['transactions']), 2)
+        self.assertEqual(result['transactions'][0]['type'], 'EXPENSE')
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+
+        # The rollup and the stats cache see rows that bypassed save()
+        self.assertEqual(rollups.verify(), [])
+        stats = get_stats(self.user, date(2024, 1, 1), date(2024, 1, 31))
+        self.assertEqual(stats['expense_total'], Decimal('40'))
+
+    def test_all_or_nothing(self):
+        inputs = [
+            {'categoryId': self.food.id, 'amount': '10.00', 'date': '2024-01-01'},
+            {'categoryId': 'nope', 'amount': '20.00', 'date': '2024-01-01'},
+        ]
+        result = self.mutate(self.TRANSACTIONS, inputs=inputs, allOrNothing=True)['createTransactions']
+        self.assertEqual(result['transactions'], [])
+        self.assertEqual(result['errors'], [{'index': 1, 'message': 'Category does not exist'}])
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_query_count_is_constant(self):
+        # Every row on its own day, so each needs a rollup row of its own
+        inputs = [{'categoryId': self.food.id, 'amount': '1.00', 'date': f'2024-01-{i + 1:02d}'} for i in range(20)]
+        with CaptureQueriesContext(connection) as queries:
+            self.mutate(self.TRANSACTIONS, inputs=inputs[:2])
+        with CaptureQueriesContext(connection) as more_queries:
+            self.mutate(self.TRANSACTIONS, inputs=inputs[2:])
+        self.assertEqual(len(queries), 12)
+        self.assertEqual(len(more_queries), len(queries))
+        self.assertEqual(TransactionDailyRollup.objects.filter(user=self.user).count(), 20)
+
+    def test_create_categories(self):
+        inputs = [
+            {'name': '交通', 'type': 'expense'},
+            {'name': '餐饮', 'type': 'expense'},
+            {'name': '交通', 'type': 'expense'},
+            {'name': '工资', 'type': 'salary'},
+        ]
+        result = self.mutate(self.CATEGORIES, inputs=inputs)['createCategories']
+        self.assertEqual([category['name'] for category in result['categories']], ['交通'])
+        self.assertEqual([error['index'] for error in result['errors']], [1, 2, 3])
+
+
+class TransactionImportTest(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = User.objects.create_user(username='importer', email='importer@example.com', password='testpass123')
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, name, content, **data):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                '/api/transactions/imports/',
+                {'file': SimpleUploadedFile(name, content.encode('utf-8')), **data},
+                format='multipart',
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        # The Celery task is only queued once the upload is committed
+        self.assertEqual(len(callbacks), 1)
+        return ImportJob.objects.get(id=response.data['id'])
+
+    def test_csv_import_in_batches(self):
+        rows = ['date,amount,description,category,type']
+        rows += [f'2024-01-{day:02d},{day}.50,午餐,餐饮,expense' for day in range(1, 8)]
+        rows += ['2024-01-08,-20,地铁,交通,', '2024-01-09,5000,,工资,', 'not-a-date,1,,餐饮,expense']
+        job = self.upload('statement.csv', '\n'.join(rows))
+        self.assertEqual(job.format, ImportJob.CSV)
+
+        with CaptureQueriesContext(connection) as queries:
+            job = run_import(job, batch_size=3)
+        self.assertEqual(job.status, ImportJob.COMPLETED)
+        self.assertEqual((job.rows_processed, job.rows_imported, job.rows_failed), (10, 9, 1))
+        self.assertEqual(job.errors[0]['line'], 11)
+        self.assertLess(len(queries), 60)
+
+        imported = Transaction.objects.filter(user=self.user)
+        self.assertEqual(imported.filter(category=self.food).count(), 7)
+        self.assertEqual(imported.get(description='地铁').category.name, '交通')
+        self.assertEqual(imported.get(date='2024-01-09').type, 'income')
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+        response = self.client.get(f'/api/transactions/imports/{job.id}/')
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(response.data['progress'], 1.0)
+
+    def test_failed_import_resumes_after_committed_batches(self):
+        rows = ['date,amount,description,category,type']
+        rows += [f'2024-01-{day:02d},{day},行{day},餐饮,expense' for day in range(1, 8)]
+        rows.insert(3, 'bad,1,,餐饮,expense')
+        job = self.upload('statement.csv', '\n'.join(rows))
+
+        bulk_create = importers.bulk_create_transactions
+        calls = []
+
+        def failing_bulk_create(batch, **kwargs):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                raise RuntimeError('database went away')
+            return bulk_create(batch, **kwargs)
+
+        with mock.patch.object(importers, 'bulk_create_transactions', failing_bulk_create):
+            with self.assertRaises(RuntimeError):
+                run_import(job, batch_size=3)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        # Only the first batch, and the bad row read with it, are committed
+        self.assertEqual((job.rows_processed, job.rows_imported, job.rows_failed), (4, 3, 1))
+        self.assertEqual([error['line'] for error in job.errors], [4, None])
+
+        job = run_import(job, batch_size=3)
+        self.assertEqual(job.status, ImportJob.COMPLETED)
+        self.assertEqual((job.rows_processed, job.rows_imported, job.rows_failed), (8, 7, 1))
+        self.assertEqual([error['line'] for error in job.errors], [4])
+        descriptions = Transaction.objects.filter(user=self.user).values_list('description', flat=True)
+        self.assertEqual(sorted(descriptions), sorted(f'行{day}' for day in range(1, 8)))
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+        # Running a completed job again changes nothing
+        self.assertEqual(run_import(job).rows_imported, 7)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 7)
+
+    def test_jsonl_and_ofx_import(self):
+        job = self.upload('export.ndjson', '\n'.join([
+            json.dumps({'date': '2024-02-01', 'amount': '12.30', 'category': '餐饮', 'type': 'expense'}),
+            '',
+            '{broken',
+        ]))
+        job = run_import(job)
+        self.assertEqual((job.rows_imported, job.rows_failed), (1, 1))
+
+        ofx = (
+            'OFXHEADER:100\nDATA:OFXSGML\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>'
+            '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240203120000<TRNAMT>-45.00<NAME>超市</STMTTRN>'
+            '<STMTTRN>\n<TRNTYPE>CREDIT\n<DTPOSTED>20240204\n<TRNAMT>100.00\n<MEMO>退款\n</STMTTRN>'
+            '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>'
+        )
+        job = run_import(self.upload('bank.ofx', ofx))
+        self.assertEqual(job.rows_imported, 2)
+        expense = Transaction.objects.get(user=self.user, description='超市')
+        self.assertEqual((expense.type, expense.amount, expense.date), ('expense', Decimal('45.00'), date(2024, 2, 3)))
+        self.assertTrue(Transaction.objects.filter(user=self.user, description='退款', type='income').exists())
+
+    def test_rejects_unknown_format_and_foreign_account(self):
+        response = self.client.post(
+            '/api/transactions/imports/',
+            {'file': SimpleUploadedFile('statement.xls', b'x')}, format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        account = Account.objects.create(name='Checking', currency='USD', user=other)
+        response = self.client.post(
+            '/api/transactions/imports/',
+            {'file': SimpleUploadedFile('statement.csv', b'date,amount\n'), 'account': account.id},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TransactionExportTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='exporter', email='exporter@example.com', password='testpass123')
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.salary = Category.objects.create(name='工资', type='income', user=self.user)
+        self.account = Account.objects.create(name='Checking', currency='USD', user=self.user)
+        for day in range(1, 6):
+            Transaction.objects.create(
+                user=self.user, category=self.food, account=self.account,
+                amount=Decimal(day), description=f'午餐, 第{day}天', date=date(2024, 3, day)
+            )
+        Transaction.objects.create(user=self.user, category=self.salary, amount=Decimal('9000'), date=date(2024, 3, 10))
+        self.client.force_authenticate(user=self.user)
+
+    def export(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/transactions/export/', params)
+            body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, body, queries
+
+    def test_csv_export_honours_list_filters(self):
+        response, body, queries = self.export(type='expense', ordering='date')
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(body.lstrip('\ufeff'))))
+        self.assertEqual(rows[0][:4], ['id', 'date', 'type', 'amount'])
+        self.assertEqual([row[1] for row in rows[1:]], [f'2024-03-0{day}' for day in range(1, 6)])
+        self.assertEqual(rows[1][5], '餐饮')
+        self.assertEqual(rows[1][7], 'Checking')
+        self.assertEqual(rows[1][8], '午餐, 第1天')
+        # One query for all rows and their category/account
+        self.assertEqual(len(queries), 1)
+
+    def test_csv_cells_guarded_against_formulas(self):
+        Category.objects.filter(pk=self.salary.pk).update(name='@SUM(A1)')
+        Transaction.objects.filter(category=self.salary).update(description='=HYPERLINK("http://x.invalid")')
+        _, body, _ = self.export(type='income')
+        row = list(csv.reader(StringIO(body.lstrip('\ufeff'))))[1]
+        self.assertEqual((row[5], row[8]), ("'@SUM(A1)", '\'=HYPERLINK("http://x.invalid")'))
+
+        # Only the CSV is a spreadsheet
+        _, body, _ = self.export(type='income', output='ndjson')
+        self.assertEqual(json.loads(body)['description'], '=HYPERLINK("http://x.invalid")')
+
+    def test_ndjson_export(self):
+        response, body, _ = self.export(output='ndjson', search='第3天')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['amount'], '3.00')
+        self.assertEqual(rows[0]['category_name'], '餐饮')
+
+        response = self.client.get('/api/transactions/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MonthlyReportDispatchTest(TestCase):
+    def setUp(self):
+        self.users = []
+        for i in range(5):
+            user = User.objects.create_user(username=f'reader{i}', email=f'reader{i}@example.com', password='x')
+            category = Category.objects.create(name='餐饮', type='expense', user=user)
+            Transaction.objects.create(user=user, category=category, amount=10 + i, date=date(2024, 4, 15))
+            # Outside the report window
+            Transaction.objects.create(user=user, category=category, amount=99, date=date(2024, 5, 1))
+            self.users.append(user)
+        User.objects.create_user(username='noemail', email='', password='x')
+        User.objects.create_user(username='inactive', email='inactive@example.com', password='x', is_active=False)
+
+    @eager_tasks
+    @override_settings(MONTHLY_REPORT_BATCH_SIZE=2)
+    def test_dispatch_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            send_monthly_reports('2024-04-01', '2024-04-30')
+        # The id bounds, then per chunk of user ids: its users, their currencies and one
+        # grouped totals query per currency (all CNY here). The last chunk holds only the
+        # inactive user, so it stops after the first
+        chunks = len(user_id_ranges(2))
+        self.assertEqual(len(queries), 1 + 3 * (chunks - 1) + 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f'reader{i}@example.com' for i in range(5)])
+        message = next(message for message in mail.outbox if message.to == ['reader3@example.com'])
+        self.assertEqual(message.subject, '2024年04月 财务报告')
+        self.assertIn('总支出: ¥13.00', message.body)
+        self.assertIn('余额: ¥-13.00', message.body)
+
+    @eager_tasks
+    def test_batch_reuses_one_connection_and_retries_the_rest(self):
+        reports = [
+            {'username': f'u{i}', 'email': f'u{i}@example.com', 'income_total': '0', 'expense_total': '1', 'balance': '-1'}
+            for i in range(4)
+        ]
+        send_messages = locmem.EmailBackend.send_messages
+        calls = []
+
+        def flaky_send(backend, messages):
+            calls.append(id(backend))
+            if len(calls) == 3:
+                raise SMTPException('temporary failure')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', flaky_send):
+            send_monthly_report_batch.delay(reports, '2024年04月')
+        # Every report is sent exactly once; the retry picks up after the failed one
+        self.assertEqual([message.to[0] for message in mail.outbox], [f'u{i}@example.com' for i in range(4)])
+        self.assertEqual(len(set(calls[:3])), 1)
+
+    @eager_tasks
+    def test_rejected_recipients_skipped_not_retried(self):
+        reports = [
+            {'username': f'u{i}', 'email': f'u{i}@example.com', 'income_total': '0', 'expense_total': '1', 'balance': '-1'}
+            for i in range(4)
+        ]
+        send_messages = locmem.EmailBackend.send_messages
+        failures = {
+            'u1@example.com': SMTPRecipientsRefused({'u1@example.com': (550, b'No such user')}),
+            'u2@example.com': SMTPDataError(554, b'Message rejected'),
+        }
+        attempts = []
+
+        def rejecting_send(backend, messages):
+            attempts.append(messages[0].to[0])
+            if messages[0].to[0] in failures:
+                raise failures[messages[0].to[0]]
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', rejecting_send), \
+                mock.patch.object(send_monthly_report_batch, 'retry') as retry, \
+                self.assertLogs('transactions.tasks', 'WARNING') as logs:
+            result = send_monthly_report_batch.delay(reports, '2024年04月').get()
+        retry.assert_not_called()
+        self.assertEqual(attempts, [f'u{i}@example.com' for i in range(4)])
+        self.assertEqual([message.to[0] for message in mail.outbox], ['u0@example.com', 'u3@example.com'])
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('拒收 2 封', result)
+
+    @eager_tasks
+    def test_temporary_rejection_retried(self):
+        report = {'username': 'u', 'email': 'u@example.com', 'income_total': '0', 'expense_total': '1', 'balance': '-1'}
+        send_messages = locmem.EmailBackend.send_messages
+        attempts = []
+
+        def greylisting_send(backend, messages):
+            attempts.append(messages[0].to[0])
+            if len(attempts) == 1:
+                raise SMTPDataError(451, b'Try again later')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', greylisting_send):
+            send_monthly_report_batch.delay([report], '2024年04月')
+        self.assertEqual(attempts, ['u@example.com', 'u@example.com'])
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class RetentionTest(TestCase):
+    def setUp(self):
+        self.archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_root, ignore_errors=True)
+        archive = override_settings(TRANSACTION_ARCHIVE_ROOT=self.archive_root, TRANSACTION_RETENTION_BATCH_PAUSE=0)
+        archive.enable()
+        self.addCleanup(archive.disable)
+
+        self.users = [
+            User.objects.create_user(username=f'keeper{i}', email=f'keeper{i}@example.com', password='x')
+            for i in range(2)
+        ]
+        self.old_ids = []
+        for user in self.users:
+            category = Category.objects.create(name='餐饮', type='expense', user=user)
+            for day in (1, 2, 40):
+                txn = Transaction.objects.create(
+                    user=user, category=category, amount=day, description=f'旧{day}', date=date(2020, 1, 1) + timedelta(days=day)
+                )
+                self.old_ids.append(txn.id)
+            Transaction.objects.create(user=user, category=category, amount=7, date=timezone.now().date())
+
+    def test_purge_with_archive_and_restore(self):
+        old_created = dict(Transaction.objects.filter(id__in=self.old_ids).values_list('id', 'created_at'))
+        out = StringIO()
+        call_command('purge_transactions', '--archive', '--batch-size', '4', stdout=out)
+
+        self.assertFalse(Transaction.objects.filter(id__in=self.old_ids).exists())
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(rollups.verify(), [])
+        self.assertFalse(TransactionDailyRollup.objects.filter(date__year=2020).exists())
+
+        run = RetentionRun.objects.get()
+        self.assertEqual((run.status, run.rows_deleted, run.rows_archived, run.batches), ('completed', 6, 6, 2))
+        self.assertIn('Deleted 6 transactions', out.getvalue())
+        for user in self.users:
+            self.assertTrue(os.path.exists(os.path.join(self.archive_root, str(user.id), '2020-01.jsonl.gz')))
+            self.assertTrue(os.path.exists(os.path.join(self.archive_root, str(user.id), '2020-02.jsonl.gz')))
+
+        # Restoring brings the rows back with their ids, and a second restore is a no-op
+        Category.objects.filter(user=self.users[0]).delete()
+        call_command('restore_transactions', stdout=StringIO())
+        restored = Transaction.objects.filter(id__in=self.old_ids)
+        self.assertEqual(restored.count(), 6)
+        self.assertEqual(dict(restored.values_list('id', 'created_at')), old_created)
+        self.assertEqual(rollups.verify(), [])
+        out = StringIO()
+        call_command('restore_transactions', '--user', str(self.users[1].id), stdout=out)
+        self.assertIn('Restored 0 transactions', out.getvalue())
+
+    def test_task_resumes_an_interrupted_run(self):
+        cutoff = date(2020, 2, 1)
+        RetentionRun.objects.create(cutoff_date=cutoff, last_id=self.old_ids[0], max_id=max(self.old_ids))
+        self.assertIn('删除了 3 条旧交易记录', cleanup_old_transactions())
+        # The resumed run starts after last_id and keeps its own cutoff
+        self.assertEqual(Transaction.objects.filter(id__in=self.old_ids).count(), 3)
+        self.assertTrue(Transaction.objects.filter(id=self.old_ids[0]).exists())
+        self.assertEqual(RetentionRun.objects.get().status, 'completed')
+
+
+class AccountLedgerTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ledger', email='ledger@example.com', password='x')
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.salary = Category.objects.create(name='工资', type='income', user=self.user)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/accounts/', {'name': 'Checking', 'currency': 'USD', 'balance': '100.00'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.account = Account.objects.get(id=response.data['id'])
+
+    def add(self, category, amount, day, account=None):
+        return Transaction.objects.create(
+            user=self.user, category=category, account=account or self.account, amount=Decimal(amount), date=day
+        )
+
+    def balance(self):
+        self.account.refresh_from_db()
+        return self.account.balance
+
+    def test_writes_move_the_balance(self):
+        self.assertEqual((self.account.opening_balance, self.account.balance), (Decimal('100'), Decimal('100')))
+        salary = self.add(self.salary, '1000', date(2024, 1, 5))
+        lunch = self.add(self.food, '30', date(2024, 1, 6))
+        self.assertEqual(self.balance(), Decimal('1070'))
+
+        lunch.amount = Decimal('50')
+        lunch.save()
+        self.assertEqual(self.balance(), Decimal('1050'))
+
+        savings = Account.objects.create(name='Savings', currency='USD', user=self.user)
+        salary.account = savings
+        salary.save()
+        self.assertEqual(self.balance(), Decimal('50'))
+        savings.refresh_from_db()
+        self.assertEqual(savings.balance, Decimal('1000'))
+
+        lunch.delete()
+        self.assertEqual(self.balance(), Decimal('100'))
+
+        bulk_create_transactions([
+            Transaction(user=self.user, category=self.food, account=self.account, type='expense',
+                        amount=Decimal('10'), date=date(2024, 2, day))
+            for day in range(1, 6)
+        ])
+        self.assertEqual(self.balance(), Decimal('50'))
+        self.assertEqual(ledger.reconcile(), ([], []))
+
+    def test_balance_as_of_uses_checkpoints(self):
+        for month in range(1, 7):
+            self.add(self.salary, '1000', date(2024, month, 1))
+            self.add(self.food, '100', date(2024, month, 15))
+        self.assertEqual(ledger.backfill_checkpoints(), 6)
+        self.assertEqual(
+            AccountBalanceCheckpoint.objects.get(account=self.account, date=date(2024, 3, 31)).balance,
+            Decimal('2800'),
+        )
+
+        # A back-dated write shifts the later checkpoints with it
+        self.add(self.food, '50', date(2024, 2, 10))
+        self.assertEqual(
+            AccountBalanceCheckpoint.objects.get(account=self.account, date=date(2024, 3, 31)).balance,
+            Decimal('2750'),
+        )
+        with self.assertNumQueries(2):
+            self.assertEqual(ledger.balance_as_of(self.account, date(2024, 4, 10)), Decimal('3750'))
+        self.assertEqual(ledger.balance_as_of(self.account, date(2023, 12, 31)), Decimal('100'))
+
+        response = self.client.get(f'/api/accounts/{self.account.id}/balance/', {'date': '2024-02-14'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '1950.00')
+
+    def test_reconcile_repairs_drift(self):
+        self.add(self.salary, '500', date(2024, 1, 1))
+        ledger.backfill_checkpoints()
+        Account.objects.filter(pk=self.account.pk).update(balance=Decimal('1'))
+        AccountBalanceCheckpoint.objects.update(balance=Decimal('2'))
+
+        with self.assertRaises(CommandError):
+            call_command('account_ledger', '--check', stdout=StringIO(), stderr=StringIO())
+        self.assertIn('Repaired 1 balance and 1 checkpoint drifts', self.run_command())
+        self.assertEqual(self.balance(), Decimal('600'))
+        self.assertEqual(AccountBalanceCheckpoint.objects.get().balance, Decimal('600'))
+        self.assertEqual(ledger.reconcile(), ([], []))
+
+    def test_retention_keeps_balances(self):
+        self.add(self.salary, '500', date(2020, 1, 1))
+        self.add(self.food, '20', timezone.now().date())
+        run_retention(RetentionRun.objects.create(cutoff_date=date(2021, 1, 1)), pause=0)
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.balance, self.account.opening_balance), (Decimal('580'), Decimal('600')))
+        self.assertEqual(ledger.balance_as_of(self.account, date(2020, 12, 31)), Decimal('600'))
+        self.assertEqual(ledger.reconcile(), ([], []))
+
+    def run_command(self):
+        out = StringIO()
+        call_command('account_ledger', stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+
+class CurrencyConversionTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        fx.clear_local_cache()
+        self.user = User.objects.create_user(username='fx', email='fx@example.com', password='x')
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        self.salary = Category.objects.create(name='工资', type='income', user=self.user)
+        self.cny = Account.objects.create(name='招行', currency='CNY', user=self.user)
+        self.usd = Account.objects.create(name='Chase', currency='USD', user=self.user)
+        self.start = date(2024, 3, 1)
+        self.end = date(2024, 3, 31)
+        fx.load_rates([
+            FxRate(currency='CNY', date=date(2024, 2, 28), rate=Decimal('7')),
+            FxRate(currency='CNY', date=date(2024, 3, 10), rate=Decimal('7.2')),
+        ])
+        for account, category, amount, day in [
+            (self.cny, self.food, '70', 5),
+            (self.usd, self.food, '10', 5),
+            (self.usd, self.food, '10', 12),
+            (None, self.salary, '1000', 1),
+        ]:
+            Transaction.objects.create(
+                user=self.user, account=account, category=category, amount=Decimal(amount), date=date(2024, 3, day)
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def test_stats_in_each_currency(self):
+        stats = compute_stats(self.user, self.start, self.end)
+        self.assertEqual(stats['currency'], 'CNY')
+        # 70 + 10 * 7 (rate carried forward from Feb 28) + 10 * 7.2
+        self.assertEqual(stats['expense_total'], Decimal('212.00'))
+        self.assertEqual(stats['income_total'], Decimal('1000'))
+
+        stats = compute_stats(self.user, self.start, self.end, 'usd')
+        self.assertEqual(stats['expense_total'], Decimal('30.00'))
+        self.assertEqual(stats['income_total'], Decimal('142.86'))
+        self.assertEqual(stats['balance'], Decimal('112.86'))
+        self.assertEqual(stats['category_stats'][0]['category__name'], '工资')
+
+        totals = compute_user_totals(self.start, self.end, user_ids=[self.user.id], currency='USD')
+        self.assertEqual(totals[self.user.id]['expense_total'], Decimal('30.00'))
+
+        # The ASGI stats view's async ORM path agrees
+        self.assertEqual(async_to_sync(acompute_stats)(self.user, self.start, self.end, 'USD'), stats)
+
+    def test_rates_are_cached(self):
+        compute_stats(self.user, self.start, self.end)
+        # One rollup query; the rates come from the process-local cache
+        with self.assertNumQueries(1):
+            compute_stats(self.user, self.start, self.end, 'USD')
+        fx.clear_local_cache()
+        with self.assertNumQueries(1):
+            self.assertEqual(fx.rate('CNY', date(2024, 3, 9)), Decimal('7'))
+            compute_stats(self.user, self.start, self.end)
+        self.assertEqual(fx.rate('CNY', date(2024, 1, 1)), Decimal('7'))
+        self.assertEqual(fx.convert(Decimal('36'), 'CNY', 'USD', date(2024, 3, 10)), Decimal('5.00'))
+
+    def test_loading_rates_invalidates_stats(self):
+        self.assertEqual(get_stats(self.user, self.start, self.end)['expense_total'], Decimal('212.00'))
+        path = os.path.join(tempfile.mkdtemp(), 'rates.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('date,currency,rate\n2024-03-01,CNY,7.5\n2024-03-10,cny,7.5\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_fx_rates', path, stdout=StringIO())
+        self.assertEqual(FxRate.objects.get(date=date(2024, 3, 10)).rate, Decimal('7.5'))
+        self.assertEqual(get_stats(self.user, self.start, self.end)['expense_total'], Decimal('220.00'))
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('date,currency,rate\n2024-03-01,EUR,1.1\n')
+        with self.assertRaises(CommandError):
+            call_command('load_fx_rates', path, stdout=StringIO())
+
+    def test_stats_endpoint_currency(self):
+        with mock.patch('transactions.views.period_range', return_value=(self.start, self.end)):
+            response = self.client.get('/api/transactions/stats/', {'currency': 'USD'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['currency'], 'USD')
+            self.assertEqual(response.data['expense_total'], 30.0)
+
+            response = self.client.get('/api/transactions/stats/', {'currency': 'EUR'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+            # Changing an account's currency re-denominates its history
+            self.usd.currency = 'CAD'
+            self.usd.save()
+            response = self.client.get('/api/transactions/stats/', {'currency': 'USD'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('CAD', str(response.data['currency']))
+
+    @eager_tasks
+    def test_missing_rates_fail_only_that_user(self):
+        # No CAD rates are loaded
+        other = User.objects.create_user(username='cad', email='cad@example.com', password='x')
+        food = Category.objects.create(name='餐饮', type='expense', user=other)
+        account = Account.objects.create(name='RBC', currency='CAD', user=other)
+        Transaction.objects.create(user=other, account=account, category=food, amount=Decimal('25'), date=date(2024, 3, 5))
+
+        # Without ?currency= stats are in the user's own currency and need no rates
+        stats = get_stats(other, self.start, self.end)
+        self.assertEqual((stats['currency'], stats['expense_total']), ('CAD', Decimal('25')))
+        self.client.force_authenticate(user=other)
+        with mock.patch('transactions.views.period_range', return_value=(self.start, self.end)):
+            response = self.client.get('/api/transactions/stats/')
+        self.assertEqual(response.data['currency'], 'CAD')
+        self.client.force_login(other)
+        response = self.client.post('/graphql/', {
+            'query': '{ stats(startDate: "2024-03-01", endDate: "2024-03-31", currency: "USD") { totalExpense } }'
+        }, format='json')
+        self.assertIn('No FX rates loaded for CAD', response.json()['errors'][0]['message'])
+
+        totals = compute_user_totals(self.start, self.end)
+        self.assertEqual(totals[self.user.id]['expense_total'], Decimal('212.00'))
+        self.assertEqual(totals[other.id], {'user_id': other.id, 'fx_missing': 'No FX rates loaded for CAD'})
+
+        # Reports are in each user's own currency too: the CAD-only user needs no rates,
+        # a user with CAD and CNY accounts is reported in CNY and skipped
+        mixed = User.objects.create_user(username='mixed', email='mixed@example.com', password='x')
+        mixed_food = Category.objects.create(name='餐饮', type='expense', user=mixed)
+        Account.objects.create(name='招行', currency='CNY', user=mixed)
+        rbc = Account.objects.create(name='RBC', currency='CAD', user=mixed)
+        Transaction.objects.create(user=mixed, account=rbc, category=mixed_food, amount=Decimal('5'), date=date(2024, 3, 5))
+        with self.assertLogs('transactions.tasks', 'WARNING'):
+            send_monthly_reports(self.start.isoformat(), self.end.isoformat())
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['cad@example.com', 'fx@example.com'])
+        message = next(message for message in mail.outbox if message.to == ['cad@example.com'])
+        self.assertIn('总支出: C$25.00', message.body)
+        with self.assertLogs('transactions.stats', 'WARNING'):
+            self.assertEqual(store_weekly_summaries(self.start, self.end, self.user.id, other.id), 1)
+        self.assertFalse(WeeklySummary.objects.filter(user=other).exists())
+
+
+class TransactionSearchTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='search', email='search@example.com', password='x')
+        food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        for description in ['Coffee shop', 'Coffee shop', 'Coffee beans', 'Cinema', '']:
+            Transaction.objects.create(user=self.user, category=food, amount=Decimal('5'), description=description,
+                                       date=date(2024, 5, 1))
+        other = User.objects.create_user(username='other', email='other@example.com', password='x')
+        Transaction.objects.create(
+            user=other, category=Category.objects.create(name='餐饮', type='expense', user=other),
+            amount=Decimal('5'), description='Coffee cart', date=date(2024, 5, 1),
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_search_param(self):
+        response = self.client.get('/api/transactions/', {'search': 'coffee'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(row['description'] for row in response.data['results']),
+            ['Coffee beans', 'Coffee shop', 'Coffee shop'],
+        )
+
+    def test_suggest(self):
+        response = self.client.get('/api/transactions/suggest/', {'q': 'cof'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], ['Coffee shop', 'Coffee beans'])
+        self.assertEqual(self.client.get('/api/transactions/suggest/', {'q': ' '}).data['results'], [])
+        response = self.client.get('/api/transactions/suggest/', {'q': 'c', 'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/transactions/suggest/', {'q': 'cof', 'limit': '-1'})
+        self.assertEqual(response.data['results'], ['Coffee shop'])
+
+
+class TransactionRowSerializerTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rows', email='rows@example.com', password='x')
+        food = Category.objects.create(name='餐饮', type='expense', icon='🍜', color='#ff0000', user=self.user)
+        salary = Category.objects.create(name='工资', type='income', user=self.user)
+        for i, (category, amount, description) in enumerate([
+            (food, '5', ''), (food, '1234.5', '午餐 "quoted" \\ 反斜杠'), (salary, '99999999.99', 'Salary'),
+        ]):
+            Transaction.objects.create(
+                user=self.user, category=category, amount=Decimal(amount), description=description,
+                date=date(2024, 1, 1) + timedelta(days=i),
+            )
+        self.client.force_authenticate(user=self.user)
+
+    def test_matches_model_serializer_bytes(self):
+        queryset = Transaction.objects.filter(user=self.user).order_by('-date')
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(TransactionRowSerializer(TransactionRowSerializer.rows(queryset), many=True).data),
+            renderer.render(TransactionSerializer(queryset, many=True).data),
+        )
+
+    def test_list_pages_take_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/transactions/', {'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len([q for q in queries if 'FROM "transactions"' in q['sql']]), 1)
+        self.assertEqual(response.data['results'][0]['category_name'], '工资')
+        next_page = self.client.get(response.data['next'])
+        self.assertEqual([row['amount'] for row in next_page.data['results']], ['5.00'])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_transaction_list', sizes='5,10', repeat=1, stdout=out)
+        self.assertIn('All paths rendered identical JSON', out.getvalue())
+        self.assertFalse(User.objects.filter(username='benchmark-list').exists())
+
+
+class ConditionalGetTest(APITestCase):
+    # Past the read-after-write window, stats ask the replica how far it has replayed
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='etag', email='etag@example.com', password='x')
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('5'), date=timezone.now().date())
+        self.client.force_authenticate(user=self.user)
+
+    def test_unchanged_polls_are_not_modified(self):
+        for url in ['/api/transactions/', '/api/transactions/stats/', '/api/categories/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('no-cache', response['Cache-Control'])
+            with self.assertNumQueries(0):
+                repeat = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(repeat.status_code, status.HTTP_304_NOT_MODIFIED, url)
+            self.assertEqual(repeat['ETag'], response['ETag'])
+
+    def test_writes_change_the_etag(self):
+        etags = {}
+        for url in ['/api/transactions/', '/api/transactions/stats/', '/api/categories/']:
+            etags[url] = self.client.get(url)['ETag']
+
+        Account.objects.create(name='Cash', currency='CNY', user=self.user)
+        for url, etag in etags.items():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            etags[url] = response['ETag']
+
+        self.client.post('/api/transactions/', {
+            'category': self.food.id, 'amount': '7.00', 'date': timezone.now().date().isoformat(),
+        })
+        response = self.client.get('/api/transactions/', HTTP_IF_NONE_MATCH=etags['/api/transactions/'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+        # Other users' writes leave the watermark alone
+        etag = self.client.get('/api/categories/')['ETag']
+        other = User.objects.create_user(username='other', email='other@example.com', password='x')
+        Category.objects.create(name='餐饮', type='expense', user=other)
+        response = self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_modified_since(self):
+        with mock.patch('transactions.stats_cache.time.time', return_value=1700000000.5):
+            Category.objects.create(name='交通', type='expense', user=self.user)
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response['Last-Modified'], 'Tue, 14 Nov 2023 22:13:20 GMT')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/categories/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Stats also depend on the date and FX rates, so they only carry an ETag
+        response = self.client.get('/api/transactions/stats/', HTTP_IF_MODIFIED_SINCE='Tue, 14 Nov 2023 22:13:20 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', response)
+
+
+
+class AsyncViewsTest(TestCase):
+    """The ASGI deployment's async views answer exactly like the sync ones"""
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='async', email='async@example.com', password='x')
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        salary = Category.objects.create(name='工资', type='income', user=self.user)
+        today = timezone.now().date()
+        for i in range(25):
+            Transaction.objects.create(
+                user=self.user, category=self.food if i % 3 else salary, amount=Decimal(i + 1),
+                description=f'午餐 {i}', date=today - timedelta(days=i),
+            )
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def get_both(self, url, data=None, view_class=None, headers=None):
+        headers = {**self.headers, **(headers or {})}
+        expected = self.client.get(url, data, headers=headers)
+        with self.settings(ROOT_URLCONF='casho.urls_async'):
+            response = async_to_sync(self.async_client.get)(url, data, headers=headers)
+            # resolver_match resolves lazily, against the current ROOT_URLCONF
+            if view_class is not None:
+                self.assertIs(response.resolver_match.func.view_class, view_class)
+        self.assertEqual(response.status_code, expected.status_code, url)
+        self.assertEqual(response.content, expected.content, url)
+        self.assertEqual(response.get('ETag'), expected.get('ETag'))
+        return response
+
+    def test_list_matches_sync(self):
+        for data in [{}, {'page': 2}, {'page': 9}, {'page_size': 5, 'ordering': 'amount'}, {'type': 'income'},
+                     {'category': self.food.id}, {'category': 999999}, {'search': '午餐 1'},
+                     {'pagination': 'cursor', 'page_size': 10, 'count': 'exact'}]:
+            self.get_both('/api/transactions/', data, view_class=AsyncTransactionListCreateView)
+
+        first = self.get_both('/api/transactions/', {'pagination': 'cursor', 'page_size': 10})
+        self.get_both(json.loads(first.content)['next'])
+
+    def test_stats_matches_sync(self):
+        for data in [{}, {'period': 'year'}, {'currency': 'XYZ'}]:
+            self.get_both('/api/transactions/stats/', data, view_class=AsyncTransactionStatsView)
+        # Computed through the async ORM, not read from what the sync view cached
+        expected = self.client.get('/api/transactions/stats/', {'period': 'year'}, headers=self.headers)
+        cache.clear()
+        with mock.patch('transactions.views.get_stats', side_effect=AssertionError), \
+                self.settings(ROOT_URLCONF='casho.urls_async'):
+            response = async_to_sync(self.async_client.get)(
+                '/api/transactions/stats/', {'period': 'year'}, headers=self.headers
+            )
+        self.assertEqual(response.content, expected.content)
+        etag = self.client.get('/api/transactions/stats/', headers=self.headers)['ETag']
+        response = self.get_both('/api/transactions/stats/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_unauthenticated_and_create(self):
+        with self.settings(ROOT_URLCONF='casho.urls_async'):
+            response = async_to_sync(self.async_client.get)('/api/transactions/stats/')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            response = async_to_sync(self.async_client.post)('/api/transactions/', {
+                'category': self.food.id, 'amount': '7.00', 'date': timezone.now().date().isoformat(),
+            }, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 26)
+
+    def test_export_streams_incrementally(self):
+        today = timezone.now().date()
+        bulk_create_transactions([
+            Transaction(user=self.user, category=self.food, amount=Decimal('1'), date=today) for _ in range(475)
+        ])
+        expected = self.client.get('/api/transactions/export/', {'output': 'ndjson'}, headers=self.headers)
+        expected = b''.join(expected.streaming_content)
+
+        async def export():
+            response = await self.async_client.get(
+                '/api/transactions/export/', {'output': 'ndjson'}, headers=self.headers
+            )
+            self.assertIs(response.resolver_match.func.view_class, AsyncTransactionExportView)
+            self.assertTrue(response.is_async)
+            progress, body = [], b''
+            # How the ASGI handler consumes a streaming response
+            async for chunk in response:
+                progress.append(export_row.call_count)
+                body += chunk
+            return progress, body
+
+        with mock.patch('transactions.exporters.export_row', wraps=exporters.export_row) as export_row:
+            with self.settings(ROOT_URLCONF='casho.urls_async'):
+                progress, body = async_to_sync(export)()
+        self.assertEqual(body, expected)
+        # Each chunk was produced just before it was sent, not all up front
+        self.assertEqual(progress, [200, 400, 500])
+
+    def test_graphql_matches_sync(self):
+        query = {'query': '{ categories { name } }'}
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        expected = self.client.post('/graphql/', query, content_type='application/json')
+        with self.settings(ROOT_URLCONF='casho.urls_async'):
+            response = async_to_sync(self.async_client.post)('/graphql/', query, content_type='application/json')
+            self.assertIs(response.resolver_match.func.view_class, AsyncGraphQLView)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(len(response.json()['data']['categories']), 2)
+
+
+class ReplicaRoutingTest(APITransactionTestCase):
+    """Reads go to the replica, except right after the user's own writes"""
+    # TestCase keeps the primary in a transaction, which pins every read to it
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='replica', email='replica@example.com', password='x')
+        self.food = Category.objects.create(name='餐饮', type='expense', user=self.user)
+        today = timezone.now().date()
+        Transaction.objects.create(user=self.user, category=self.food, amount=50, date=today)
+        Transaction.objects.create(user=self.user, category=self.food, amount=30, date=today)
+        for model in (User, Category, Transaction, TransactionDailyRollup):
+            model.objects.using(REPLICA).bulk_create(model.objects.using('default').all())
+        # Not replicated yet
+        Transaction.objects.create(user=self.user, category=self.food, amount=500, date=today)
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def test_list_stats_and_export_read_replica(self):
+        self.assertEqual(self.client.get('/api/transactions/').data['count'], 2)
+        response = self.client.get('/api/transactions/stats/')
+        self.assertEqual(response.data['expense_total'], 80.0)
+        response = self.client.get('/api/transactions/export/', {'output': 'ndjson'})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+    def test_graphql_reads_replica(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/graphql/', {'query': '{ transactions { amount } }'}, format='json')
+        self.assertEqual(len(response.json()['data']['transactions']), 2)
+
+    def test_reads_after_write_stay_on_primary(self):
+        response = self.client.post('/api/transactions/', {
+            'category': self.food.id, 'amount': '7.00', 'date': timezone.now().date().isoformat(),
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Transaction.objects.using(REPLICA).count(), 2)
+        self.assertEqual(self.client.get('/api/transactions/').data['count'], 4)
+        self.assertEqual(self.client.get('/api/transactions/stats/').data['expense_total'], 587.0)
+
+    @override_settings(REPLICA_READ_AFTER_WRITE_WINDOW=0)
+    def test_no_read_after_write_window(self):
+        self.client.post('/api/transactions/', {
+            'category': self.food.id, 'amount': '7.00', 'date': timezone.now().date().isoformat(),
+        })
+        self.assertEqual(self.client.get('/api/transactions/').data['count'], 2)
+
+    @override_settings(REPLICA_READ_AFTER_WRITE_WINDOW=0)
+    def test_lagging_replica_not_read_after_window(self):
+        self.client.post('/api/transactions/', {
+            'category': self.food.id, 'amount': '7.00', 'date': timezone.now().date().isoformat(),
+        })
+        written_at = cache.get(f'db:recent-write:{self.user.pk}')
+        with mock.patch.object(db_router, 'replica_replay_time', return_value=written_at - 60):
+            self.assertEqual(self.client.get('/api/transactions/').data['count'], 4)
+            self.assertEqual(self.client.get('/api/transactions/stats/').data['expense_total'], 587.0)
+        with mock.patch.object(db_router, 'replica_replay_time', return_value=written_at + 1):
+            self.assertEqual(self.client.get('/api/transactions/').data['count'], 2)
+
+    def test_weekly_summary_reads_replica_writes_primary(self):
+        generate_weekly_summary()
+        self.assertEqual(WeeklySummary.objects.get(user=self.user).expense, Decimal('80'))
+        self.assertFalse(WeeklySummary.objects.using(REPLICA).exists())
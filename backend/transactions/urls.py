@@ -1,7 +1,10 @@
 from django.urls import path
 from .views import (
     CategoryListCreateView, CategoryDetailView,
-    TransactionListCreateView, TransactionDetailView, TransactionStatsView, AccountListCreateView
+    TransactionListCreateView, TransactionDetailView, TransactionStatsView, TransactionExportView,
+    TransactionSuggestView,
+    AccountListCreateView, AccountBalanceView,
+    ImportJobListCreateView, ImportJobDetailView
 )
 
 urlpatterns = [
@@ -13,5 +16,10 @@ urlpatterns = [
     path('transactions/', TransactionListCreateView.as_view(), name='transaction-list-create'),
     path('transactions/<int:pk>/', TransactionDetailView.as_view(), name='transaction-detail'),
     path('transactions/stats/', TransactionStatsView.as_view(), name='transaction-stats'),
+    path('transactions/export/', TransactionExportView.as_view(), name='transaction-export'),
+    path('transactions/suggest/', TransactionSuggestView.as_view(), name='transaction-suggest'),
+    path('transactions/imports/', ImportJobListCreateView.as_view(), name='import-job-list-create'),
+    path('transactions/imports/<int:pk>/', ImportJobDetailView.as_view(), name='import-job-detail'),
     path('accounts/', AccountListCreateView.as_view(), name='account-list-create'),
+    path('accounts/<int:pk>/balance/', AccountBalanceView.as_view(), name='account-balance'),
 ] 
\ No newline at end of file
@@ -1,16 +1,82 @@
+from asgiref.sync import sync_to_async
 from rest_framework import generics, filters
-from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Sum
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.dateparse import parse_date
+from django_filters.rest_framework import DjangoFilterBackend
+
+from casho.async_views import AsyncAPIViewMixin
+from casho.db_router import read_alias
 
-from .models import Category, Transaction, Account
+from . import fx, ledger, search
+from .exporters import CONTENT_TYPES, STREAMS, aiterate
+from .models import Category, Transaction, Account, ImportJob
+from .pagination import AsyncPageNumberPagination, TransactionCursorPagination
 from .serializers import (
-    CategorySerializer, TransactionSerializer, TransactionCreateSerializer, AccountSerializer
+    CategorySerializer, TransactionSerializer, TransactionCreateSerializer, TransactionRowSerializer,
+    AccountSerializer, ImportJobSerializer
 )
+from .stats import period_range
+from .stats_cache import aget_stats, get_stats, watermark
+from .tasks import import_transactions
+
+
+class ConditionalResponse(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class WatermarkConditionalMixin:
+    """
+    条件 GET：ETag / Last-Modified 取自用户的数据水位（stats_cache.watermark），
+    If-None-Match / If-Modified-Since 命中时在认证之后、任何查询和序列化之前返回 304
+    """
+    # Whether the response depends on nothing but the user's data (and so may carry Last-Modified)
+    last_modified_from_watermark = True
+
+    def get_etag_parts(self, request):
+        """Anything besides the user's data that the GET response depends on"""
+        return []
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.validators = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        version, modified = watermark(request.user.pk)
+        parts = [request.user.pk, version, request.accepted_renderer.format, *self.get_etag_parts(request)]
+        etag = '"%s"' % ':'.join(str(part) for part in parts)
+        last_modified = int(modified) if self.last_modified_from_watermark else None
+        self.validators = (etag, last_modified)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            raise ConditionalResponse(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, ConditionalResponse):
+            return exc.response
+        return super().handle_exception(exc)
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'validators', None) and response.status_code in (200, 304):
+            etag, last_modified = self.validators
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            # Clients keep their copy but revalidate it on every poll
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
 
-class CategoryListCreateView(generics.ListCreateAPIView):
+
+class CategoryListCreateView(WatermarkConditionalMixin, generics.ListCreateAPIView):
     """分类列表和创建视图"""
     serializer_class = CategorySerializer
     filter_backends = [DjangoFilterBackend]
@@ -31,81 +97,163 @@ class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
         return Category.objects.filter(user=self.request.user)
 
 
-class TransactionListCreateView(generics.ListCreateAPIView):
-    """交易列表和创建视图"""
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+class TransactionSearchFilter(filters.SearchFilter):
+    """?search= 走 search.py 的全文/三元组索引，并按相关度标注 search_rank"""
+    def filter_queryset(self, request, queryset, view):
+        return search.search(queryset, request.query_params.get(self.search_param, ''))
+
+
+class TransactionOrderingFilter(filters.OrderingFilter):
+    """未指定 ?ordering= 时，搜索结果按相关度排序"""
+    def get_ordering(self, request, queryset, view):
+        if self.ordering_param not in request.query_params and search.RANK in queryset.query.annotations:
+            return ['-' + search.RANK, *self.get_default_ordering(view)]
+        return super().get_ordering(request, queryset, view)
+
+
+class TransactionFilterMixin:
+    """交易列表与导出共用的过滤条件"""
+    filter_backends = [DjangoFilterBackend, TransactionSearchFilter, TransactionOrderingFilter]
     filterset_fields = ['type', 'category', 'date']
     search_fields = ['description']
     ordering_fields = ['amount', 'date', 'created_at']
     ordering = ['-date', '-created_at']
 
     def get_queryset(self):
-        return Transaction.objects.filter(user=self.request.user)
+        # Lists and exports read from the replica unless the user has just written
+        return Transaction.objects.using(read_alias(self.request.user.pk)).filter(user=self.request.user)
+
+
+class TransactionListCreateView(WatermarkConditionalMixin, TransactionFilterMixin, generics.ListCreateAPIView):
+    """交易列表和创建视图"""
+
+    @property
+    def pagination_class(self):
+        # ?pagination=cursor (and the cursor links it returns) switch to keyset pages
+        params = self.request.query_params
+        if params.get('pagination') == 'cursor' or 'cursor' in params:
+            return TransactionCursorPagination
+        return api_settings.DEFAULT_PAGINATION_CLASS
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return TransactionCreateSerializer
         return TransactionSerializer
 
+    def list(self, request, *args, **kwargs):
+        # values() rows with the category columns joined in, instead of model instances
+        queryset = TransactionRowSerializer.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(TransactionRowSerializer(page, many=True).data)
+        return Response(TransactionRowSerializer(queryset, many=True).data)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
+class TransactionExportView(TransactionFilterMixin, generics.GenericAPIView):
+    """交易导出视图：以 CSV 或 NDJSON 流式输出全部（过滤后的）交易"""
+    def get_output(self, request):
+        output = request.query_params.get('output', 'csv')
+        if output not in STREAMS:
+            raise ValidationError({'output': f"仅支持 {', '.join(STREAMS)}"})
+        return output
+
+    def get(self, request):
+        output = self.get_output(request)
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.export_response(output, STREAMS[output](queryset))
+
+    def export_response(self, output, content):
+        response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[output])
+        filename = f"transactions-{timezone.localdate():%Y%m%d}.{output}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        # Stop nginx from buffering the whole export before sending it
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class TransactionSuggestView(generics.GenericAPIView):
+    """交易描述自动补全：?q= 前缀，返回最常用的匹配描述"""
+    def get_queryset(self):
+        return Transaction.objects.filter(user=self.request.user)
+
+    def get(self, request):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+        except ValueError:
+            raise ValidationError({'limit': "必须是整数"})
+        return Response({'results': search.suggest(self.get_queryset(), request.query_params.get('q', ''), limit)})
+
+
 class TransactionDetailView(generics.RetrieveUpdateDestroyAPIView):
     """交易详情视图"""
     serializer_class = TransactionSerializer
 
     def get_queryset(self):
-        return Transaction.objects.filter(user=self.request.user)
+        return Transaction.objects.filter(user=self.request.user).select_related('category')
 
 
-class TransactionStatsView(generics.GenericAPIView):
-    """交易统计视图"""
-    def get(self, request):
-        user = request.user
+class TransactionStatsView(WatermarkConditionalMixin, generics.GenericAPIView):
+    """交易统计视图：?currency= 指定折算币种（默认为用户账户的币种，多币种时为 DEFAULT_CURRENCY）"""
+    # The period is relative to today and amounts depend on FX rates
+    last_modified_from_watermark = False
+
+    def get_etag_parts(self, request):
+        return [timezone.localdate().isoformat(), fx.rates_version()]
+
+    def get_period(self, request):
         period = request.query_params.get('period', 'month')  # week, month, year
-        
-        # 计算时间范围
-        now = timezone.now().date()
-        if period == 'week':
-            start_date = now - timedelta(days=7)
-        elif period == 'month':
-            start_date = now - timedelta(days=30)
-        elif period == 'year':
-            start_date = now - timedelta(days=365)
-        else:
-            start_date = now - timedelta(days=30)
-        
-        # 获取统计数据
-        transactions = Transaction.objects.filter(
-            user=user,
-            date__gte=start_date,
-            date__lte=now
-        )
-        
-        income_total = transactions.filter(type='income').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        expense_total = transactions.filter(type='expense').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        # 按分类统计
-        category_stats = transactions.values('category__name', 'type').annotate(
-            total=Sum('amount')
-        ).order_by('-total')
-        
+        start_date, end_date = period_range(period)
+        currency = request.query_params.get('currency') or None
+        if currency:
+            try:
+                currency = fx.reporting_currency(currency)
+            except ValueError:
+                raise ValidationError({'currency': f"仅支持 {', '.join(fx.CURRENCIES)}"})
+        return period, start_date, end_date, currency
+
+    def stats_response(self, period, start_date, end_date, stats):
         return Response({
             'period': period,
             'start_date': start_date,
-            'end_date': now,
-            'income_total': float(income_total),
-            'expense_total': float(expense_total),
-            'balance': float(income_total - expense_total),
-            'category_stats': list(category_stats),
+            'end_date': end_date,
+            'currency': stats['currency'],
+            'income_total': float(stats['income_total']),
+            'expense_total': float(stats['expense_total']),
+            'balance': float(stats['balance']),
+            'category_stats': stats['category_stats'],
         })
 
+    def get(self, request):
+        period, start_date, end_date, currency = self.get_period(request)
+        try:
+            stats = get_stats(request.user, start_date, end_date, currency)
+        except fx.FxRateMissing as e:
+            raise ValidationError({'currency': str(e)})
+        return self.stats_response(period, start_date, end_date, stats)
+
+
+class ImportJobListCreateView(generics.ListCreateAPIView):
+    """银行流水导入：上传文件并在后台导入"""
+    serializer_class = ImportJobSerializer
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        job = serializer.save(user=self.request.user)
+        transaction.on_commit(lambda: import_transactions.delay(job.id))
+
+
+class ImportJobDetailView(generics.RetrieveAPIView):
+    """导入任务状态视图"""
+    serializer_class = ImportJobSerializer
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(user=self.request.user)
+
 
 class AccountListCreateView(generics.ListCreateAPIView):
     """Account list and create view"""
@@ -117,4 +265,78 @@ class AccountListCreateView(generics.ListCreateAPIView):
         return Account.objects.filter(user=self.request.user)
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user) 
\ No newline at end of file
+        serializer.save(user=self.request.user)
+
+
+class AccountBalanceView(generics.GenericAPIView):
+    """账户余额查询：?date=YYYY-MM-DD 返回该日结束时的余额（默认今天）"""
+    def get_queryset(self):
+        return Account.objects.filter(user=self.request.user)
+
+    def get(self, request, pk):
+        account = self.get_object()
+        day = request.query_params.get('date')
+        if day:
+            day = parse_date(day)
+            if day is None:
+                raise ValidationError({'date': "日期格式应为 YYYY-MM-DD"})
+        else:
+            day = timezone.localdate()
+
+        return Response({
+            'account': account.id,
+            'date': day,
+            'balance': str(ledger.balance_as_of(account, day)),
+        })
+
+
+class AsyncTransactionListCreateView(AsyncAPIViewMixin, TransactionListCreateView):
+    """交易列表和创建视图（ASGI，见 casho/urls_async.py）：列表经异步 ORM 计数和取行"""
+
+    @property
+    def pagination_class(self):
+        pagination_class = TransactionListCreateView.pagination_class.fget(self)
+        if pagination_class is PageNumberPagination:
+            return AsyncPageNumberPagination
+        return pagination_class
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        if hasattr(self.paginator, 'apaginate_queryset'):
+            return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+        return await sync_to_async(self.paginator.paginate_queryset)(queryset, self.request, view=self)
+
+    async def get(self, request, *args, **kwargs):
+        # Filter validation may look up the ?category= row
+        queryset = await sync_to_async(self.filter_queryset)(self.get_queryset())
+        queryset = TransactionRowSerializer.rows(queryset)
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(TransactionRowSerializer(page, many=True).data)
+        return Response(TransactionRowSerializer([row async for row in queryset.aiterator()], many=True).data)
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(self.create)(request, *args, **kwargs)
+
+
+class AsyncTransactionStatsView(AsyncAPIViewMixin, TransactionStatsView):
+    """交易统计视图（ASGI）：统计经异步 ORM 计算，缓存读取在工作线程中进行"""
+
+    async def get(self, request):
+        period, start_date, end_date, currency = self.get_period(request)
+        try:
+            stats = await aget_stats(request.user, start_date, end_date, currency)
+        except fx.FxRateMissing as e:
+            raise ValidationError({'currency': str(e)})
+        return self.stats_response(period, start_date, end_date, stats)
+
+
+class AsyncTransactionExportView(AsyncAPIViewMixin, TransactionExportView):
+    """交易导出视图（ASGI）：逐块在工作线程中生成，避免整份导出先被读入内存"""
+
+    async def get(self, request):
+        output = self.get_output(request)
+        # Filter validation may look up the ?category= row
+        queryset = await sync_to_async(self.filter_queryset)(self.get_queryset())
+        return self.export_response(output, aiterate(STREAMS[output](queryset)))
@@ -0,0 +1,176 @@
+"""
+Cached user resolution for JWT-authenticated requests.
+
+Both token schemes already carry the user's identity (simplejwt access
+tokens the ``user_id`` claim, graphql_jwt tokens the email), so instead
+of loading the users row on every request the user is resolved through
+a short-lived per-process LRU in front of Django's cache (Redis):
+
+* ``auth:user:{id}`` holds what authentication needs for
+  AUTH_USER_CACHE_TIMEOUT seconds: the id, email and is_active, plus a
+  fingerprint of the password hash when tokens are revoked on password
+  change (simplejwt's CHECK_REVOKE_TOKEN), never the hash itself,
+* ``auth:user-key:{email}`` maps a natural key to that id.
+
+The user handed to the request is built from that entry with every other
+field deferred; the first access to one loads the rest of the row in one
+query (User.refresh_from_db).
+
+Saving or deleting a user, and logging out, evicts the shared entries
+(see signals.py and views.logout); other processes drop their local copy
+within AUTH_USER_LOCAL_CACHE_TTL seconds. QuerySet.update() sends no
+signals, so rows changed that way are picked up when the entries expire.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+User = get_user_model()
+
+_lock = threading.Lock()
+_local = OrderedDict()
+
+
+def _user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _natural_key(username):
+    return f'auth:user-key:{username}'
+
+
+def _local_get(key):
+    with _lock:
+        entry = _local.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if time.monotonic() >= expires:
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return value
+
+
+def _local_set(key, value):
+    with _lock:
+        _local[key] = (time.monotonic() + settings.AUTH_USER_LOCAL_CACHE_TTL, value)
+        _local.move_to_end(key)
+        while len(_local) > settings.AUTH_USER_LOCAL_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def clear_local_cache():
+    with _lock:
+        _local.clear()
+
+
+def _entry(user):
+    entry = {'id': user.pk, User.USERNAME_FIELD: user.get_username(), 'is_active': user.is_active}
+    if api_settings.CHECK_REVOKE_TOKEN:
+        entry['password_fingerprint'] = get_md5_hash_password(user.password)
+    return entry
+
+
+def _remember(user):
+    key = _user_key(user.pk)
+    entry = _entry(user)
+    username = user.get_username()
+    cache.set_many({key: entry, _natural_key(username): user.pk}, settings.AUTH_USER_CACHE_TIMEOUT)
+    _local_set(key, entry)
+    _local_set(_natural_key(username), user.pk)
+    return entry
+
+
+def _from_entry(entry):
+    """A User with the cached fields loaded and the rest deferred"""
+    # from_db() takes the values in field order
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in entry]
+    return User.from_db(User._default_manager.db, field_names, [entry[name] for name in field_names])
+
+
+def get_cached_entry(user_id):
+    """The cached authentication fields of user user_id, or None when it does not exist"""
+    key = _user_key(user_id)
+    entry = _local_get(key)
+    if entry is None:
+        entry = cache.get(key)
+        if entry is not None:
+            _local_set(key, entry)
+    if entry is None:
+        user = User._default_manager.filter(pk=user_id).first()
+        if user is None:
+            return None
+        entry = _remember(user)
+    return entry
+
+
+def get_cached_user(user_id):
+    """User with primary key user_id (a new instance the caller may modify), or None when it does not exist"""
+    entry = get_cached_entry(user_id)
+    return _from_entry(entry) if entry is not None else None
+
+
+def get_cached_user_by_natural_key(username):
+    """User whose USERNAME_FIELD is username, or None (graphql_jwt's JWT_GET_USER_BY_NATURAL_KEY_HANDLER)"""
+    key = _natural_key(username)
+    user_id = _local_get(key)
+    if user_id is None:
+        user_id = cache.get(key)
+    if user_id is not None:
+        entry = get_cached_entry(user_id)
+        # The mapping outlives a change of email; only trust it while it still matches
+        if entry is not None and entry[User.USERNAME_FIELD] == username:
+            _local_set(key, user_id)
+            return _from_entry(entry)
+    try:
+        user = User._default_manager.get_by_natural_key(username)
+    except User.DoesNotExist:
+        return None
+    _remember(user)
+    return user
+
+
+def invalidate_user(user):
+    """Evict a user (instance or id) from the shared and local caches"""
+    user_id = getattr(user, 'pk', user)
+    keys = [_user_key(user_id)]
+    if hasattr(user, 'get_username'):
+        keys.append(_natural_key(user.get_username()))
+    cache.delete_many(keys)
+    with _lock:
+        for key in keys:
+            _local.pop(key, None)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication resolving the token's user through the user cache"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        entry = get_cached_entry(user_id)
+        if entry is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not entry['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Entries cached while the check was off carry no fingerprint and never match
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != entry.get('password_fingerprint'):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return _from_entry(entry)
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with its cost read from
+    PASSWORD_HASH_ITERATIONS. must_update() compares a stored hash's
+    iterations against it, so check_password() rehashes a password stored
+    with any other cost on the next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
@@ -0,0 +1,145 @@
+"""
+Login pipeline shared by LoginView and the GraphQL login and tokenAuth
+mutations.
+
+Password hashing is deliberately slow, so each attempt goes through:
+
+1. the attempt limiter: failed logins are counted in Django's cache
+   (Redis) for LOGIN_FAILURE_WINDOW seconds per account and client IP
+   (LOGIN_MAX_ACCOUNT_FAILURES, so guessing from one address cannot
+   lock the owner out everywhere), per account across all addresses
+   (the much higher LOGIN_MAX_ACCOUNT_TOTAL_FAILURES, against
+   distributed guessing) and per client IP (LOGIN_MAX_IP_FAILURES).
+   Once a count reaches its limit the attempt is rejected (429) before
+   anything is hashed or queried;
+2. the hashing gate: at most LOGIN_HASH_CONCURRENCY password checks run
+   at once across all workers. The gate is a counting semaphore in the
+   shared cache, one key per slot taken with cache.add() and expiring
+   after LOGIN_HASH_SLOT_TTL seconds should a worker die holding it.
+   When every slot is taken the attempt gets 503 with Retry-After at
+   once rather than waiting in the worker, so a login burst cannot take
+   every worker (nor every core) from the rest of the API;
+3. authenticate(). Its hasher (hashers.py) rehashes passwords stored
+   with another cost on success.
+"""
+import random
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+
+
+class LoginThrottled(Throttled):
+    default_detail = '登录失败次数过多，请稍后再试'
+
+
+class LoginBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = '登录请求过多，请稍后再试'
+    default_code = 'login_busy'
+    wait = 1
+
+
+
+def client_ip(request):
+    """
+    The client address as recorded by our own proxies. LOGIN_CLIENT_IP_HEADER
+    lists addresses client first, each proxy appending the one it received
+    from, so only the entry LOGIN_TRUSTED_PROXY_HOPS from the right cannot
+    be forged by the client
+    """
+    value = request.META.get(settings.LOGIN_CLIENT_IP_HEADER) or request.META.get('REMOTE_ADDR') or ''
+    addresses = [address.strip() for address in value.split(',') if address.strip()]
+    if not addresses:
+        return ''
+    return addresses[max(len(addresses) - settings.LOGIN_TRUSTED_PROXY_HOPS, 0)]
+
+
+def _account(email):
+    return email.strip().lower()
+
+
+def _source_key(email, ip):
+    return f'login:failures:source:{_account(email)}:{ip}'
+
+
+def _account_key(email):
+    return f'login:failures:account:{_account(email)}'
+
+
+def _ip_key(ip):
+    return f'login:failures:ip:{ip}'
+
+
+def check_limits(email, ip):
+    """Raise LoginThrottled when the account from this IP, the account or the IP is out of failed attempts"""
+    limits = {
+        _source_key(email, ip): settings.LOGIN_MAX_ACCOUNT_FAILURES,
+        _account_key(email): settings.LOGIN_MAX_ACCOUNT_TOTAL_FAILURES,
+        _ip_key(ip): settings.LOGIN_MAX_IP_FAILURES,
+    }
+    counts = cache.get_many(list(limits))
+    if any(counts.get(key, 0) >= limit for key, limit in limits.items()):
+        raise LoginThrottled(wait=settings.LOGIN_FAILURE_WINDOW)
+
+
+def record_failure(email, ip):
+    for key in (_source_key(email, ip), _account_key(email), _ip_key(ip)):
+        # The window starts at the first failure
+        cache.add(key, 0, timeout=settings.LOGIN_FAILURE_WINDOW)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=settings.LOGIN_FAILURE_WINDOW)
+
+
+def clear_failures(email, ip):
+    cache.delete_many([_source_key(email, ip), _account_key(email)])
+
+
+def _slot_key(slot):
+    return f'login:hash-slot:{slot}'
+
+
+def _take_slot(token):
+    slots = list(range(settings.LOGIN_HASH_CONCURRENCY))
+    # Spread attempts over the slots instead of all racing for the first
+    random.shuffle(slots)
+    for slot in slots:
+        key = _slot_key(slot)
+        if cache.add(key, token, timeout=settings.LOGIN_HASH_SLOT_TTL):
+            return key
+    return None
+
+
+@contextmanager
+def hashing_slot():
+    """Hold one of the LOGIN_HASH_CONCURRENCY hashing slots shared by all workers, or raise LoginBusy"""
+    token = uuid.uuid4().hex
+    key = _take_slot(token)
+    if key is None:
+        # Waiting here would hold the worker, which is what the gate protects
+        raise LoginBusy()
+    try:
+        yield
+    finally:
+        # Only free the slot if it has not expired and gone to someone else
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def attempt_login(request, email, password):
+    """The user for email/password, or None; raises LoginThrottled or LoginBusy"""
+    ip = client_ip(request)
+    check_limits(email, ip)
+    with hashing_slot():
+        user = authenticate(username=email, password=password)
+    if user is None:
+        record_failure(email, ip)
+        return None
+    clear_failures(email, ip)
+    return user
@@ -0,0 +1,205 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users import login
+
+User = get_user_model()
+
+PASSWORD = 'benchmark-login-password'
+EMAIL = 'benchmark-login-{}@example.invalid'
+SERVER_START_TIMEOUT = 30
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port, method, path, body=None, headers=None):
+    """One request on a fresh connection; returns the response status"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure logins/sec and the latency of another endpoint during a login storm, once '
+        'without the storm and then once per hashing gate size. Each phase starts gunicorn '
+        '(casho.wsgi) with --workers sync workers, as in production, and sends the logins and '
+        'the probe requests to that same worker pool over HTTP. Creates temporary users in '
+        'the configured database and deletes them afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per phase')
+        parser.add_argument('--workers', type=int, default=4, help='Gunicorn sync workers serving both')
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent clients posting logins')
+        parser.add_argument('--probe-clients', type=int, default=1, help='Concurrent clients requesting --probe-path')
+        parser.add_argument('--probe-path', default='/api/profile/', help='Authenticated GET endpoint to time')
+        parser.add_argument('--users', type=int, default=20, help='Accounts the storm logs in to')
+        parser.add_argument('--iterations', type=int, help='PBKDF2 iterations (default PASSWORD_HASH_ITERATIONS)')
+        parser.add_argument('--hash-concurrency', default=str(settings.LOGIN_HASH_CONCURRENCY),
+                            help='Comma-separated LOGIN_HASH_CONCURRENCY values, one storm each')
+
+    def handle(self, *args, duration, workers, clients, probe_clients, probe_path, users, iterations=None,
+               hash_concurrency, **options):
+        iterations = iterations or settings.PASSWORD_HASH_ITERATIONS
+        try:
+            gate_sizes = [int(size) for size in hash_concurrency.split(',')]
+        except ValueError:
+            raise CommandError('--hash-concurrency must be comma-separated integers')
+        if min(gate_sizes) < 1 or min(users, workers, clients, probe_clients) < 1:
+            raise CommandError(
+                '--hash-concurrency, --users, --workers, --clients and --probe-clients must be at least 1'
+            )
+        if 'locmem' in settings.CACHES['default']['BACKEND'].lower():
+            raise CommandError('The hashing gate needs a cache shared between processes (e.g. Redis)')
+
+        with override_settings(PASSWORD_HASH_ITERATIONS=iterations):
+            accounts = self.create_users(users)
+        try:
+            token = str(RefreshToken.for_user(accounts[0]).access_token)
+            self.stdout.write(
+                f"{'phase':<14} {'logins/s':>9} {'busy':>6} {'probes':>7} {'p50 ms':>8} {'p99 ms':>8}"
+            )
+            common = dict(duration=duration, workers=workers, probe_clients=probe_clients,
+                          probe_path=probe_path, users=users, iterations=iterations, token=token)
+            self.run_phase('baseline', clients=0, size=gate_sizes[0], **common)
+            for size in gate_sizes:
+                self.run_phase(f'storm gate={size}', clients=clients, size=size, **common)
+        finally:
+            OutstandingToken.objects.filter(user__in=accounts).delete()
+            User.objects.filter(pk__in=[account.pk for account in accounts]).delete()
+
+    def create_users(self, count):
+        return [
+            User.objects.create_user(username=f'benchmark-login-{i}', email=EMAIL.format(i), password=PASSWORD)
+            for i in range(count)
+        ]
+
+    def start_server(self, workers, iterations, size):
+        port = free_port()
+        # Settings are read from the environment (python-decouple)
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE,
+            'ALLOWED_HOSTS': ','.join([*settings.ALLOWED_HOSTS, '127.0.0.1']),
+            'PASSWORD_HASH_ITERATIONS': str(iterations),
+            'LOGIN_HASH_CONCURRENCY': str(size),
+            # Every storm login succeeds; keep the limiter out of the measurement
+            'LOGIN_MAX_ACCOUNT_FAILURES': str(10 ** 9),
+            'LOGIN_MAX_ACCOUNT_TOTAL_FAILURES': str(10 ** 9),
+            'LOGIN_MAX_IP_FAILURES': str(10 ** 9),
+        }
+        # A file rather than a pipe: nobody reads gunicorn's log while the phase runs
+        log = tempfile.TemporaryFile(mode='w+')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'casho.wsgi:application', '--bind', f'127.0.0.1:{port}',
+             '--workers', str(workers), '--worker-class', 'sync'],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log,
+        )
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                log.seek(0)
+                raise CommandError(f'gunicorn failed to start:\n{log.read()}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                log.close()
+                return server, port
+            except OSError:
+                time.sleep(0.1)
+        server.kill()
+        log.close()
+        raise CommandError(f'gunicorn did not listen on port {port} within {SERVER_START_TIMEOUT}s')
+
+    def run_phase(self, name, duration, workers, clients, probe_clients, probe_path, users, iterations, token,
+                  size):
+        # Slots a previous phase's server was killed holding would shrink this gate
+        cache.delete_many([login._slot_key(slot) for slot in range(max(size, settings.LOGIN_HASH_CONCURRENCY))])
+        server, port = self.start_server(workers, iterations, size)
+        statuses = Counter()
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def storm(offset):
+            seen = Counter()
+            i = offset
+            try:
+                while time.monotonic() < deadline:
+                    body = json.dumps({'email': EMAIL.format(i % users), 'password': PASSWORD})
+                    seen[request(port, 'POST', '/api/login/', body, {'Content-Type': 'application/json'})] += 1
+                    i += 1
+            except OSError as exc:
+                with lock:
+                    errors.append(f'Login request failed: {exc}')
+            with lock:
+                statuses.update(seen)
+
+        def probe():
+            timings = []
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = request(port, 'GET', probe_path, headers={'Authorization': f'Bearer {token}'})
+                except OSError as exc:
+                    status = exc
+                timings.append(time.perf_counter() - started)
+                if status != 200:
+                    with lock:
+                        errors.append(f'{probe_path} answered {status}')
+                    return
+            with lock:
+                latencies.extend(timings)
+
+        threads = [threading.Thread(target=storm, args=(i,)) for i in range(clients)]
+        threads += [threading.Thread(target=probe) for _ in range(probe_clients)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            server.terminate()
+            server.wait()
+
+        if errors:
+            raise CommandError(errors[0])
+        if set(statuses) - {200, 503}:
+            raise CommandError(f'Unexpected login responses: {dict(statuses)}')
+        self.stdout.write(
+            f'{name:<14} {statuses[200] / duration:>9.1f} {statuses[503]:>6} {len(latencies):>7} '
+            f'{percentile(latencies, 0.5) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}'
+        )
@@ -18,5 +18,14 @@ class User(AbstractUser):
         verbose_name = 'User'
         verbose_name_plural = 'Users'
 
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # Users resolved from the authentication cache arrive with most fields
+        # deferred: the first access to one loads all of them in one query
+        if fields is not None:
+            deferred = self.get_deferred_fields()
+            if deferred.intersection(fields):
+                fields = deferred.union(fields)
+        super().refresh_from_db(using, fields, **kwargs)
+
     def __str__(self):
         return self.email 
\ No newline at end of file
@@ -1,8 +1,12 @@
 import graphene
+import graphql_jwt
 from graphene_django import DjangoObjectType
-from django.contrib.auth import authenticate
+from graphql_jwt.exceptions import JSONWebTokenError
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from casho.query_cost import list_size
+
+from .login import attempt_login, check_limits, clear_failures, client_ip, hashing_slot, record_failure
 from .models import User
 
 
@@ -62,7 +66,7 @@ class Login(graphene.Mutation):
     Output = AuthPayload
 
     def mutate(self, info, input):
-        user = authenticate(username=input.email, password=input.password)
+        user = attempt_login(info.context, input.email, input.password)
         if not user:
             raise Exception("Invalid email or password")
         
@@ -75,6 +79,24 @@ class Login(graphene.Mutation):
         )
 
 
+class ObtainJSONWebToken(graphql_jwt.ObtainJSONWebToken):
+    """tokenAuth through the same attempt limiter and hashing gate as every other login"""
+
+    @classmethod
+    def mutate(cls, root, info, **kwargs):
+        email = kwargs.get(User.USERNAME_FIELD, '')
+        ip = client_ip(info.context)
+        check_limits(email, ip)
+        with hashing_slot():
+            try:
+                result = super().mutate(root, info, **kwargs)
+            except JSONWebTokenError:
+                record_failure(email, ip)
+                raise
+        clear_failures(email, ip)
+        return result
+
+
 class Query(graphene.ObjectType):
     me = graphene.Field(UserType)
     users = graphene.List(UserType)
@@ -86,7 +108,13 @@ class Query(graphene.ObjectType):
         return None
 
     def resolve_users(self, info):
-        return User.objects.all()
+        user = info.context.user
+        if not user.is_authenticated:
+            return User.objects.none()
+        users = User.objects.order_by('pk')
+        if not user.is_staff:
+            users = users.filter(pk=user.pk)
+        return users[:list_size('Query.users')]
 
 
 class Mutation(graphene.ObjectType):
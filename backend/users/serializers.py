@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from django.contrib.auth import authenticate
+from .login import attempt_login
 from .models import User
 
 
@@ -41,7 +41,7 @@ class LoginSerializer(serializers.Serializer):
         password = attrs.get('password')
 
         if email and password:
-            user = authenticate(username=email, password=password)
+            user = attempt_login(self.context['request'], email, password)
             if not user:
                 raise serializers.ValidationError('邮箱或密码错误')
             attrs['user'] = user
@@ -1,7 +1,18 @@
+from unittest import mock
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, override_settings
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from casho.schema import schema
+
+from . import authentication, login
 
 User = get_user_model()
 
@@ -50,4 +61,241 @@ class UserAPITest(TestCase):
         }
         response = self.client.post('/api/users/login/', login_data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('access_token', response.data) 
\ No newline at end of file
+        self.assertIn('access_token', response.data)
+
+
+class CachedUserAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        authentication.clear_local_cache()
+        self.user = User.objects.create_user(username='cached', email='cached@example.com', password='testpass123')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+    def authenticate(self):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+        return authentication.CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_user_resolved_without_query_once_cached(self):
+        self.assertEqual(self.client.get('/api/profile/').status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.pk, user.email, user.is_active), (self.user.pk, 'cached@example.com', True))
+
+        # Another process: local tier empty, served from the shared cache
+        authentication.clear_local_cache()
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_rest_of_row_loaded_lazily_in_one_query(self):
+        self.authenticate()
+        user = self.authenticate()
+        with self.assertNumQueries(1):
+            self.assertEqual((user.username, user.phone), ('cached', None))
+            self.assertTrue(user.check_password('testpass123'))
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/profile/')
+        self.assertEqual(response.data['username'], 'cached')
+
+    def test_password_hash_not_cached(self):
+        self.authenticate()
+        entry = cache.get(f'auth:user:{self.user.pk}')
+        self.assertNotIn('password', entry)
+        self.assertNotIn(self.user.password, map(str, entry.values()))
+
+    @mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True)
+    def test_password_change_revokes_tokens(self):
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+        self.assertEqual(self.client.get('/api/profile/').status_code, status.HTTP_200_OK)
+
+        self.user.set_password('changed-password')
+        self.user.save()
+        self.assertEqual(self.client.get('/api/profile/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_save_and_deactivation_invalidate(self):
+        self.client.get('/api/profile/')
+        self.user.phone = '123456'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/profile/').data['phone'], '123456')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/profile/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_profile_update_does_not_leak_into_cache(self):
+        self.client.get('/api/profile/')
+        cached = authentication.get_cached_user(self.user.pk)
+        cached.phone = 'unsaved'
+        self.assertIsNone(authentication.get_cached_user(self.user.pk).phone)
+
+        self.client.patch('/api/profile/', {'phone': '654321'})
+        self.assertEqual(authentication.get_cached_user(self.user.pk).phone, '654321')
+
+    def test_logout_blacklists_and_evicts(self):
+        self.client.get('/api/profile/')
+        self.assertIsNotNone(cache.get(f'auth:user:{self.user.pk}'))
+        response = self.client.post('/api/logout/', {'refresh_token': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(cache.get(f'auth:user:{self.user.pk}'))
+        self.assertIsNone(authentication._local_get(f'auth:user:{self.user.pk}'))
+
+    def test_natural_key_lookup_follows_email_change(self):
+        user = authentication.get_cached_user_by_natural_key('cached@example.com')
+        self.assertEqual(user.pk, self.user.pk)
+        with self.assertNumQueries(0):
+            authentication.get_cached_user_by_natural_key('cached@example.com')
+
+        self.user.email = 'renamed@example.com'
+        self.user.save()
+        self.assertIsNone(authentication.get_cached_user_by_natural_key('cached@example.com'))
+        self.assertEqual(authentication.get_cached_user_by_natural_key('renamed@example.com').pk, self.user.pk)
+
+
+class UsersQueryTest(TestCase):
+    QUERY = '{ users { email } }'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='member', email='member@example.com', password='x')
+        User.objects.create_user(username='other', email='other@example.com', password='x')
+
+    def run_query(self, user):
+        request = RequestFactory().post('/graphql/')
+        request.user = user
+        result = schema.execute(self.QUERY, context_value=request)
+        self.assertIsNone(result.errors)
+        return [row['email'] for row in result.data['users']]
+
+    def test_users_scoped_to_requester(self):
+        self.assertEqual(self.run_query(self.user), ['member@example.com'])
+        self.assertEqual(self.run_query(AnonymousUser()), [])
+
+    @override_settings(GRAPHQL_QUERY_COST={'LIST_SIZES': {'Query.users': 1}})
+    def test_staff_list_bounded_by_cost_model(self):
+        self.user.is_staff = True
+        self.assertEqual(len(self.run_query(self.user)), 1)
+
+
+@override_settings(
+    PASSWORD_HASH_ITERATIONS=1000, LOGIN_MAX_ACCOUNT_FAILURES=3, LOGIN_MAX_ACCOUNT_TOTAL_FAILURES=6,
+    LOGIN_MAX_IP_FAILURES=5,
+)
+class LoginPipelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='login', email='login@example.com', password='testpass123')
+
+    def post_login(self, email='login@example.com', password='testpass123', **extra):
+        return self.client.post('/api/login/', {'email': email, 'password': password}, **extra)
+
+    def test_login_returns_tokens(self):
+        response = self.post_login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+
+    def test_password_rehashed_when_cost_changes(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(self.post_login().status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(self.user.check_password('testpass123'))
+
+    def test_account_locked_out_before_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.post_login(password='wrong').status_code, status.HTTP_400_BAD_REQUEST)
+        with self.assertNumQueries(0):
+            response = self.post_login()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+    def test_success_resets_account_failures(self):
+        for _ in range(2):
+            self.post_login(password='wrong')
+        self.assertEqual(self.post_login().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.post_login(password='wrong').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post_login().status_code, status.HTTP_200_OK)
+
+    def test_ip_limited_across_accounts(self):
+        for i in range(5):
+            self.post_login(email=f'nobody{i}@example.com', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(self.post_login(REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.post_login(REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_200_OK)
+
+    def test_guessing_from_one_ip_does_not_lock_out_the_owner(self):
+        for _ in range(3):
+            self.post_login(password='wrong', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(self.post_login(REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.post_login(REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_200_OK)
+
+        # Guessing spread over many addresses still hits the per-account limit
+        for i in range(6):
+            self.post_login(password='wrong', REMOTE_ADDR=f'10.0.1.{i}')
+        self.assertEqual(self.post_login(REMOTE_ADDR='10.0.0.3').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(LOGIN_CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR', LOGIN_TRUSTED_PROXY_HOPS=1)
+    def test_client_ip_from_trusted_proxy_hop(self):
+        # The client controls everything left of what our proxy appended
+        for i in range(5):
+            self.post_login(email=f'nobody{i}@example.com', HTTP_X_FORWARDED_FOR=f'1.1.1.{i}, 10.0.0.1')
+        response = self.post_login(HTTP_X_FORWARDED_FOR='2.2.2.2, 10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.post_login(HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, status.HTTP_200_OK)
+
+    @override_settings(LOGIN_HASH_CONCURRENCY=1)
+    def test_busy_when_hashing_slots_taken(self):
+        with login.hashing_slot(), mock.patch('time.sleep') as sleep:
+            response = self.post_login()
+        # Turned away at once, without waiting in the worker for a slot
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        sleep.assert_not_called()
+        self.assertEqual(self.post_login().status_code, status.HTTP_200_OK)
+
+    @override_settings(LOGIN_HASH_CONCURRENCY=2)
+    def test_hashing_slots_shared_through_cache(self):
+        # Slots held by other worker processes
+        cache.set(login._slot_key(0), 'worker-1')
+        cache.set(login._slot_key(1), 'worker-2')
+        self.assertEqual(self.post_login().status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        # As when a slot held by a dead worker expires
+        cache.delete(login._slot_key(1))
+        self.assertEqual(self.post_login().status_code, status.HTTP_200_OK)
+        self.assertEqual(cache.get(login._slot_key(0)), 'worker-1')
+        self.assertIsNone(cache.get(login._slot_key(1)))
+
+    def test_graphql_login_limited(self):
+        mutation = 'mutation($input: LoginInput!) { login(input: $input) { accessToken } }'
+        variables = {'input': {'email': 'login@example.com', 'password': 'wrong'}}
+        for _ in range(3):
+            result = schema.execute(mutation, variables=variables, context_value=RequestFactory().post('/graphql/'))
+            self.assertEqual(result.errors[0].message, 'Invalid email or password')
+        variables['input']['password'] = 'testpass123'
+        result = schema.execute(mutation, variables=variables, context_value=RequestFactory().post('/graphql/'))
+        self.assertIsNone(result.data['login'])
+        self.assertIn('登录失败次数过多', result.errors[0].message)
+
+    def test_graphql_token_auth_limited_before_hashing(self):
+        mutation = 'mutation($email: String!, $password: String!) { tokenAuth(email: $email, password: $password) { token } }'
+
+        def token_auth(password, **extra):
+            request = RequestFactory().post('/graphql/', **extra)
+            return schema.execute(mutation, variables={'email': 'login@example.com', 'password': password}, context_value=request)
+
+        self.assertIsNone(token_auth('testpass123').errors)
+        for _ in range(3):
+            self.assertEqual(token_auth('wrong').errors[0].message, 'Please enter valid credentials')
+        with mock.patch('graphql_jwt.decorators.authenticate') as authenticate, self.assertNumQueries(0):
+            result = token_auth('testpass123')
+        authenticate.assert_not_called()
+        self.assertIn('登录失败次数过多', result.errors[0].message)
+
+        # A locked-out IP, whichever login path it used
+        for i in range(5):
+            self.post_login(email=f'nobody{i}@example.com', REMOTE_ADDR='10.0.0.1')
+        with mock.patch('graphql_jwt.decorators.authenticate') as authenticate:
+            result = token_auth('testpass123', REMOTE_ADDR='10.0.0.1')
+        authenticate.assert_not_called()
+        self.assertIn('登录失败次数过多', result.errors[0].message)
@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 
+from .authentication import invalidate_user
 from .serializers import UserSerializer, RegisterSerializer, LoginSerializer
 from .models import User
 
@@ -41,7 +42,12 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
 
     def get_object(self):
-        return self.request.user
+        user = self.request.user
+        # Load what the authentication cache left deferred, so an update saves every field
+        deferred = user.get_deferred_fields()
+        if deferred:
+            user.refresh_from_db(fields=deferred)
+        return user
 
 
 @api_view(['POST'])
@@ -52,6 +58,7 @@ def logout(request):
         refresh_token = request.data.get('refresh_token')
         token = RefreshToken(refresh_token)
         token.blacklist()
+        invalidate_user(request.user)
         return Response({"message": "Logout successful"}, status=status.HTTP_200_OK)
     except Exception:
         return Response({"message": "Logout failed"}, status=status.HTTP_400_BAD_REQUEST) 
\ No newline at end of file